@@ -0,0 +1,7 @@
+"""
+Benchmarks for clarent.
+
+Run them as modules, e.g. ``python -m benchmarks.certificate``. Each
+benchmark module writes its results as JSON, so they can be compared
+across releases.
+"""
@@ -0,0 +1,117 @@
+"""
+Shared tools for timing things and reporting the results.
+"""
+import json
+import platform
+import sys
+
+from clarent import __version__
+from OpenSSL import SSL
+from time import time
+from twisted import version as twistedVersion
+from twisted.python import usage
+
+
+def measure(f, repeat, _time=time):
+    """Call ``f`` ``repeat`` times, and return how long each call took, in
+    seconds.
+
+    """
+    durations = []
+    for _ in xrange(repeat):
+        start = _time()
+        f()
+        durations.append(_time() - start)
+    return durations
+
+
+
+def result(name, params, durations, operations=1):
+    """Summarize the durations of a benchmark.
+
+    ``operations`` is the number of operations each duration covers,
+    for computing throughput.
+
+    """
+    total = sum(durations)
+    return {
+        "name": name,
+        "params": params,
+        "operations": operations,
+        "seconds": durations,
+        "mean": total / len(durations),
+        "min": min(durations),
+        "max": max(durations),
+        "opsPerSecond": operations * len(durations) / total if total else None
+    }
+
+
+
+def environment():
+    """Describe the environment the benchmarks ran in.
+
+    """
+    return {
+        "clarent": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "twisted": twistedVersion.short(),
+        "openssl": SSL.SSLeay_version(SSL.SSLEAY_VERSION),
+    }
+
+
+
+class Options(usage.Options):
+    optParameters = [
+        ["output", "o", "-", "File to write the JSON results to "
+         "(default: stdout)."],
+        ["scale", "s", 1.0, "Multiply the number of repetitions of every "
+         "benchmark by this factor.", float]
+    ]
+
+    optFlags = [
+        ["quiet", "q", "Don't report progress on stderr."]
+    ]
+
+
+
+def run(benchmarks, argv=None, _stdout=sys.stdout, _stderr=sys.stderr):
+    """Run benchmarks, and write their results as JSON.
+
+    ``benchmarks`` is a callable that takes a function to scale
+    repetition counts by, and returns an iterable of results. Results
+    of benchmarks that couldn't run have an ``error`` instead of
+    durations.
+
+    """
+    options = Options()
+    try:
+        options.parseOptions(sys.argv[1:] if argv is None else argv)
+    except usage.UsageError as e:
+        _stderr.write("{0}\n{1}\n".format(options, e))
+        return 2
+
+    def scaled(repeat):
+        return max(1, int(round(repeat * options["scale"])))
+
+    results = []
+    for r in benchmarks(scaled):
+        if not options["quiet"]:
+            if "error" in r:
+                summary = r["error"]
+            else:
+                summary = "{0:.6f}s/op".format(r["mean"] / r["operations"])
+            _stderr.write("{0} {1}: {2}\n".format(
+                r["name"], json.dumps(r["params"], sort_keys=True), summary))
+        results.append(r)
+
+    report = {"environment": environment(), "results": results}
+    if options["output"] == "-":
+        json.dump(report, _stdout, indent=2, sort_keys=True)
+        _stdout.write("\n")
+    else:
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return 0
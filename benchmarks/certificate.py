@@ -0,0 +1,219 @@
+"""
+Benchmarks for making credentials, loading them, and doing TLS
+handshakes with them.
+
+Usage: python -m benchmarks.certificate [options]
+"""
+import shutil
+import sys
+import tempfile
+
+from benchmarks._common import measure, result, run
+from clarent import certificate
+from itertools import count
+from OpenSSL import SSL
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+from twisted.python.filepath import FilePath
+
+
+REPEATS = {
+    certificate.RSA: 3,
+    certificate.ECDSA: 100
+}
+
+
+def keyBenchmarks(scaled):
+    """Key generation and certificate signing, for every key type.
+
+    """
+    for keyType in certificate.keyTypes:
+        repeat = scaled(REPEATS[keyType])
+        params = {"keyType": keyType}
+
+        durations = measure(lambda: certificate._generateKey(keyType), repeat)
+        yield result("generateKey", params, durations)
+
+        key = certificate._generateKey(keyType)
+        makeCertificate = lambda: certificate._makeCertificate(
+            key, u"bench@example.test")
+        yield result("makeCertificate", params,
+                     measure(makeCertificate, scaled(100)))
+
+
+
+def credentialsBenchmarks(scaled, root):
+    """Making credentials end to end, and loading them again, for every
+    key type.
+
+    """
+    counter = count()
+    for keyType in certificate.keyTypes:
+        params = {"keyType": keyType}
+
+        def makeCredentials():
+            path = root.child("{0}-{1}".format(keyType, next(counter)))
+            path.makedirs()
+            certificate.makeCredentials(path, u"bench@example.test",
+                                        keyType=keyType)
+
+        durations = measure(makeCredentials, scaled(REPEATS[keyType]))
+        yield result("makeCredentials", params, durations)
+
+        path = _credentials(root, keyType)
+
+        def load():
+            certificate.clearContextFactoryCache()
+            certificate.getContextFactory(path)
+
+        yield result("getContextFactory", params, measure(load, scaled(100)))
+
+        certificate.getContextFactory(path)
+        cached = lambda: certificate.getContextFactory(path)
+        yield result("getContextFactoryCached", params,
+                     measure(cached, scaled(1000)))
+
+
+
+RESUMPTION = {
+    "none": None,
+    "sessionCache": dict(tickets=False),
+    "tickets": dict(tickets=True),
+}
+
+
+def handshakeBenchmarks(scaled, root):
+    """Loopback handshake throughput, for every key type, resumption
+    setting and ciphersuite.
+
+    ``None`` as a cipher means whatever the peers negotiate by
+    default (which may be TLS 1.3). Otherwise, the server only allows
+    that ciphersuite, and TLS 1.3 is disabled.
+
+    """
+    for keyType in certificate.keyTypes:
+        path = _credentials(root, keyType)
+        for cipher in [None] + _ciphersFor(keyType):
+            for resumption, settings in sorted(RESUMPTION.items()):
+                params = {
+                    "keyType": keyType,
+                    "cipher": cipher,
+                    "resumption": resumption
+                }
+
+                client, server = _factories(path, settings, cipher)
+                number = scaled(20)
+                durations = measure(
+                    lambda: [_handshake(client, server) for _ in xrange(number)],
+                    3)
+                r = result("handshake", params, durations, number)
+                r["resumptionRate"] = client.metrics.resumptionRate
+                yield r
+
+
+
+def _credentials(root, keyType):
+    """Get a path with credentials of the given key type, making them if
+    necessary.
+
+    """
+    path = root.child(keyType)
+    if not path.exists():
+        path.makedirs()
+        certificate.makeCredentials(path, u"bench@example.test",
+                                    keyType=keyType)
+    return path
+
+
+
+def _ciphersFor(keyType):
+    """The ECDHE ciphersuites from the secure ciphersuites that work with
+    the given key type.
+
+    DHE suites are left out, since the context factories don't have DH
+    parameters.
+
+    """
+    prefix = "ECDHE-RSA-" if keyType == certificate.RSA else "ECDHE-ECDSA-"
+    return [suite for suite in certificate.ciphersuites.split(":")
+            if suite.startswith(prefix)]
+
+
+
+def _factories(path, settings, cipher):
+    """Make a client and a server context factory for a handshake
+    benchmark.
+
+    """
+    if settings is not None:
+        settings = certificate.SessionResumption(**settings)
+
+    certificate.clearContextFactoryCache()
+    client = certificate.getContextFactory(
+        path, settings, certificate.ContextMetrics())
+
+    certificate.clearContextFactoryCache()
+    server = certificate.getContextFactory(path, settings)
+    server.cacheContext = True
+    if cipher is not None:
+        ctx = server.getContext()
+        ctx.set_cipher_list(cipher)
+        ctx.set_options(getattr(SSL, "OP_NO_TLSv1_3", 0x20000000))
+
+    return client, server
+
+
+
+def _handshake(clientFactory, serverFactory):
+    """Do a TLS handshake in memory, and shut both ends down cleanly.
+
+    """
+    server = SSL.Connection(serverFactory.getContext(), None)
+    server.set_accept_state()
+
+    if IOpenSSLClientConnectionCreator.providedBy(clientFactory):
+        client = clientFactory.clientConnectionForTLS(None)
+    else:
+        client = SSL.Connection(clientFactory.getContext(), None)
+    client.set_connect_state()
+
+    def pump():
+        for _ in range(10):
+            for source, destination in [(client, server), (server, client)]:
+                try:
+                    destination.bio_write(source.bio_read(2 ** 16))
+                except SSL.WantReadError:
+                    pass
+
+            for connection in [client, server]:
+                try:
+                    connection.do_handshake()
+                except SSL.WantReadError:
+                    pass
+
+    pump()
+    # Get a byte across, so TLS 1.3 session tickets arrive.
+    server.send(b"x")
+    pump()
+    client.recv(1)
+    client.shutdown()
+    server.shutdown()
+
+
+
+def benchmarks(scaled):
+    root = FilePath(tempfile.mkdtemp())
+    try:
+        for benchmark in [keyBenchmarks]:
+            for r in benchmark(scaled):
+                yield r
+
+        for benchmark in [credentialsBenchmarks, handshakeBenchmarks]:
+            for r in benchmark(scaled, root):
+                yield r
+    finally:
+        shutil.rmtree(root.path)
+
+
+
+if __name__ == "__main__":
+    sys.exit(run(benchmarks))
@@ -0,0 +1,276 @@
+"""
+Benchmarks for serializing exercise commands, and for sending them
+over in-memory AMP connections.
+
+Usage: python -m benchmarks.exercise [options]
+"""
+import sys
+
+from benchmarks._common import measure, result, run
+from clarent import exercise
+from twisted.protocols import amp
+from twisted.python.failure import Failure
+from twisted.test.iosim import FakeTransport, connect
+
+
+CATALOG_SIZES = [10, 100, 1000, 10000]
+DESCRIPTION_SIZES = [100, 1000, 10000, 100000]
+CLIENT_COUNTS = [1, 10, 100]
+
+TOO_LONG = "response doesn't fit in an AMP box"
+
+
+def makeCatalog(size, descriptionSize=100):
+    """Make a catalog of exercises, as a list of dicts with everything
+    the commands being benchmarked need.
+
+    """
+    sentence = u"Lorem ipsum dolor sit amet. "
+    description = sentence * (descriptionSize // len(sentence) + 1)
+    description = description[:descriptionSize]
+    return [{
+        b"identifier": b"exercise-{0:06d}".format(i),
+        b"title": u"Exercise {0}".format(i),
+        b"description": description,
+        b"solved": i % 2 == 0
+    } for i in xrange(size)]
+
+
+
+def _getExercisesResponse(catalog):
+    exercises = [{b"identifier": e[b"identifier"], b"title": e[b"title"]}
+                 for e in catalog]
+    return {b"exercises": exercises}
+
+
+
+def _getExerciseDetailsResponse(catalog):
+    e = catalog[0]
+    return {
+        b"title": e[b"title"],
+        b"description": e[b"description"],
+        b"solved": e[b"solved"]
+    }
+
+
+
+def _notifySolvedArguments(catalog):
+    e = catalog[0]
+    return {b"identifier": e[b"identifier"], b"title": e[b"title"]}
+
+
+
+def _fits(command, response):
+    """Check if a response to a command fits in an AMP box.
+
+    """
+    try:
+        command.makeResponse(dict(response), None).serialize()
+    except amp.TooLong:
+        return False
+    return True
+
+
+
+def _failed(name, params, error):
+    """Make the result of a benchmark that couldn't run.
+
+    """
+    return {"name": name, "params": params, "error": error}
+
+
+
+def _serializationBenchmark(name, params, make, parse, objects, repeat):
+    """Measure serializing some objects to bytes, and parsing them back.
+
+    If they don't fit in an AMP box, the result has the error instead
+    of durations.
+
+    """
+    try:
+        data = make(dict(objects)).serialize()
+    except amp.TooLong as e:
+        return [_failed(name, params, repr(e))]
+
+    def encode():
+        make(dict(objects)).serialize()
+
+    def decode():
+        parse(amp.parseString(data)[0])
+
+    encoded = result(name + ".encode", params, measure(encode, repeat))
+    decoded = result(name + ".decode", params, measure(decode, repeat))
+    for r in encoded, decoded:
+        r["bytes"] = len(data)
+    return [encoded, decoded]
+
+
+
+def serializationBenchmarks(scaled):
+    """Encoding and decoding every command, as catalogs and descriptions
+    grow.
+
+    """
+    for size in CATALOG_SIZES:
+        params = {"catalogSize": size}
+        repeat = scaled(max(1, 10000 // size))
+        command = exercise.GetExercises
+        for r in _serializationBenchmark(
+                "GetExercises.response", params,
+                lambda o: command.makeResponse(o, None),
+                lambda b: command.parseResponse(b, None),
+                _getExercisesResponse(makeCatalog(size)), repeat):
+            yield r
+
+    for size in DESCRIPTION_SIZES:
+        params = {"descriptionSize": size}
+        repeat = scaled(max(1, 1000000 // size))
+        command = exercise.GetExerciseDetails
+        for r in _serializationBenchmark(
+                "GetExerciseDetails.response", params,
+                lambda o: command.makeResponse(o, None),
+                lambda b: command.parseResponse(b, None),
+                _getExerciseDetailsResponse(makeCatalog(1, size)), repeat):
+            yield r
+
+    command = exercise.NotifySolved
+    for r in _serializationBenchmark(
+            "NotifySolved.arguments", {},
+            lambda o: command.makeArguments(o, None),
+            lambda b: command.parseArguments(b, None),
+            _notifySolvedArguments(makeCatalog(1)), scaled(10000)):
+        yield r
+
+
+
+class Server(amp.AMP):
+    """A stand-in for an exercise server, serving a fixed catalog.
+
+    """
+    def __init__(self, catalog):
+        amp.AMP.__init__(self)
+        self.catalog = catalog
+        self._byIdentifier = dict((e[b"identifier"], e) for e in catalog)
+
+
+    @exercise.GetExercises.responder
+    def getExercises(self, solved):
+        catalog = [e for e in self.catalog if e[b"solved"] == solved]
+        return _getExercisesResponse(catalog)
+
+
+    @exercise.GetExerciseDetails.responder
+    def getExerciseDetails(self, identifier):
+        return _getExerciseDetailsResponse([self._byIdentifier[identifier]])
+
+
+
+class Client(amp.AMP):
+    """A stand-in for an exercise client, counting notifications.
+
+    """
+    notifications = 0
+
+    @exercise.NotifySolved.responder
+    def notifySolved(self, identifier, title):
+        self.notifications += 1
+        return {}
+
+
+
+def _connect(catalog, clients):
+    """Connect some clients to servers for the given catalog, in memory.
+
+    """
+    connections = []
+    for _ in xrange(clients):
+        server, client = Server(catalog), Client()
+        pump = connect(server, FakeTransport(server, True),
+                       client, FakeTransport(client, False))
+        connections.append((server, client, pump))
+    return connections
+
+
+
+def _callAll(connections, command, **kwargs):
+    """Have every client call the command, and wait for all responses.
+
+    """
+    responses = []
+    for _, client, _ in connections:
+        client.callRemote(command, **kwargs).addBoth(responses.append)
+    for _, _, pump in connections:
+        pump.flush()
+
+    if len(responses) != len(connections):
+        raise RuntimeError("missing responses to {0}".format(command))
+    for response in responses:
+        if isinstance(response, Failure):
+            response.raiseException()
+
+
+
+def roundTripBenchmarks(scaled):
+    """Round trips over in-memory connections, as catalogs, descriptions
+    and the number of concurrent clients grow.
+
+    """
+    for size in CATALOG_SIZES:
+        catalog = makeCatalog(size)
+        response = _getExercisesResponse(catalog)
+        for clients in CLIENT_COUNTS:
+            params = {"catalogSize": size, "clients": clients}
+            if not _fits(exercise.GetExercises, response):
+                yield _failed("GetExercises.roundTrip", params, TOO_LONG)
+                continue
+
+            connections = _connect(catalog, clients)
+            call = lambda: _callAll(connections, exercise.GetExercises,
+                                    solved=False)
+            durations = measure(call, scaled(max(1, 1000 // size)))
+            yield result("GetExercises.roundTrip", params, durations,
+                         operations=clients)
+
+    for size in DESCRIPTION_SIZES:
+        catalog = makeCatalog(1, size)
+        response = _getExerciseDetailsResponse(catalog)
+        identifier = catalog[0][b"identifier"]
+        for clients in CLIENT_COUNTS:
+            params = {"descriptionSize": size, "clients": clients}
+            if not _fits(exercise.GetExerciseDetails, response):
+                yield _failed("GetExerciseDetails.roundTrip", params,
+                              TOO_LONG)
+                continue
+
+            connections = _connect(catalog, clients)
+            call = lambda: _callAll(connections, exercise.GetExerciseDetails,
+                                    identifier=identifier)
+            durations = measure(call, scaled(max(1, 100000 // size)))
+            yield result("GetExerciseDetails.roundTrip", params, durations,
+                         operations=clients)
+
+    catalog = makeCatalog(1)
+    for clients in CLIENT_COUNTS:
+        connections = _connect(catalog, clients)
+
+        def notify():
+            for server, _, _ in connections:
+                server.callRemote(exercise.NotifySolved,
+                                  **_notifySolvedArguments(catalog))
+            for _, _, pump in connections:
+                pump.flush()
+
+        yield result("NotifySolved.fanOut", {"clients": clients},
+                     measure(notify, scaled(100)), operations=clients)
+
+
+
+def benchmarks(scaled):
+    for benchmark in [serializationBenchmarks, roundTripBenchmarks]:
+        for r in benchmark(scaled):
+            yield r
+
+
+
+if __name__ == "__main__":
+    sys.exit(run(benchmarks))
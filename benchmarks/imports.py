@@ -0,0 +1,75 @@
+"""
+Benchmarks for how long it takes to import clarent's modules in a
+fresh interpreter.
+
+Usage: python -m benchmarks.imports [options]
+"""
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks._common import result, run
+
+
+MODULES = [
+    "clarent",
+    "clarent.path",
+    "clarent.certificate",
+    "clarent.provision",
+    "clarent.arguments",
+    "clarent.exercise",
+    "clarent.cache",
+    "clarent.client",
+    "clarent.notification",
+    "clarent.solved",
+    "clarent.store"
+]
+
+SLOW = ["OpenSSL", "cryptography", "twisted.internet.ssl",
+        "twisted.internet.reactor"]
+"""Slow dependencies, which are reported if importing a module imports
+them.
+
+"""
+
+_SCRIPT = """
+import json, sys, time
+start = time.time()
+import {module}
+duration = time.time() - start
+slow = {slow!r}
+print(json.dumps([duration, [m for m in slow if m in sys.modules]]))
+"""
+
+
+def importModule(module):
+    """Import a module in a new interpreter, and return how long that
+    took, in seconds, along with which slow dependencies it imported.
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root, PYTHONDONTWRITEBYTECODE="1")
+    script = _SCRIPT.format(module=module, slow=SLOW)
+    command = [sys.executable, "-W", "ignore", "-c", script]
+    output = subprocess.check_output(command, env=env)
+    duration, imported = json.loads(output)
+    return duration, imported
+
+
+
+def benchmarks(scaled):
+    for module in MODULES:
+        durations, imported = [], []
+        for _ in xrange(scaled(10)):
+            duration, imported = importModule(module)
+            durations.append(duration)
+
+        r = result("import", {"module": module}, durations)
+        r["imported"] = imported
+        yield r
+
+
+
+if __name__ == "__main__":
+    sys.exit(run(benchmarks))
@@ -0,0 +1,177 @@
+"""
+Extra AMP argument types.
+"""
+import zlib
+from twisted.protocols import amp
+
+
+MAX_VALUE_LENGTH = 0xffff
+"""The maximum length of a single value in an AMP box.
+
+"""
+
+_pythonName = getattr(amp, "_wireNameToPythonIdentifier", lambda name: name)
+
+
+class CompressedUnicode(amp.Unicode):
+    """A Unicode argument, compressed with zlib when that makes it
+    smaller.
+
+    Values shorter than ``threshold`` bytes (UTF-8 encoded) aren't
+    compressed. Values that would decompress to more than
+    ``maxLength`` bytes are rejected.
+
+    Only use this for values that aren't secret. Compressing secrets
+    along with data an attacker can influence leaks them (as in the
+    CRIME and BREACH attacks), which is also why TLS compression is
+    disabled.
+
+    """
+    RAW = b"\x00"
+    ZLIB = b"\x01"
+
+    def __init__(self, optional=False, threshold=256, level=6,
+                 maxLength=16 * 1024 * 1024):
+        amp.Unicode.__init__(self, optional)
+        self.threshold = threshold
+        self.level = level
+        self.maxLength = maxLength
+
+
+    def toString(self, inObject):
+        encoded = inObject.encode("utf-8")
+        if len(encoded) >= self.threshold:
+            compressed = zlib.compress(encoded, self.level)
+            if len(compressed) < len(encoded):
+                return self.ZLIB + compressed
+
+        return self.RAW + encoded
+
+
+    def fromString(self, inString):
+        flag, payload = inString[:1], inString[1:]
+        if flag == self.ZLIB:
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(payload, self.maxLength)
+            if decompressor.unconsumed_tail:
+                raise ValueError("compressed value is too long")
+        elif flag != self.RAW:
+            raise ValueError("unknown compression flag: {0!r}".format(flag))
+
+        return payload.decode("utf-8")
+
+
+
+class Identifier(amp.String):
+    """A string argument for identifiers, such as exercise identifiers.
+
+    On the wire, this is the same as a string. Parsed identifiers are
+    interned, so the many copies of the same identifier that a client
+    or server receives share a single string, and compare faster.
+
+    """
+    def fromString(self, inString):
+        return intern(inString)
+
+
+
+class EncodedAmpList(amp.AmpList):
+    """An ``AmpList`` that can send rows that were serialized ahead of
+    time.
+
+    Servers that send the same rows over and over, such as the
+    exercises in a catalog, can serialize every row once with
+    ``encodeRow``, and send the rows it returns without serializing
+    them again: they're just joined together. Other rows are
+    serialized as usual. On the wire, and when parsing, this is the
+    same as an ``AmpList``.
+
+    """
+    def encodeRow(self, row, proto=None):
+        """Serialize a row ahead of time, and return it as an
+        ``EncodedRow``.
+
+        """
+        return EncodedRow(row, amp.AmpList.toStringProto(self, [row], proto))
+
+
+    def toStringProto(self, inObject, proto):
+        parts = []
+        for row in inObject:
+            if isinstance(row, EncodedRow):
+                parts.append(row.encoded)
+            else:
+                parts.append(amp.AmpList.toStringProto(self, [row], proto))
+        return b"".join(parts)
+
+
+
+class EncodedRow(dict):
+    """A row of an ``EncodedAmpList``, which remembers how it was
+    serialized.
+
+    It's a dict with the same items as the row it was made from, so
+    it can be used like any other row, but it mustn't be changed. It
+    should only be sent with the argument that made it.
+
+    """
+    def __init__(self, row, encoded):
+        dict.__init__(self, row)
+        self.encoded = encoded
+
+
+
+class Chunked(amp.Argument):
+    """An argument that wraps another argument, and splits its serialized
+    value across as many AMP values as it needs.
+
+    This gets around AMP's limit on the length of a single value. The
+    wrapped argument's value is serialized as usual, and then split
+    into chunks of at most ``chunkSize`` bytes, stored under the keys
+    ``name.0``, ``name.1``, and so on. The key ``name`` itself has the
+    number of chunks.
+
+    The whole box still has to fit in memory on both ends; this only
+    lifts the per-value limit.
+
+    """
+    def __init__(self, argument, chunkSize=MAX_VALUE_LENGTH, optional=False):
+        amp.Argument.__init__(self, optional)
+        self.argument = argument
+        self.chunkSize = chunkSize
+
+
+    def toBox(self, name, strings, objects, proto):
+        value = self.retrieve(objects, _pythonName(name), proto)
+        if self.optional and value is None:
+            return
+
+        string = self.argument.toStringProto(value, proto)
+        size = self.chunkSize
+        chunks = [string[i:i + size] for i in xrange(0, len(string), size)]
+        chunks = chunks or [b""]
+
+        strings[name] = str(len(chunks))
+        for i, chunk in enumerate(chunks):
+            strings[_chunkName(name, i)] = chunk
+
+
+    def fromBox(self, name, strings, objects, proto):
+        count = self.retrieve(strings, name, proto)
+        if self.optional and count is None:
+            objects[_pythonName(name)] = None
+            return
+
+        chunks = [self.retrieve(strings, _chunkName(name, i), proto)
+                  for i in xrange(int(count))]
+        value = self.argument.fromStringProto(b"".join(chunks), proto)
+        objects[_pythonName(name)] = value
+
+
+
+def _chunkName(name, index):
+    """Get the key of the chunk with the given index of the named
+    argument.
+
+    """
+    return b"{0}.{1}".format(name, index)
@@ -0,0 +1,239 @@
+"""
+A client-side cache for exercise details.
+"""
+import json
+import os
+from clarent.exercise import GetExerciseDetailsIfChanged
+from clarent.path import getDataPath
+from collections import OrderedDict
+from hashlib import sha256
+from twisted.python import log
+
+
+class ExerciseDetailsCache(object):
+    """A least-recently-used cache of exercise details, stored on disk so
+    that it survives restarts.
+
+    Every exercise is stored in its own file, named after a hash of
+    the exercise's identifier, since identifiers can be any byte
+    strings and too long for a file name. The file has the identifier
+    and revision, along with the details. When the files take up more
+    than ``maxSize`` bytes, the least recently used ones are removed.
+    The order of use is kept in the files' modification times.
+
+    By default, the cache is stored in the ``exercises`` directory
+    under the data path.
+
+    """
+    def __init__(self, path=None, maxSize=16 * 1024 * 1024,
+                 _getDataPath=getDataPath):
+        if path is None:
+            path = _getDataPath().child("exercises")
+        if not path.exists():
+            path.makedirs()
+
+        self.path = path
+        self.maxSize = maxSize
+        self.size = 0
+        self._entries = OrderedDict()
+        self._load()
+
+
+    def _load(self):
+        """Find all cached exercises, least recently used first.
+
+        """
+        entries = []
+        for child in self.path.children():
+            if not _isFileName(child.basename()):
+                continue
+
+            try:
+                details = json.loads(child.getContent())
+                identifier = _decodeBytes(details[u"identifier"])
+                revision = _decodeBytes(details[u"revision"])
+            except (IOError, OSError, ValueError, KeyError, TypeError,
+                    AttributeError):
+                continue
+            if child.basename() != _fileName(identifier):
+                continue
+
+            entries.append((child.getModificationTime(), identifier,
+                            revision, child.getsize()))
+
+        for _, identifier, revision, size in sorted(entries):
+            self._entries[identifier] = revision, size
+            self.size += size
+
+        self._evict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def revision(self, identifier):
+        """Get the revision of the cached details of the exercise, or
+        ``None`` if they're not cached.
+
+        """
+        entry = self._entries.get(identifier)
+        return entry[0] if entry is not None else None
+
+
+    def get(self, identifier):
+        """Get the cached details of an exercise, as a dict with its
+        revision, title and description, or ``None`` if they're not
+        cached.
+
+        """
+        revision = self.revision(identifier)
+        if revision is None:
+            return None
+
+        child = self._child(identifier)
+        try:
+            details = json.loads(child.getContent())
+            if (_decodeBytes(details[u"identifier"]) != identifier
+                    or _decodeBytes(details[u"revision"]) != revision):
+                raise ValueError("cached details don't match the entry")
+            os.utime(child.path, None)
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            self.remove(identifier)
+            return None
+
+        self._entries[identifier] = self._entries.pop(identifier)
+        return {
+            b"revision": revision,
+            b"title": details[u"title"],
+            b"description": details[u"description"]
+        }
+
+
+    def put(self, identifier, revision, title, description):
+        """Store the details of an exercise, replacing any older revision.
+
+        """
+        self.remove(identifier)
+
+        content = json.dumps({
+            u"identifier": _encodeBytes(identifier),
+            u"revision": _encodeBytes(revision),
+            u"title": title,
+            u"description": description
+        })
+        self._child(identifier).setContent(content)
+
+        self._entries[identifier] = revision, len(content)
+        self.size += len(content)
+        self._evict()
+
+
+    def remove(self, identifier):
+        """Remove the details of an exercise from the cache, if they're in
+        it.
+
+        """
+        entry = self._entries.pop(identifier, None)
+        if entry is None:
+            return
+
+        _, size = entry
+        self.size -= size
+        try:
+            self._child(identifier).remove()
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        """Remove least recently used exercises until the cache is small
+        enough.
+
+        """
+        while self.size > self.maxSize and self._entries:
+            identifier = next(iter(self._entries))
+            self.remove(identifier)
+
+
+    def _child(self, identifier):
+        return self.path.child(_fileName(identifier))
+
+
+
+def _fileName(identifier):
+    """Get the name of the file storing the details of an exercise.
+
+    The name has a fixed length, however long the identifier is.
+
+    """
+    return sha256(identifier).hexdigest() + ".json"
+
+
+
+def _isFileName(name):
+    """Check if a name could have been made by ``_fileName``.
+
+    """
+    digest, dot, extension = name.partition(".")
+    return (len(digest) == 64 and dot and extension == "json"
+            and all(c in "0123456789abcdef" for c in digest))
+
+
+
+def _encodeBytes(value):
+    """Encode a byte string, such as an identifier or revision, for
+    storing in JSON.
+
+    """
+    return value.decode("latin-1")
+
+
+
+def _decodeBytes(encoded):
+    """Decode a byte string encoded with ``_encodeBytes``.
+
+    """
+    return encoded.encode("latin-1")
+
+
+
+def getExerciseDetails(protocol, identifier, cache):
+    """Get the details of an exercise, using the cache.
+
+    The server only sends the title and description if the cached
+    ones are missing or out of date; new ones are stored in the
+    cache. Failing to store them is logged, but doesn't fail the
+    fetch. Returns a deferred that fires with a dict with the title,
+    description and whether the exercise has been solved.
+
+    """
+    def getDetails(revision):
+        d = protocol.callRemote(GetExerciseDetailsIfChanged,
+                                identifier=identifier, revision=revision)
+        d.addCallback(gotResponse, revision)
+        return d
+
+    def gotResponse(response, revision):
+        if response[b"modified"]:
+            title, description = response[b"title"], response[b"description"]
+            try:
+                cache.put(identifier, response[b"revision"],
+                          title, description)
+            except (IOError, OSError):
+                log.err(None, "caching exercise details failed")
+        else:
+            cached = cache.get(identifier)
+            if cached is None or cached[b"revision"] != revision:
+                # Evicted while we were asking; ask again.
+                return getDetails(None)
+            title, description = cached[b"title"], cached[b"description"]
+
+        return {
+            b"title": title,
+            b"description": description,
+            b"solved": response[b"solved"]
+        }
+
+    return getDetails(cache.revision(identifier))
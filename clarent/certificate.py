@@ -1,26 +1,57 @@
 """
 Tools for creating certificates.
 """
+import os
+from collections import defaultdict, OrderedDict
 from datetime import datetime
-from OpenSSL.crypto import PKey, X509, dump_privatekey, dump_certificate
-from OpenSSL.crypto import TYPE_RSA, FILETYPE_PEM
-from OpenSSL import SSL
-from twisted.internet.ssl import PrivateCertificate
-
-SSL.OP_NO_COMPRESSION = 0x00020000L
-SSL.OP_CIPHER_SERVER_PREFERENCE = 0x00400000L
-SSL.OP_SINGLE_ECDH_USE = 0x00080000L
-SSL.OP_SINGLE_DH_USE = 0x00100000L
-SSL.OP_DONT_INSERT_EMPTY_FRAGMENTS = 0x00000800L
-SSL.OP_NO_TLSv1 = 0x04000000L
-SSL.OP_NO_SESSION_RESUMPTION_ON_RENEGOTIATION = 0x00010000L
-SSL.OP_NO_TICKET = 0x00004000L
+from time import time
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+from weakref import WeakKeyDictionary, WeakSet
+from zope.interface import alsoProvides
+
+try:
+    from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+except ImportError: # pragma: no cover
+    IOpenSSLClientConnectionCreator = None
+
+# PyOpenSSL, cryptography and twisted.internet.ssl take a while to
+# import, so they're imported when they're first needed, not here.
+# That keeps this module quick to import for callers that only need
+# some of it, such as short-lived command line tools.
+
+_SSL = None
+
+
+def _ssl():
+    """Import PyOpenSSL's SSL module, with the constants that older
+    versions of it lack patched in.
+
+    """
+    global _SSL
+    if _SSL is None:
+        from OpenSSL import SSL
+        SSL.OP_NO_COMPRESSION = 0x00020000L
+        SSL.OP_CIPHER_SERVER_PREFERENCE = 0x00400000L
+        SSL.OP_SINGLE_ECDH_USE = 0x00080000L
+        SSL.OP_SINGLE_DH_USE = 0x00100000L
+        SSL.OP_DONT_INSERT_EMPTY_FRAGMENTS = 0x00000800L
+        SSL.OP_NO_TLSv1 = 0x04000000L
+        SSL.OP_NO_SESSION_RESUMPTION_ON_RENEGOTIATION = 0x00010000L
+        SSL.OP_NO_TICKET = 0x00004000L
+        _SSL = SSL
+    return _SSL
+
+
 
 def _makeCertificate(key, email, _utcnow=datetime.utcnow):
     """Make the certificate for the client using the given key and e-mail
     address.
 
     """
+    from OpenSSL.crypto import X509
+
     # Create a certificate for this key.
     cert = X509()
     cert.set_pubkey(key)
@@ -47,49 +78,392 @@ def _makeCertificate(key, email, _utcnow=datetime.utcnow):
 _ASN1_GENERALIZEDTIME_FORMAT = "%Y%m%d%H%M%SZ"
 
 
-def _generateKey(_PKey=PKey):
-    """Generate a 4096-bit RSA key.
+RSA = "rsa"
+"""4096-bit RSA keys. This is the default key type.
+
+"""
+
+ECDSA = "ecdsa"
+"""ECDSA keys on the NIST P-256 curve. These are much faster to
+generate and use than RSA keys, but aren't supported by some very old
+TLS implementations.
+
+"""
+
+keyTypes = (RSA, ECDSA)
+
+
+def _generateKey(keyType=RSA, _PKey=None):
+    """Generate a key of the given type.
+
+    """
+    if keyType == RSA:
+        from OpenSSL.crypto import PKey, TYPE_RSA
+        key = (_PKey or PKey)()
+        key.generate_key(TYPE_RSA, 4096)
+        return key
+    elif keyType == ECDSA:
+        return _generateECDSAKey()
+    else:
+        raise ValueError("unknown key type: {0!r}".format(keyType))
+
+
+
+def _generateECDSAKey():
+    """Generate an ECDSA key on the P-256 curve.
+
+    PyOpenSSL can't generate EC keys, or convert them from
+    ``cryptography``, so this generates one with ``cryptography`` and
+    loads it through PEM.
 
     """
-    key = _PKey()
-    key.generate_key(TYPE_RSA, 4096)
-    return key
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from OpenSSL.crypto import FILETYPE_PEM, load_privatekey
+
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    pem = key.private_bytes(serialization.Encoding.PEM,
+                            serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    return load_privatekey(FILETYPE_PEM, pem)
+
+
+
+class KeyPool(object):
+    """A pool of keys, generated ahead of time in the background.
+
+    Key generation is slow, so it happens in a thread, one key at a
+    time. When the number of available keys drops to ``lowWater`` or
+    below, the pool generates new keys until it holds ``size`` of
+    them again. Every key is handed out exactly once.
+
+    The pool doesn't generate anything until it is asked for a key or
+    explicitly started with ``start``. All of its keys are of the
+    given type.
+
+    """
+    def __init__(self, size=4, lowWater=1, keyType=RSA,
+                 _generateKey=_generateKey, _deferToThread=deferToThread):
+        if not 0 <= lowWater < size:
+            raise ValueError("lowWater must be at least 0 and less than size")
+
+        self.size = size
+        self.lowWater = lowWater
+        self.keyType = keyType
+
+        self._generateKey = _generateKey
+        self._deferToThread = _deferToThread
+
+        self._keys = []
+        self._waiting = []
+        self._generating = False
+        self._filling = False
+
+
+    def __len__(self):
+        """The number of keys that are available right now.
+
+        """
+        return len(self._keys)
+
+
+    def start(self):
+        """Start filling the pool.
+
+        """
+        self._filling = True
+        self._maybeGenerate()
+
+
+    def getKey(self):
+        """Take a key from the pool.
+
+        Returns a deferred that fires with the key. If no keys are
+        available, it fires as soon as the next one has been
+        generated.
+
+        """
+        if self._keys:
+            d = succeed(self._keys.pop(0))
+        else:
+            d = Deferred()
+            self._waiting.append(d)
+
+        self._maybeGenerate()
+        return d
+
+
+    def _maybeGenerate(self):
+        """Generate another key in the background, if we need one and
+        aren't already generating one.
 
+        """
+        if self._generating:
+            return
 
-def makeCredentials(path, email):
+        if self._waiting or len(self._keys) <= self.lowWater:
+            self._filling = True
+        elif len(self._keys) >= self.size:
+            self._filling = False
+
+        if self._filling:
+            self._generating = True
+            d = self._deferToThread(self._generateKey, self.keyType)
+            d.addCallbacks(self._keyGenerated, self._generationFailed)
+
+
+    def _keyGenerated(self, key):
+        """A key was generated. Hand it to the first caller waiting for one,
+        or add it to the pool, and then keep filling.
+
+        """
+        self._generating = False
+
+        if self._waiting:
+            self._waiting.pop(0).callback(key)
+        else:
+            self._keys.append(key)
+
+        self._maybeGenerate()
+
+
+    def _generationFailed(self, failure):
+        """Generating a key failed.
+
+        Everyone waiting for a key gets the failure. The pool stops
+        filling until it is asked for a key again.
+
+        """
+        self._generating = self._filling = False
+
+        waiting, self._waiting = self._waiting, []
+        if not waiting:
+            log.err(failure, "generating a key for the pool failed")
+
+        for d in waiting:
+            d.errback(failure)
+
+
+
+def makeCredentials(path, email, key=None, keyType=RSA):
     """Make credentials for the client from given e-mail address and store
     them in the directory at path.
 
+    If a key is given (for example, one taken from a ``KeyPool``),
+    it is used; otherwise, a new one of the given type is generated.
+
+    """
+    pem = _makeCredentialsPEM(email, key, keyType)
+    _writeAtomically(path.child("client.pem"), pem)
+
+
+
+def _makeCredentialsPEM(email, key=None, keyType=RSA):
+    """Make credentials for the given e-mail address, and return them as
+    PEM: first the private key, then the certificate.
+
     """
-    key = _generateKey()
+    from OpenSSL.crypto import FILETYPE_PEM, dump_certificate, dump_privatekey
+
+    if key is None:
+        key = _generateKey(keyType)
+
     cert = _makeCertificate(key, email)
+    return (dump_privatekey(FILETYPE_PEM, key)
+            + dump_certificate(FILETYPE_PEM, cert))
+
 
-    certPath = path.child("client.pem")
-    certPath.alwaysCreate = True
 
-    with certPath.open("wb") as pemFile:
-        pemFile.write(dump_privatekey(FILETYPE_PEM, key))
-        pemFile.write(dump_certificate(FILETYPE_PEM, cert))
+def _writeAtomically(filePath, content, _link=getattr(os, "link", os.rename)):
+    """Write the content to a new file at the given path.
+
+    The content is first written to a temporary sibling, which is then
+    linked into place, so nobody ever sees a partially written
+    file. Raises OSError if the file already exists. (On platforms
+    without hard links, the temporary file is renamed instead, which
+    fails the same way on those platforms.)
+
+    """
+    temporary = filePath.temporarySibling(".new")
+    try:
+        with temporary.open("wb") as f:
+            f.write(content)
+        _link(temporary.path, filePath.path)
+    finally:
+        if os.path.exists(temporary.path):
+            os.remove(temporary.path)
+
+
+
+def makeCredentialsAsync(path, email, keyPool=None, semaphore=None,
+                         keyType=RSA, _deferToThread=deferToThread):
+    """Like ``makeCredentials``, but does the work in a thread.
+
+    Returns a deferred that fires when the credentials have been
+    written. If a ``KeyPool`` is given, the key is taken from it;
+    otherwise, a new key of the given type is generated.
+
+    To limit how many credentials are made at once, pass a
+    ``DeferredSemaphore``; each call holds one of its tokens until
+    it's done. Calls sharing a semaphore wait their turn.
+
+    """
+    def make():
+        if keyPool is None:
+            return _deferToThread(makeCredentials, path, email,
+                                  keyType=keyType)
+
+        d = keyPool.getKey()
+        d.addCallback(lambda key: _deferToThread(makeCredentials,
+                                                 path, email, key))
+        return d
+
+    if semaphore is None:
+        return make()
+    else:
+        return semaphore.run(make)
 
 
 
-def getContextFactory(path):
+def getContextFactory(path, sessionResumption=None, metrics=None):
     """Get a context factory for the client from keys already stored at
     path.
 
+    If ``sessionResumption`` settings are given, TLS sessions can be
+    resumed; see ``SessionResumption``. If ``ContextMetrics`` are
+    given, they're kept up to date by the context factory.
+
+    Context factories are cached: as long as the credentials file
+    doesn't change, this returns the same context factory for the same
+    path, settings and metrics, without reading the file again.
+    Settings and metrics are compared by identity, so reuse the same
+    ``SessionResumption`` and ``ContextMetrics`` objects to get the
+    cached context factory; new ones always make a new context
+    factory. Only the most recently used context factories are kept.
+    Use ``clearContextFactoryCache`` to forget all cached context
+    factories.
+
     Raises IOError if the credentials didn't exist.
 
     """
-    with path.child("client.pem").open() as pemFile:
-        cert = PrivateCertificate.loadPEM(pemFile.read())
+    pemPath = path.child("client.pem")
+    cacheKey = pemPath.path, sessionResumption, metrics
+
+    try:
+        stamp = _fileStamp(pemPath.path)
+    except OSError:
+        stamp = None
+    else:
+        cached = _contextFactories.pop(cacheKey, None)
+        if cached is not None and cached[0] == stamp:
+            _contextFactories[cacheKey] = cached
+            return cached[1]
+
+    ctxFactory = _loadContextFactory(pemPath, sessionResumption, metrics)
+    if stamp is not None:
+        _contextFactories[cacheKey] = stamp, ctxFactory
+        while len(_contextFactories) > _maxCachedContextFactories:
+            _contextFactories.popitem(last=False)
 
-    certOptions = cert.options() # TODO: verify server cert (see #1)
-    certOptions.method = SSL.SSLv23_METHOD
-    ctxFactory = SecureCiphersContextFactory(certOptions)
     return ctxFactory
 
 
 
+_maxCachedContextFactories = 32
+_contextFactories = OrderedDict()
+
+
+def clearContextFactoryCache():
+    """Forget all context factories cached by ``getContextFactory``.
+
+    """
+    _contextFactories.clear()
+
+
+
+def _fileStamp(pathName):
+    """Get something that changes whenever the file at the given path
+    does: its inode number, size and modification time.
+
+    Raises OSError if the file doesn't exist.
+
+    """
+    stat = os.stat(pathName)
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+
+def _loadContextFactory(pemPath, sessionResumption, metrics):
+    """Load the credentials at the given path, and make a context factory
+    for them, which loads them again when it's invalidated.
+
+    """
+    def load():
+        return _loadCertificateOptions(pemPath, sessionResumption)
+
+    ctxFactory = SecureCiphersContextFactory(
+        load(), sessionResumption=sessionResumption, metrics=metrics,
+        reloadContextFactory=load)
+    return ctxFactory
+
+
+
+def _loadCertificateOptions(pemPath, sessionResumption):
+    """Load the credentials at the given path into certificate options.
+
+    """
+    from twisted.internet.ssl import CertificateOptions, PrivateCertificate
+
+    with pemPath.open() as pemFile:
+        cert = PrivateCertificate.loadPEM(pemFile.read())
+
+    tickets = sessionResumption is not None and sessionResumption.tickets
+    certOptions = CertificateOptions( # TODO: verify server cert (see #1)
+        privateKey=cert.privateKey.original,
+        certificate=cert.original,
+        enableSessionTickets=tickets)
+    certOptions.method = _ssl().SSLv23_METHOD
+    return certOptions
+
+
+
+class SessionResumption(object):
+    """Settings for resuming TLS sessions, so that reconnecting peers
+    don't have to do a full handshake.
+
+    On the server side, sessions are kept in a session cache, under
+    the given session ID context, for ``timeout`` seconds. Session
+    tickets are only used if ``tickets`` is true. The keys used to
+    encrypt tickets belong to the underlying OpenSSL context, so to
+    rotate them, make a new context factory.
+
+    On the client side, if ``reuseClientSessions`` is true, the
+    session of the last connection that completed a handshake is
+    offered to the server when reconnecting.
+
+    """
+    def __init__(self, sessionID=b"clarent", timeout=300, tickets=False,
+                 reuseClientSessions=True):
+        self.sessionID = sessionID
+        self.timeout = timeout
+        self.tickets = tickets
+        self.reuseClientSessions = reuseClientSessions
+
+
+    def configure(self, ctx):
+        """Configure a context to use these settings.
+
+        """
+        SSL = _ssl()
+        ctx.set_session_id(self.sessionID)
+        ctx.set_session_cache_mode(SSL.SESS_CACHE_BOTH)
+        ctx.set_timeout(self.timeout)
+        if not self.tickets:
+            ctx.set_options(SSL.OP_NO_TICKET)
+
+
+
 class SecureCiphersContextFactory(object):
     """A context factory to limit SSL/TLS connections to secure
     ciphersuites.
@@ -113,12 +487,106 @@ class SecureCiphersContextFactory(object):
     timing issues in GHASH; but peers with hardware implementations of
     GCM may prefer it.
 
+    If ``cacheContext`` is true, the context is only built once, and
+    then reused for every connection until ``invalidate`` is called.
+
+    Note that the wrapped context factory may cache its context too;
+    ``CertificateOptions`` does. To get a really new context (for
+    example, because the credentials changed) after ``invalidate``,
+    give a ``reloadContextFactory``: ``invalidate`` calls it without
+    arguments, and wraps the context factory it returns instead.
+    Context factories from ``getContextFactory`` load their
+    credentials again this way.
+
+    Session resumption is off unless ``SessionResumption`` settings
+    are given. Since the session cache lives in the context, this
+    implies caching the context. When reusing client sessions, this
+    factory also creates client connections itself, so that it can
+    offer the previous session to the server.
+
+    If ``ContextMetrics`` are given, they're told about every context
+    that is built and every handshake. Without metrics, handshakes
+    aren't watched at all.
+
     """
-    def __init__(self, ctxFactory):
+    def __init__(self, ctxFactory, cacheContext=False,
+                 sessionResumption=None, metrics=None,
+                 reloadContextFactory=None):
         self.ctxFactory = ctxFactory
+        self.reloadContextFactory = reloadContextFactory
+        self.cacheContext = cacheContext or sessionResumption is not None
+        self.sessionResumption = sessionResumption
+        self.metrics = metrics
+        self._context = None
+        self._clientConnections = WeakSet()
+        self._lastClientConnection = None
+
+        if self._reuseClientSessions:
+            alsoProvides(self, IOpenSSLClientConnectionCreator)
+
+
+    @property
+    def _reuseClientSessions(self):
+        """Whether this factory remembers client sessions, and offers them
+        to the server again when reconnecting.
+
+        """
+        return (self.sessionResumption is not None
+                and self.sessionResumption.reuseClientSessions
+                and IOpenSSLClientConnectionCreator is not None)
 
 
     def getContext(self):
+        if not self.cacheContext:
+            return self._buildContext()
+
+        if self._context is None:
+            self._context = self._buildContext()
+
+        return self._context
+
+
+    def invalidate(self):
+        """Forget the cached context and client session, if any, and reload
+        the wrapped context factory, if this factory knows how to. The
+        next connection does a full handshake.
+
+        Raises whatever ``reloadContextFactory`` raises, such as IOError
+        when the credentials of a context factory from
+        ``getContextFactory`` don't exist any more. This factory keeps
+        using its old context factory if that happens.
+
+        """
+        if self.reloadContextFactory is not None:
+            self.ctxFactory = self.reloadContextFactory()
+
+        self._context = None
+        self._lastClientConnection = None
+
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        """Create a client connection, offering the last session to the
+        server, if there is one.
+
+        This is only used when reusing client sessions.
+
+        """
+        connection = _ssl().Connection(self.getContext(), None)
+        connection.set_app_data(tlsProtocol)
+        self._clientConnections.add(connection)
+
+        last = self._lastClientConnection
+        if last is not None:
+            connection.set_session(last.get_session())
+
+        return connection
+
+
+    def _buildContext(self):
+        """Get a context from the wrapped context factory, and harden it.
+
+        """
+        SSL = _ssl()
         ctx = self.ctxFactory.getContext()
         ctx.set_options(SSL.OP_NO_SSLv2
                         | SSL.OP_NO_SSLv3
@@ -126,12 +594,142 @@ class SecureCiphersContextFactory(object):
                         | SSL.OP_SINGLE_DH_USE
                         | SSL.OP_SINGLE_ECDH_USE)
         ctx.set_cipher_list(ciphersuites)
+
+        if self.sessionResumption is not None:
+            self.sessionResumption.configure(ctx)
+
+        if self._reuseClientSessions or self.metrics is not None:
+            ctx.set_info_callback(self._infoCallback)
+
+        if self.metrics is not None:
+            self.metrics.contextBuilt()
+
         return ctx
 
 
+    def _infoCallback(self, connection, where, ret):
+        """Tell the metrics about handshakes, and remember the last client
+        connection that completed a handshake.
+
+        The connection is remembered instead of its session, because
+        with TLS 1.3, the resumable session only arrives after the
+        handshake is done.
+
+        """
+        SSL = _ssl()
+        if self.metrics is not None:
+            if where & SSL.SSL_CB_HANDSHAKE_START:
+                self.metrics.handshakeStarted(connection)
+            if where & SSL.SSL_CB_HANDSHAKE_DONE:
+                self.metrics.handshakeDone(connection)
+
+        if (where & SSL.SSL_CB_HANDSHAKE_DONE
+            and connection in self._clientConnections):
+            self._lastClientConnection = connection
+
+
+
+class ContextMetrics(object):
+    """Counters describing what a ``SecureCiphersContextFactory`` does:
+    how many contexts it built, and how many handshakes were done
+    with its contexts, how long they took, which ciphers and protocol
+    versions were negotiated, and how many sessions were resumed.
+
+    To do something else with each handshake, such as reporting it
+    somewhere, override ``handshakeCompleted``.
+
+    """
+    def __init__(self, _clock=time):
+        self._clock = _clock
+        self._started = WeakKeyDictionary()
+
+        self.contextsBuilt = 0
+        self.handshakes = 0
+        self.resumedHandshakes = 0
+        self.handshakeTime = 0.0
+        self.ciphers = defaultdict(int)
+        self.protocols = defaultdict(int)
+
+
+    @property
+    def resumptionRate(self):
+        """The fraction of handshakes that resumed a session.
+
+        """
+        if not self.handshakes:
+            return 0.0
+        return float(self.resumedHandshakes) / self.handshakes
+
+
+    @property
+    def meanHandshakeTime(self):
+        """The mean duration of a handshake, in seconds.
+
+        """
+        if not self.handshakes:
+            return 0.0
+        return self.handshakeTime / self.handshakes
+
+
+    def contextBuilt(self):
+        """A context was built.
+
+        """
+        self.contextsBuilt += 1
+
+
+    def handshakeStarted(self, connection):
+        """A handshake started on the given connection.
+
+        """
+        self._started[connection] = self._clock()
+
+
+    def handshakeDone(self, connection):
+        """A handshake finished on the given connection.
+
+        Handshakes that weren't seen starting (such as post-handshake
+        messages in TLS 1.3) are ignored.
+
+        """
+        started = self._started.pop(connection, None)
+        if started is None:
+            return
+
+        self.handshakeCompleted(self._clock() - started,
+                                connection.get_cipher_name(),
+                                connection.get_protocol_version_name(),
+                                _sessionReused(connection))
+
+
+    def handshakeCompleted(self, duration, cipher, protocol, resumed):
+        """Count a completed handshake.
+
+        """
+        self.handshakes += 1
+        self.handshakeTime += duration
+        self.ciphers[cipher] += 1
+        self.protocols[protocol] += 1
+        if resumed:
+            self.resumedHandshakes += 1
+
+
+
+def _sessionReused(connection):
+    """Whether the connection resumed a session.
+
+    PyOpenSSL doesn't expose this, so this asks OpenSSL directly.
+
+    """
+    from OpenSSL._util import lib
+    return bool(lib.SSL_session_reused(connection._ssl))
+
+
 
 # Ciphersuites, based on Qualys' SSL/TLS Deployment Best Practices
 # https://www.ssllabs.com/downloads/SSL_TLS_Deployment_Best_Practices_1.3.pdf
+# Both RSA and ECDSA suites are included, so that credentials made with
+# either key type work.
 # Exceptions: Our RSA keys are bigger than recommended (4096 vs 2048).
 # Since we can multiplex everything over a single connection, this
 # doesn't really matter as much. Also, GCM is not as preferred,
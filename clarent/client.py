@@ -0,0 +1,251 @@
+"""
+Tools for clients connecting to an exercise server.
+"""
+import random
+from twisted.internet import defer
+from twisted.internet.error import ConnectionDone
+from twisted.internet.protocol import Factory
+from twisted.protocols import amp
+from twisted.protocols.policies import WrappingFactory
+from twisted.python import log
+
+
+class ConnectionPool(object):
+    """A small pool of AMP connections to a server, which reconnects
+    when connections are lost.
+
+    Calls are spread over the live connections, going to the one with
+    the fewest calls in flight. While there are no live connections,
+    calls are queued, and sent as soon as a connection is made.
+
+    Connections that fail or are lost are made again after a delay,
+    which starts at ``initialDelay`` seconds, and is multiplied by
+    ``factor`` after every failed attempt, up to ``maxDelay`` seconds.
+    Each delay is randomized between half and all of that, so that
+    many clients don't all reconnect at once after the server goes
+    away. The delay only goes back to ``initialDelay`` once a
+    connection has stayed up for ``stableTime`` seconds, so servers
+    that accept connections and then drop them right away (for
+    example, because the TLS handshake fails) aren't hammered with
+    reconnections either.
+
+    ``endpoint`` is a client endpoint to connect to. Use the same TLS
+    context factory for all of its connections (for example, from
+    ``getContextFactory`` with session resumption), so reconnections
+    can resume TLS sessions instead of doing full handshakes.
+
+    ``protocolFactory`` is called without arguments to make the AMP
+    protocol for a connection, for example to give it responders for
+    notifications.
+
+    """
+    def __init__(self, endpoint, size=2, protocolFactory=amp.AMP,
+                 initialDelay=0.5, maxDelay=60.0, factor=2.0,
+                 stableTime=10.0, _clock=None, _random=random.random):
+        if _clock is None:
+            from twisted.internet import reactor as _clock
+
+        self.endpoint = endpoint
+        self.size = size
+        self.protocolFactory = protocolFactory
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.factor = factor
+        self.stableTime = stableTime
+
+        self._clock = _clock
+        self._random = _random
+        self._factory = _PoolFactory(self)
+
+        self.running = False
+        self._connections = {}
+        self._attempts = {}
+        self._delayedCalls = {}
+        self._failures = {}
+        self._stableCalls = {}
+        self._queue = []
+
+
+    def __len__(self):
+        """The number of live connections.
+
+        """
+        return len(self._connections)
+
+
+    def start(self):
+        """Start connecting.
+
+        """
+        self.running = True
+        for slot in xrange(self.size):
+            self._connect(slot)
+
+
+    def stop(self):
+        """Stop reconnecting, disconnect all connections, and fail all
+        queued calls with ``ConnectionDone``.
+
+        """
+        self.running = False
+
+        for call in self._delayedCalls.values():
+            call.cancel()
+        self._delayedCalls.clear()
+
+        for attempt in self._attempts.values():
+            attempt.cancel()
+        self._attempts.clear()
+
+        for call in self._stableCalls.values():
+            call.cancel()
+        self._stableCalls.clear()
+
+        connections, self._connections = self._connections, {}
+        for wrapper in connections:
+            wrapper.transport.loseConnection()
+
+        queue, self._queue = self._queue, []
+        for d, _, _ in queue:
+            d.errback(ConnectionDone("connection pool stopped"))
+
+
+    def callRemote(self, command, **kwargs):
+        """Call a remote command on one of the connections, like
+        ``AMP.callRemote``.
+
+        """
+        if not self._connections:
+            d = defer.Deferred()
+            self._queue.append((d, command, kwargs))
+            return d
+
+        wrapper = min(self._connections, key=self._connections.get)
+        return self._send(wrapper, command, kwargs)
+
+
+    def _send(self, wrapper, command, kwargs):
+        """Call a remote command on the given connection, keeping track of
+        how many calls are in flight on it.
+
+        """
+        self._connections[wrapper] += 1
+
+        def done(result):
+            if wrapper in self._connections:
+                self._connections[wrapper] -= 1
+            return result
+
+        d = wrapper.wrappedProtocol.callRemote(command, **kwargs)
+        return d.addBoth(done)
+
+
+    def _connect(self, slot):
+        """Connect the given slot.
+
+        """
+        self._delayedCalls.pop(slot, None)
+        if not self.running:
+            return
+
+        d = self._attempts[slot] = self.endpoint.connect(self._factory)
+        d.addCallbacks(self._connected, self._connectionFailed,
+                       callbackArgs=(slot,), errbackArgs=(slot,))
+
+
+    def _connected(self, wrapper, slot):
+        """A connection was made for the given slot. Send any queued
+        calls over it, and reset the delay for the slot if it stays up.
+
+        """
+        self._attempts.pop(slot, None)
+        wrapper.slot = slot
+        self._connections[wrapper] = 0
+        self._stableCalls[slot] = self._clock.callLater(
+            self.stableTime, self._stable, slot)
+
+        queue, self._queue = self._queue, []
+        for d, command, kwargs in queue:
+            self._send(wrapper, command, kwargs).chainDeferred(d)
+
+
+    def _stable(self, slot):
+        """The connection for the given slot has stayed up long enough to
+        reset its delay.
+
+        """
+        del self._stableCalls[slot]
+        self._failures.pop(slot, None)
+
+
+    def _connectionFailed(self, failure, slot):
+        """Connecting the given slot failed. Try again later.
+
+        """
+        self._attempts.pop(slot, None)
+        if failure.check(defer.CancelledError) or not self.running:
+            return
+
+        log.msg("Connecting to {0} failed: {1}".format(
+            self.endpoint, failure.getErrorMessage()))
+        self._reconnect(slot)
+
+
+    def _connectionLost(self, wrapper):
+        """A connection was lost. Make it again later, unless it's no longer
+        the pool's connection for its slot, because the pool was stopped
+        since.
+
+        """
+        if self._connections.pop(wrapper, None) is not None:
+            call = self._stableCalls.pop(wrapper.slot, None)
+            if call is not None:
+                call.cancel()
+            self._reconnect(wrapper.slot)
+
+
+    def _reconnect(self, slot):
+        """Connect the given slot again, after a delay that grows with
+        every consecutive failure.
+
+        """
+        if not self.running:
+            return
+
+        failures = self._failures.get(slot, 0)
+        self._failures[slot] = failures + 1
+
+        delay = min(self.maxDelay, self.initialDelay * self.factor ** failures)
+        delay *= 0.5 + 0.5 * self._random()
+
+        self._delayedCalls[slot] = self._clock.callLater(delay, self._connect,
+                                                         slot)
+
+
+
+class _PoolFactory(WrappingFactory):
+    """Makes protocols for a connection pool, and tells the pool when
+    their connections are lost.
+
+    """
+    def __init__(self, pool):
+        WrappingFactory.__init__(self, _ProtocolFactory(pool))
+        self.pool = pool
+
+
+    def unregisterProtocol(self, wrapper):
+        WrappingFactory.unregisterProtocol(self, wrapper)
+        self.pool._connectionLost(wrapper)
+
+
+
+class _ProtocolFactory(Factory):
+    """Makes protocols with a connection pool's protocol factory.
+
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+
+    def buildProtocol(self, addr):
+        return self.pool.protocolFactory()
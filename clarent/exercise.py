@@ -1,6 +1,11 @@
 """
 Public exercise API.
 """
+from hashlib import sha256
+from struct import pack
+from clarent.arguments import Chunked, CompressedUnicode, EncodedAmpList
+from clarent.arguments import Identifier
+from clarent.arguments import MAX_VALUE_LENGTH
 from twisted.protocols import amp
 from txampext.errors import Error
 
@@ -15,25 +20,246 @@ class UnknownExercise(Error):
 class GetExercises(amp.Command):
     """
     Gets the identifiers and titles of some exercises.
+
+    Servers can serialize the exercises ahead of time; see
+    ``EncodedAmpList``.
     """
     arguments = [
         (b"solved", amp.Boolean())
     ]
     response = [
-        (b"exercises", amp.AmpList([
-            (b"identifier", amp.String()),
+        (b"exercises", EncodedAmpList([
+            (b"identifier", Identifier()),
             (b"title", amp.Unicode())
         ]))
     ]
 
 
 
+class InvalidCursor(Error):
+    """The cursor was not recognized, for example because it has expired.
+
+    """
+
+
+
+class GetExercisesPage(amp.Command):
+    """
+    Gets the identifiers and titles of some exercises, a page at a time.
+
+    Leave out the cursor to get the first page. Every page comes with
+    the cursor for the next one, except for the last page. The limit
+    is the largest number of exercises a page may have; servers may
+    return fewer.
+    """
+    arguments = [
+        (b"solved", amp.Boolean()),
+        (b"cursor", amp.String(optional=True)),
+        (b"limit", amp.Integer())
+    ]
+    response = [
+        (b"exercises", amp.AmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode())
+        ])),
+        (b"next", amp.String(optional=True))
+    ]
+    errors = dict([
+        InvalidCursor.asAMP()
+    ])
+
+
+
+class UnknownField(Error):
+    """The field was not recognized.
+
+    """
+
+
+
+FIELDS = (b"identifier", b"title", b"solved", b"tags", b"difficulty")
+"""The fields of an exercise that ``QueryExercises`` can return.
+
+"""
+
+
+
+class QueryExercises(amp.Command):
+    """
+    Gets some fields of the exercises that match some filters, a page
+    at a time.
+
+    Every filter is optional; exercises have to match all the ones
+    that are given. ``tag`` matches exercises that have that tag,
+    ``prefix`` matches exercises whose identifiers start with it, and
+    ``changedSince`` matches exercises that were added or changed since
+    that version of the catalog (see ``GetExerciseChanges``).
+
+    ``fields`` are the names of the fields to return, out of
+    ``FIELDS``. The identifier is always returned. Leave the fields
+    out to get the identifier and title, like ``GetExercises``.
+
+    Paging works like it does for ``GetExercisesPage``.
+    """
+    arguments = [
+        (b"solved", amp.Boolean(optional=True)),
+        (b"tag", amp.Unicode(optional=True)),
+        (b"difficulty", amp.Integer(optional=True)),
+        (b"prefix", amp.String(optional=True)),
+        (b"changedSince", amp.String(optional=True)),
+        (b"fields", amp.ListOf(amp.String(), optional=True)),
+        (b"cursor", amp.String(optional=True)),
+        (b"limit", amp.Integer())
+    ]
+    response = [
+        (b"exercises", amp.AmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode(optional=True)),
+            (b"solved", amp.Boolean(optional=True)),
+            (b"tags", amp.ListOf(amp.Unicode(), optional=True)),
+            (b"difficulty", amp.Integer(optional=True))
+        ])),
+        (b"next", amp.String(optional=True))
+    ]
+    errors = dict([
+        InvalidCursor.asAMP(),
+        UnknownField.asAMP()
+    ])
+
+
+
+def queryExercises(exercises, solved=None, tag=None, difficulty=None,
+                   prefix=None, fields=None):
+    """Filter and project exercises for a ``QueryExercises`` response.
+
+    The exercises are dicts with all of the fields in ``FIELDS``. This
+    returns a list of the ones that match the given filters, in order,
+    with only the requested fields. Raises ``UnknownField`` if any of
+    the fields aren't in ``FIELDS``.
+
+    Versions of the catalog only mean something to the server, so it
+    has to apply the ``changedSince`` filter itself.
+
+    """
+    if fields is None:
+        fields = [b"title"]
+
+    fields = set(fields)
+    if not fields.issubset(FIELDS):
+        raise UnknownField()
+    fields.add(b"identifier")
+
+    def matches(exercise):
+        identifier = exercise[b"identifier"]
+        return ((solved is None or exercise[b"solved"] == solved)
+                and (tag is None or tag in exercise[b"tags"])
+                and (difficulty is None
+                     or exercise[b"difficulty"] == difficulty)
+                and (prefix is None or identifier.startswith(prefix)))
+
+    return [dict((k, v) for k, v in exercise.iteritems() if k in fields)
+            for exercise in exercises if matches(exercise)]
+
+
+
+class GetExerciseChanges(amp.Command):
+    """
+    Gets the changes to the exercise catalog since a given version.
+
+    Leave out the version to get the entire catalog. If nothing has
+    changed, ``modified`` is false, and there are no changes.
+    Otherwise, the response has the exercises that were added or
+    changed (including whether they've been solved), and the
+    identifiers of the ones that were removed. Either way, it has the
+    current version, to pass along next time.
+
+    If the server can't tell what changed since the given version, it
+    sends the entire catalog, with ``reset`` set: the client should
+    replace its copy instead of updating it.
+
+    The changed and removed exercises are chunked, so that the entire
+    catalog fits in a response no matter how large it is.
+    """
+    arguments = [
+        (b"version", amp.String(optional=True))
+    ]
+    response = [
+        (b"version", amp.String()),
+        (b"modified", amp.Boolean()),
+        (b"reset", amp.Boolean()),
+        (b"changed", Chunked(amp.AmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode()),
+            (b"solved", amp.Boolean())
+        ]))),
+        (b"removed", Chunked(amp.ListOf(Identifier())))
+    ]
+
+
+
+class SubscribeToExerciseChanges(amp.Command):
+    """
+    Gets the changes to the exercise catalog since a given version,
+    and subscribes to further changes.
+
+    The arguments and response are the same as for
+    ``GetExerciseChanges``. After that, the server pushes every change
+    to the catalog with ``NotifyExerciseChanges``, until the client
+    unsubscribes or the connection is lost. Subscribing again just
+    gets the changes.
+    """
+    arguments = GetExerciseChanges.arguments
+    response = GetExerciseChanges.response
+
+
+
+class UnsubscribeFromExerciseChanges(amp.Command):
+    """
+    Stops the server from pushing changes to the exercise catalog.
+
+    Unsubscribing when not subscribed does nothing.
+    """
+    arguments = []
+    response = []
+
+
+
+class NotifyExerciseChanges(amp.Command):
+    """Notify a subscribed client that the exercise catalog has changed.
+
+    The changes take the catalog from the ``previous`` version to the
+    new one. If ``previous`` isn't the version the client has, it has
+    missed some changes, and should catch up with
+    ``GetExerciseChanges``.
+
+    Unlike ``GetExerciseChanges``, changed exercises don't say whether
+    they've been solved: that doesn't change along with the catalog,
+    and is sent with ``NotifySolved`` instead.
+
+    Like in ``GetExerciseChanges``, the changed and removed exercises
+    are chunked.
+
+    """
+    arguments = [
+        (b"previous", amp.String()),
+        (b"version", amp.String()),
+        (b"changed", Chunked(amp.AmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode())
+        ]))),
+        (b"removed", Chunked(amp.ListOf(Identifier())))
+    ]
+    response = []
+    requiresAnswer = False
+
+
+
 class GetExerciseDetails(amp.Command):
     """
     Gets the details of a partiucular exercise.
     """
     arguments = [
-        (b"identifier", amp.String())
+        (b"identifier", Identifier())
     ]
     response = [
         (b"title", amp.Unicode()),
@@ -46,13 +272,138 @@ class GetExerciseDetails(amp.Command):
 
 
 
+class GetExerciseDetailsIfChanged(amp.Command):
+    """
+    Gets the details of an exercise, unless the client already has them.
+
+    The client passes the revision of the details it has, if any. If
+    that's still the current revision, ``modified`` is false, and the
+    title and description are left out. Either way, the response has
+    the current revision, and whether the exercise has been solved.
+
+    The description may be longer than AMP's limit on the length of a
+    single value; it's split into chunks if it is.
+    """
+    arguments = [
+        (b"identifier", Identifier()),
+        (b"revision", amp.String(optional=True))
+    ]
+    response = [
+        (b"modified", amp.Boolean()),
+        (b"revision", amp.String()),
+        (b"title", amp.Unicode(optional=True)),
+        (b"description", Chunked(CompressedUnicode(), optional=True)),
+        (b"solved", amp.Boolean())
+    ]
+    errors = dict([
+        UnknownExercise.asAMP()
+    ])
+
+
+
+def detailsRevision(title, description):
+    """Compute the revision of exercise details with the given title and
+    description.
+
+    This is a hash of the title and the description, so it changes
+    whenever either of them does.
+
+    """
+    h = sha256()
+    for part in [title, description]:
+        encoded = part.encode("utf-8")
+        h.update(pack("!Q", len(encoded)))
+        h.update(encoded)
+    return h.hexdigest()
+
+
+
+class GetExerciseDetailsBatch(amp.Command):
+    """
+    Gets the details of several exercises at once.
+
+    Exercises that don't exist are listed in ``unknown``, instead of
+    failing the whole request. If the details don't all fit in a
+    single response, the identifiers of the ones that didn't fit are
+    listed in ``remaining``: ask for those again. Servers can use
+    ``makeDetailsBatchResponse`` to split their responses. Long
+    descriptions are compressed. The exercises are an
+    ``EncodedAmpList``.
+    """
+    arguments = [
+        (b"identifiers", amp.ListOf(Identifier()))
+    ]
+    response = [
+        (b"exercises", EncodedAmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode()),
+            (b"description", CompressedUnicode()),
+            (b"solved", amp.Boolean())
+        ])),
+        (b"unknown", amp.ListOf(Identifier())),
+        (b"remaining", amp.ListOf(Identifier()))
+    ]
+
+
+
+def makeDetailsBatchResponse(exercises, unknown=(),
+                             maxLength=MAX_VALUE_LENGTH):
+    """Make a ``GetExerciseDetailsBatch`` response for the given exercise
+    details, which are dicts with the same keys as the response's
+    exercises.
+
+    The response includes as many exercises as fit in a single AMP
+    value, in order, and lists the identifiers of the rest as
+    remaining. It always includes at least one exercise, so an
+    exercise that doesn't fit by itself still fails loudly. The
+    exercises in the response are already serialized, so they aren't
+    serialized (and their descriptions compressed) again when it's
+    sent.
+
+    """
+    argument = dict(GetExerciseDetailsBatch.response)[b"exercises"]
+
+    fit, length = [], 0
+    for exercise in exercises:
+        row = argument.encodeRow(exercise)
+        length += len(row.encoded)
+        if fit and length > maxLength:
+            break
+        fit.append(row)
+
+    remaining = [exercise[b"identifier"] for exercise in exercises[len(fit):]]
+    return {
+        b"exercises": fit,
+        b"unknown": list(unknown),
+        b"remaining": remaining
+    }
+
+
+
 class NotifySolved(amp.Command):
     """Notify the client that they have solved an exercise.
 
     """
     arguments = [
-        (b"identifier", amp.String()),
+        (b"identifier", Identifier()),
         (b"title", amp.Unicode())
     ]
     response = []
     requiresAnswer = False
+
+
+
+class NotifySolvedBatch(amp.Command):
+    """Notify the client that they have solved some exercises.
+
+    This is like ``NotifySolved``, but for many exercises at once.
+
+    """
+    arguments = [
+        (b"exercises", amp.AmpList([
+            (b"identifier", Identifier()),
+            (b"title", amp.Unicode())
+        ]))
+    ]
+    response = []
+    requiresAnswer = False
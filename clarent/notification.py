@@ -0,0 +1,351 @@
+"""
+Tools for sending notifications to clients.
+"""
+from clarent.exercise import NotifyExerciseChanges, NotifySolvedBatch
+from collections import OrderedDict
+from twisted.internet.error import ConnectionLost
+from twisted.internet.interfaces import IPushProducer
+from twisted.protocols.amp import ProtocolSwitched
+from weakref import WeakSet
+from zope.interface import implementer
+
+
+class SolvedNotifier(object):
+    """Coalesces solved notifications for a single connection into
+    batches.
+
+    Notifications are collected for up to ``delay`` seconds, or until
+    there are ``maxBatchSize`` of them, whichever comes first, and
+    then sent as a single ``NotifySolvedBatch``. Notifications for an
+    exercise that is already waiting to be sent are dropped.
+
+    """
+    def __init__(self, protocol, delay=0.05, maxBatchSize=100, _clock=None):
+        if _clock is None:
+            from twisted.internet import reactor as _clock
+
+        self.protocol = protocol
+        self.delay = delay
+        self.maxBatchSize = maxBatchSize
+
+        self._clock = _clock
+        self._pending = OrderedDict()
+        self._call = None
+
+
+    def notify(self, identifier, title):
+        """Notify the client that they solved the given exercise.
+
+        """
+        self._pending.setdefault(identifier, title)
+
+        if len(self._pending) >= self.maxBatchSize:
+            self.flush()
+        elif self._call is None:
+            self._call = self._clock.callLater(self.delay, self.flush)
+
+
+    def flush(self):
+        """Send all pending notifications now.
+
+        """
+        self._cancelCall()
+        while self._pending:
+            self._sendBatch()
+
+
+    def _cancelCall(self):
+        """Cancel the delayed flush, if there is one.
+
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+
+    def _sendBatch(self):
+        """Send the oldest pending notifications, up to ``maxBatchSize`` of
+        them, as a single ``NotifySolvedBatch``, and return how many
+        were sent.
+
+        """
+        exercises = []
+        while self._pending and len(exercises) < self.maxBatchSize:
+            identifier, title = self._pending.popitem(last=False)
+            exercises.append({b"identifier": identifier, b"title": title})
+
+        self.protocol.callRemote(NotifySolvedBatch, exercises=exercises)
+        return len(exercises)
+
+
+
+class ExerciseChangesPublisher(object):
+    """Pushes changes to the exercise catalog to subscribed connections.
+
+    Servers call ``subscribe`` from their ``SubscribeToExerciseChanges``
+    responder, ``unsubscribe`` from their
+    ``UnsubscribeFromExerciseChanges`` responder and when a connection
+    is lost, and ``publish`` whenever the catalog changes.
+
+    Connections are only weakly referenced, so connections that have
+    gone away are forgotten even if they're never unsubscribed.
+
+    """
+    def __init__(self):
+        self._subscribers = WeakSet()
+
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+    def __contains__(self, protocol):
+        return protocol in self._subscribers
+
+
+    def subscribe(self, protocol):
+        """Push changes to the given connection from now on.
+
+        """
+        self._subscribers.add(protocol)
+
+
+    def unsubscribe(self, protocol):
+        """Stop pushing changes to the given connection, if they were
+        being pushed to it.
+
+        """
+        self._subscribers.discard(protocol)
+
+
+    def publish(self, previous, version, changed=(), removed=()):
+        """Push a change to the catalog to every subscribed connection.
+
+        ``changed`` has dicts with the identifiers and titles of the
+        exercises that were added or changed, and ``removed`` has the
+        identifiers of the exercises that were removed. The
+        notification is only serialized once, no matter how many
+        connections it's pushed to.
+
+        Connections that have been lost, or switched to another
+        protocol, are unsubscribed instead. AMP silently drops
+        notifications sent over lost connections, so this checks for
+        them first.
+
+        """
+        if not self._subscribers:
+            return
+
+        box = NotifyExerciseChanges.makeArguments({
+            "previous": previous,
+            "version": version,
+            "changed": list(changed),
+            "removed": list(removed)
+        }, None)
+
+        for protocol in list(self._subscribers):
+            if protocol.transport is None:
+                self.unsubscribe(protocol)
+                continue
+
+            try:
+                protocol.callRemoteString(NotifyExerciseChanges.commandName,
+                                          requiresAnswer=False, **box)
+            except (ConnectionLost, ProtocolSwitched):
+                self.unsubscribe(protocol)
+
+
+
+@implementer(IPushProducer)
+class NotificationQueue(SolvedNotifier):
+    """A bounded queue of solved notifications for a single connection,
+    which only sends them while the connection keeps up.
+
+    Notifications are coalesced into batches like a ``SolvedNotifier``
+    does, as long as the connection's transport isn't paused. The
+    queue registers itself as a producer with the transport, which
+    must not have another producer registered already; if it does,
+    this raises ``RuntimeError``. While the transport is paused,
+    notifications are queued, and when it's resumed, they're all sent,
+    in batches of up to ``maxBatchSize``.
+
+    Notifications for an exercise that's already queued are collapsed
+    into the queued one. When the queue already has ``maxSize``
+    notifications, they're sent right away if the transport isn't
+    paused, and otherwise the oldest one is dropped; clients that are
+    that far behind can find out what they've solved with
+    ``GetExercises``.
+
+    ``onStop`` is called without arguments when the transport stops
+    the queue, which it does when the connection is lost.
+
+    """
+    def __init__(self, protocol, maxSize=1000, maxBatchSize=100,
+                 delay=0.05, onStop=None, _clock=None):
+        SolvedNotifier.__init__(self, protocol, delay, maxBatchSize, _clock)
+        self.maxSize = maxSize
+        self.onStop = onStop
+
+        self.paused = False
+        self.stopped = False
+        self.sent = 0
+        self.collapsed = 0
+        self.dropped = 0
+
+        protocol.transport.registerProducer(self, True)
+
+
+    def __len__(self):
+        """The number of queued notifications.
+
+        """
+        return len(self._pending)
+
+
+    def notify(self, identifier, title):
+        """Notify the client that they solved the given exercise.
+
+        """
+        if self.stopped:
+            return
+
+        if identifier in self._pending:
+            self.collapsed += 1
+        else:
+            if len(self._pending) >= self.maxSize:
+                self.flush()
+            if len(self._pending) >= self.maxSize:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+
+        SolvedNotifier.notify(self, identifier, title)
+
+
+    def flush(self):
+        """Send queued notifications now, until there are none left or the
+        transport is paused.
+
+        """
+        self._cancelCall()
+        while self._pending and not self.paused and not self.stopped:
+            self.sent += self._sendBatch()
+
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+
+    def stopProducing(self):
+        self.stopped = True
+        self._cancelCall()
+        self._pending.clear()
+        if self.onStop is not None:
+            self.onStop()
+
+
+
+class NotificationDispatcher(object):
+    """Sends solved notifications to many connections, each through its
+    own ``NotificationQueue``, so slow clients can't make the server
+    buffer an unbounded number of notifications.
+
+    Connections are forgotten when they're lost. The numbers of
+    notifications sent, collapsed and dropped include those of
+    connections that have been forgotten.
+
+    """
+    def __init__(self, maxQueueSize=1000, maxBatchSize=100, delay=0.05,
+                 _clock=None):
+        self.maxQueueSize = maxQueueSize
+        self.maxBatchSize = maxBatchSize
+        self.delay = delay
+        self._clock = _clock
+
+        self._queues = {}
+        self.sent = 0
+        self.collapsed = 0
+        self.dropped = 0
+
+
+    def register(self, protocol):
+        """Start sending notifications to a connection, and return its
+        queue.
+
+        The connection's transport must not have another producer
+        registered; if it does, this raises ``RuntimeError``.
+
+        """
+        queue = self._queues.get(protocol)
+        if queue is None:
+            queue = NotificationQueue(
+                protocol, self.maxQueueSize, self.maxBatchSize, self.delay,
+                onStop=lambda: self._forget(protocol), _clock=self._clock)
+            self._queues[protocol] = queue
+        return queue
+
+
+    def unregister(self, protocol):
+        """Stop sending notifications to a connection, dropping its queued
+        notifications.
+
+        """
+        queue = self._queues.get(protocol)
+        if queue is not None:
+            queue.stopProducing()
+            protocol.transport.unregisterProducer()
+
+
+    def _forget(self, protocol):
+        """Forget a connection whose queue was stopped, keeping its
+        numbers of notifications sent, collapsed and dropped.
+
+        """
+        queue = self._queues.pop(protocol, None)
+        if queue is not None:
+            self.sent += queue.sent
+            self.collapsed += queue.collapsed
+            self.dropped += queue.dropped
+
+
+    def notify(self, protocol, identifier, title):
+        """Notify the client on a registered connection that they solved
+        the given exercise.
+
+        """
+        queue = self._queues.get(protocol)
+        if queue is not None:
+            queue.notify(identifier, title)
+
+
+    def queueDepths(self):
+        """Get the number of queued notifications for every connection.
+
+        """
+        return dict((protocol, len(queue))
+                    for protocol, queue in self._queues.items())
+
+
+    def metrics(self):
+        """Summarize the state of all queues, as a dict with the numbers
+        of connections and paused connections, the total and largest
+        number of queued notifications, and the total numbers of
+        notifications sent, collapsed and dropped, ever.
+
+        """
+        queues = self._queues.values()
+        depths = [len(q) for q in queues]
+        return {
+            "connections": len(queues),
+            "paused": sum(1 for q in queues if q.paused),
+            "queued": sum(depths),
+            "maxQueued": max(depths) if depths else 0,
+            "sent": self.sent + sum(q.sent for q in queues),
+            "collapsed": self.collapsed + sum(q.collapsed for q in queues),
+            "dropped": self.dropped + sum(q.dropped for q in queues)
+        }
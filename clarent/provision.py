@@ -0,0 +1,186 @@
+"""
+Making credentials for many clients at once.
+"""
+import sys
+from clarent import certificate
+from collections import namedtuple
+from multiprocessing import Pool
+from time import time
+from twisted.python import usage
+from twisted.python.filepath import FilePath
+
+
+Result = namedtuple("Result", "email path error")
+"""The result of making credentials for one client.
+
+``error`` is ``None`` if the credentials were made successfully, or a
+description of what went wrong otherwise.
+
+"""
+
+
+def _provisionOne(item):
+    """Make credentials for a single ``(email, path, keyType)`` item, and
+    write them to ``client.pem`` in the directory at that path.
+
+    This runs in a worker process, so it gets a path name instead of
+    a ``FilePath``, and reports errors instead of raising them.
+
+    """
+    email, pathName, keyType = item
+    try:
+        pem = certificate._makeCredentialsPEM(email, keyType=keyType)
+        certPath = FilePath(pathName).child("client.pem")
+        certificate._writeAtomically(certPath, pem)
+    except Exception as e:
+        return Result(email, pathName, "{0}: {1}".format(type(e).__name__, e))
+
+    return Result(email, pathName, None)
+
+
+
+def provision(items, processes=None, progress=None,
+              keyType=certificate.RSA, _Pool=Pool, _time=time):
+    """Make credentials for many clients at once.
+
+    ``items`` are ``(email, path)`` pairs, where the path is the
+    directory to store that client's credentials in. The work is
+    spread over a pool of processes; by default, one per CPU. All keys
+    are of the given type.
+
+    If given, ``progress`` is called after each item with its
+    ``Result``, the number of items done so far, the total number of
+    items, and the number of seconds elapsed since starting.
+
+    Failing to make the credentials for one client doesn't affect the
+    others. Returns a list of ``Result``s, in the order they were
+    finished. If anything else goes wrong, for example ``progress``
+    raises or the user interrupts, the pool's processes are stopped
+    right away, without finishing the remaining items.
+
+    """
+    items = [(email, getattr(path, "path", path), keyType)
+             for email, path in items]
+    total = len(items)
+
+    results = []
+    start = _time()
+
+    pool = _Pool(processes)
+    try:
+        for result in pool.imap_unordered(_provisionOne, items):
+            results.append(result)
+            if progress is not None:
+                progress(result, len(results), total, _time() - start)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return results
+
+
+
+class Options(usage.Options):
+    synopsis = "Usage: clarent-provision [options] <file>"
+    longdesc = ("Makes credentials for many clients at once. The file (or "
+                "\"-\" for stdin) has one client per line: an e-mail address, "
+                "followed by whitespace, followed by the directory to store "
+                "that client's credentials in.")
+
+    optParameters = [
+        ["processes", "p", None, "Number of worker processes "
+         "(default: one per CPU).", int],
+        ["key-type", "k", certificate.RSA, "Type of key to generate: "
+         + ", ".join(certificate.keyTypes) + "."]
+    ]
+
+    def postOptions(self):
+        if self["key-type"] not in certificate.keyTypes:
+            raise usage.UsageError("Unknown key type: " + self["key-type"])
+
+    def parseArgs(self, itemsFile):
+        self["itemsFile"] = itemsFile
+
+
+
+def _parseItems(lines):
+    """Parse ``(email, path)`` pairs, one per line.
+
+    Blank lines and lines starting with ``#`` are ignored. Raises
+    ValueError, mentioning the line number, for lines that aren't
+    such pairs.
+
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            email, path = line.split(None, 1)
+            email = email.decode("utf-8")
+        except ValueError:
+            raise ValueError("line {0}: expected an e-mail address and a "
+                             "path, got {1!r}".format(number, line))
+
+        yield email, path
+
+
+
+def _reportProgress(result, done, total, elapsed, _stream=sys.stderr):
+    """Write a line of progress, including throughput, to the stream.
+
+    """
+    status = "ok" if result.error is None else result.error
+    rate = done / elapsed if elapsed else 0.0
+    line = u"[{0}/{1}] {2}: {3} ({4:.2f}/s)\n".format(
+        done, total, result.email, status, rate)
+    _stream.write(line.encode("utf-8"))
+
+
+
+def main(argv=None, _stdin=sys.stdin, _stderr=sys.stderr,
+         _provision=provision):
+    """Make credentials for many clients, as described by the command
+    line arguments.
+
+    Returns the exit status: 0 if all credentials were made, 1 if
+    some couldn't be made, and 2 if the command line arguments or the
+    items file were bad, in which case nothing is made.
+
+    """
+    options = Options()
+    try:
+        options.parseOptions(sys.argv[1:] if argv is None else argv)
+    except usage.UsageError as e:
+        _stderr.write("{0}\n{1}\n".format(options, e))
+        return 2
+
+    try:
+        if options["itemsFile"] == "-":
+            items = list(_parseItems(_stdin))
+        else:
+            with open(options["itemsFile"]) as itemsFile:
+                items = list(_parseItems(itemsFile))
+    except (IOError, ValueError) as e:
+        _stderr.write("Can't read items from {0}: {1}\n".format(
+            options["itemsFile"], e))
+        return 2
+
+    def progress(*args):
+        _reportProgress(*args, _stream=_stderr)
+
+    start = time()
+    results = _provision(items, options["processes"], progress,
+                         options["key-type"])
+    elapsed = time() - start
+
+    failed = sum(1 for result in results if result.error is not None)
+    _stderr.write("{0} made, {1} failed, in {2:.2f}s\n".format(
+        len(results) - failed, failed, elapsed))
+
+    return 1 if failed else 0
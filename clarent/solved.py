@@ -0,0 +1,313 @@
+"""
+Compact storage for which users have solved which exercises.
+"""
+import mmap
+import struct
+from binascii import hexlify, unhexlify
+from clarent.exercise import UnknownExercise
+
+
+_BIT_OFFSETS = [tuple(i for i in xrange(8) if byte >> i & 1)
+                for byte in xrange(256)]
+"""For every byte, the offsets of the bits that are set in it.
+
+"""
+
+
+def _toBytes(bits, length):
+    """Serialize a bitmap as the given number of little-endian bytes.
+
+    """
+    data = unhexlify("{0:0{1}x}".format(bits, length * 2))
+    return data[::-1]
+
+
+
+def _fromBytes(data):
+    """Parse a bitmap serialized by ``_toBytes``.
+
+    """
+    return int(hexlify(data[::-1]), 16) if data else 0
+
+
+
+def _fromOrdinals(ordinals):
+    """Make a bitmap with the bits for the given ordinals set.
+
+    """
+    ordinals = list(ordinals)
+    if not ordinals:
+        return 0
+
+    data = bytearray(max(ordinals) // 8 + 1)
+    for ordinal in ordinals:
+        data[ordinal // 8] |= 1 << (ordinal % 8)
+    return _fromBytes(bytes(data))
+
+
+
+def _toOrdinals(bits):
+    """Get the ordinals of the bits set in a bitmap, in order.
+
+    """
+    if not bits:
+        return []
+
+    data = bytearray(_toBytes(bits, (bits.bit_length() + 7) // 8))
+    ordinals = []
+    for index, byte in enumerate(data):
+        if byte:
+            base = index * 8
+            ordinals.extend(base + offset for offset in _BIT_OFFSETS[byte])
+    return ordinals
+
+
+
+class SolvedBitmaps(object):
+    """Which exercises every user has solved, as a bitmap per user.
+
+    Every exercise gets an ordinal, in the order they're added, and
+    every user's solved exercises are the bits set in an integer.
+    Python does bitwise operations on integers a machine word at a
+    time, so solved and unsolved listings only need a few operations
+    over the whole bitmap, and each user takes up about one bit per
+    exercise.
+
+    Users are identified by byte strings.
+
+    Bitmaps can be saved to a file, and opened again with ``open``.
+    Opened files are memory-mapped, and a user's bitmap is only read
+    when it's first used, so opening is quick no matter how many
+    users there are. Call ``close`` to unmap the file when you're
+    done with it.
+
+    """
+    MAGIC = b"CLSB"
+    VERSION = 1
+    _header = struct.Struct("!4sBII")
+    _length = struct.Struct("!H")
+
+    def __init__(self, identifiers=()):
+        self._identifiers = []
+        self._ordinals = {}
+        self._bitmaps = {}
+
+        self._map = None
+        self._mapped = {}
+        self._mappedLength = 0
+
+        for identifier in identifiers:
+            self.addExercise(identifier)
+
+
+    def __len__(self):
+        """The number of users.
+
+        """
+        return len(self.users())
+
+
+    def users(self):
+        """Get all users that have a bitmap, in no particular order.
+
+        """
+        return list(set(self._bitmaps).union(self._mapped))
+
+
+    def addExercise(self, identifier):
+        """Add an exercise, if it hasn't been added yet, and return its
+        ordinal.
+
+        """
+        ordinal = self._ordinals.get(identifier)
+        if ordinal is None:
+            ordinal = self._ordinals[identifier] = len(self._identifiers)
+            self._identifiers.append(identifier)
+        return ordinal
+
+
+    def ordinal(self, identifier):
+        """Get the ordinal of an exercise.
+
+        Raises ``UnknownExercise`` if it hasn't been added.
+
+        """
+        try:
+            return self._ordinals[identifier]
+        except KeyError:
+            raise UnknownExercise()
+
+
+    def _bitmap(self, user):
+        """Get a user's bitmap, reading it from the mapped file if
+        necessary.
+
+        """
+        bits = self._bitmaps.get(user)
+        if bits is None:
+            offset = self._mapped.pop(user, None)
+            if offset is None:
+                return 0
+            end = offset + self._mappedLength
+            bits = self._bitmaps[user] = _fromBytes(self._map[offset:end])
+        return bits
+
+
+    def markSolved(self, user, identifier):
+        """Mark an exercise as solved by a user.
+
+        """
+        bits = self._bitmap(user) | 1 << self.ordinal(identifier)
+        self._bitmaps[user] = bits
+
+
+    def isSolved(self, user, identifier):
+        """Check if a user has solved an exercise.
+
+        """
+        return bool(self._bitmap(user) >> self.ordinal(identifier) & 1)
+
+
+    def setSolved(self, user, identifiers):
+        """Replace the exercises a user has solved.
+
+        """
+        ordinals = [self.ordinal(identifier) for identifier in identifiers]
+        self._mapped.pop(user, None)
+        self._bitmaps[user] = _fromOrdinals(ordinals)
+
+
+    def solved(self, user):
+        """Get the identifiers of the exercises a user has solved, in the
+        order they were added in.
+
+        """
+        return self._identifiersOf(self._bitmap(user))
+
+
+    def unsolved(self, user):
+        """Get the identifiers of the exercises a user hasn't solved, in
+        the order they were added in.
+
+        """
+        everything = (1 << len(self._identifiers)) - 1
+        return self._identifiersOf(everything & ~self._bitmap(user))
+
+
+    def _identifiersOf(self, bits):
+        identifiers = self._identifiers
+        return [identifiers[ordinal] for ordinal in _toOrdinals(bits)]
+
+
+    def dump(self, user):
+        """Serialize a user's bitmap, as one bit per exercise, in
+        little-endian order.
+
+        """
+        return _toBytes(self._bitmap(user), self._rowLength())
+
+
+    def load(self, user, data):
+        """Replace a user's bitmap with one serialized by ``dump``.
+
+        Raises ``ValueError`` if it has bits for exercises that haven't
+        been added.
+
+        """
+        bits = _fromBytes(data)
+        if bits >> len(self._identifiers):
+            raise ValueError("bitmap has bits for unknown exercises")
+        self._mapped.pop(user, None)
+        self._bitmaps[user] = bits
+
+
+    def _rowLength(self):
+        return (len(self._identifiers) + 7) // 8
+
+
+    def save(self, path):
+        """Save the exercises and every user's bitmap to the file at the
+        given ``FilePath``, replacing it.
+
+        The file is first written to a temporary sibling, which is then
+        moved into place.
+
+        """
+        users = self.users()
+        parts = [self._header.pack(self.MAGIC, self.VERSION,
+                                   len(self._identifiers), len(users))]
+        for name in self._identifiers + users:
+            parts.append(self._length.pack(len(name)) + name)
+        parts.extend(self.dump(user) for user in users)
+
+        temporary = path.temporarySibling(".new")
+        with temporary.open("wb") as f:
+            f.write(b"".join(parts))
+        temporary.moveTo(path)
+
+
+    @classmethod
+    def open(cls, path):
+        """Open bitmaps saved with ``save`` from the file at the given
+        ``FilePath``.
+
+        Raises ``ValueError`` if it isn't such a file.
+
+        """
+        bitmaps = cls()
+        with path.open("rb") as f:
+            if path.getsize() == 0:
+                raise ValueError("empty file")
+            bitmaps._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            bitmaps._readMap()
+        except struct.error:
+            bitmaps.close()
+            raise ValueError("truncated file")
+        except ValueError:
+            bitmaps.close()
+            raise
+        return bitmaps
+
+
+    def close(self):
+        """Unmap the file these bitmaps were opened from, if any.
+
+        Bitmaps that haven't been read from it yet are read first, so
+        these bitmaps can still be used, and saved, afterwards.
+
+        """
+        if self._map is None:
+            return
+
+        for user in list(self._mapped):
+            self._bitmap(user)
+        self._map.close()
+        self._map = None
+
+
+    def _readMap(self):
+        data = self._map
+        magic, version, exercises, users = self._header.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("not a solved bitmaps file")
+
+        offset = self._header.size
+        names = []
+        for _ in xrange(exercises + users):
+            length, = self._length.unpack_from(data, offset)
+            offset += self._length.size
+            names.append(data[offset:offset + length])
+            offset += length
+
+        for identifier in names[:exercises]:
+            self.addExercise(identifier)
+
+        self._mappedLength = rowLength = self._rowLength()
+        if offset + rowLength * users != len(data):
+            raise ValueError("file has the wrong length")
+
+        for user in names[exercises:]:
+            self._mapped[user] = offset
+            offset += rowLength
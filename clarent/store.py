@@ -0,0 +1,146 @@
+"""
+A reference in-memory exercise store, with AMP responders.
+"""
+from clarent.exercise import GetExerciseDetails, GetExercises
+from clarent.exercise import UnknownExercise
+from clarent.solved import SolvedBitmaps
+from collections import namedtuple
+from twisted.protocols import amp
+
+
+Exercise = namedtuple("Exercise", "identifier title description")
+
+
+class ExerciseStore(object):
+    """An in-memory catalog of exercises, and which users have solved
+    which of them.
+
+    Exercises are indexed by identifier, and every exercise has its
+    ``GetExercises`` row made and serialized ahead of time, so that
+    answering that command only needs to join the serialized rows
+    together.
+
+    Which exercises users have solved is kept in ``SolvedBitmaps``,
+    so listing a user's solved or unsolved exercises takes a few
+    operations over their bitmap, and a lookup per exercise listed.
+    Pass existing bitmaps (for example, ones opened from a file) to
+    use them; exercises that are added to the store are added to
+    them. Exercises keep their place in the bitmaps, and keep being
+    solved, when they're removed, so that adding them again puts
+    them back where they were.
+
+    """
+    def __init__(self, solved=None):
+        self._exercises = {}
+        self._rows = {}
+        self._solved = SolvedBitmaps() if solved is None else solved
+
+
+    def __len__(self):
+        return len(self._exercises)
+
+
+    def __contains__(self, identifier):
+        return identifier in self._exercises
+
+
+    def add(self, identifier, title, description):
+        """Add an exercise to the catalog, or replace one with the same
+        identifier.
+
+        """
+        self._exercises[identifier] = Exercise(identifier, title, description)
+        row = {b"identifier": identifier, b"title": title}
+        self._rows[identifier] = _exercisesArgument.encodeRow(row)
+        self._solved.addExercise(identifier)
+
+
+    def remove(self, identifier):
+        """Remove an exercise from the catalog.
+
+        Raises ``UnknownExercise`` if there's no such exercise.
+
+        """
+        self.get(identifier)
+        del self._exercises[identifier]
+        del self._rows[identifier]
+
+
+    def get(self, identifier):
+        """Get an exercise.
+
+        Raises ``UnknownExercise`` if there's no such exercise.
+
+        """
+        try:
+            return self._exercises[identifier]
+        except KeyError:
+            raise UnknownExercise()
+
+
+    def markSolved(self, user, identifier):
+        """Mark an exercise as solved by a user.
+
+        Raises ``UnknownExercise`` if there's no such exercise.
+
+        """
+        self.get(identifier)
+        self._solved.markSolved(user, identifier)
+
+
+    def isSolved(self, user, identifier):
+        """Check if a user has solved an exercise.
+
+        """
+        try:
+            return self._solved.isSolved(user, identifier)
+        except UnknownExercise:
+            return False
+
+
+    def rows(self, user, solved):
+        """Get the ``GetExercises`` rows of the exercises that the user
+        has, or hasn't, solved.
+
+        The rows are in the order the exercises were first added in.
+        They're ``EncodedRow``s, which are shared, and mustn't be
+        changed.
+
+        """
+        if solved:
+            identifiers = self._solved.solved(user)
+        else:
+            identifiers = self._solved.unsolved(user)
+
+        rows = self._rows
+        return [rows[identifier] for identifier in identifiers
+                if identifier in rows]
+
+
+
+_exercisesArgument = dict(GetExercises.response)[b"exercises"]
+
+
+
+class ExerciseLocator(amp.CommandLocator):
+    """Responds to exercise commands for a user, using an exercise store.
+
+    """
+    def __init__(self, store, user):
+        self.store = store
+        self.user = user
+
+
+    @GetExercises.responder
+    def getExercises(self, solved):
+        return {b"exercises": self.store.rows(self.user, solved)}
+
+
+    @GetExerciseDetails.responder
+    def getExerciseDetails(self, identifier):
+        exercise = self.store.get(identifier)
+        return {
+            b"title": exercise.title,
+            b"description": exercise.description,
+            b"solved": self.store.isSolved(self.user, identifier)
+        }
@@ -0,0 +1,264 @@
+from clarent import arguments
+from clarent.arguments import Chunked
+from os import urandom
+from twisted.protocols import amp
+from twisted.test.iosim import FakeTransport, connect
+from twisted.trial.unittest import SynchronousTestCase
+import zlib
+
+
+class CompressedUnicodeTests(SynchronousTestCase):
+    """Tests for the compressed Unicode argument.
+
+    """
+    def setUp(self):
+        self.argument = arguments.CompressedUnicode(threshold=10)
+
+
+    def test_short(self):
+        """Short values aren't compressed.
+
+        """
+        self.assertEqual(self.argument.toString(u"\N{SNOWMAN}"),
+                         b"\x00" + u"\N{SNOWMAN}".encode("utf-8"))
+
+
+    def test_compressed(self):
+        """Long, compressible values are compressed.
+
+        """
+        value = u"\N{SNOWMAN}" * 1000
+        string = self.argument.toString(value)
+        self.assertEqual(string[:1], b"\x01")
+        self.assertTrue(len(string) < 100)
+        self.assertEqual(self.argument.fromString(string), value)
+
+
+    def test_incompressible(self):
+        """Long values that don't get smaller aren't compressed.
+
+        """
+        value = urandom(100).encode("hex").decode("ascii")
+        self.argument.level = 0
+        string = self.argument.toString(value)
+        self.assertEqual(string, b"\x00" + value.encode("ascii"))
+
+
+    def test_roundtrip(self):
+        """Values can be parsed again, compressed or not.
+
+        """
+        for value in [u"", u"short", u"\N{CLOUD}" * 100]:
+            string = self.argument.toString(value)
+            self.assertEqual(self.argument.fromString(string), value)
+
+
+    def test_tooLong(self):
+        """Values that decompress to more than the maximum length are
+        rejected.
+
+        """
+        self.argument.maxLength = 100
+        string = b"\x01" + zlib.compress(b"x" * 101)
+        self.assertRaises(ValueError, self.argument.fromString, string)
+
+
+    def test_unknownFlag(self):
+        """Values with an unknown flag are rejected.
+
+        """
+        self.assertRaises(ValueError, self.argument.fromString, b"\x02abc")
+
+
+    def test_optional(self):
+        """The argument can be optional.
+
+        """
+        self.assertTrue(arguments.CompressedUnicode(optional=True).optional)
+
+
+
+class IdentifierTests(SynchronousTestCase):
+    """Tests for the identifier argument.
+
+    """
+    def setUp(self):
+        self.argument = arguments.Identifier()
+
+
+    def test_wireCompatible(self):
+        """Identifiers are serialized the same way as strings.
+
+        """
+        self.assertEqual(self.argument.toString(b"abc"),
+                         amp.String().toString(b"abc"))
+
+
+    def test_interned(self):
+        """Parsed identifiers are interned.
+
+        """
+        first = self.argument.fromString(b"".join([b"ab", b"c"]))
+        second = self.argument.fromString(b"".join([b"a", b"bc"]))
+        self.assertEqual(first, b"abc")
+        self.assertIdentical(first, second)
+
+
+    def test_list(self):
+        """Identifiers in a list are interned too.
+
+        """
+        argument = amp.ListOf(arguments.Identifier())
+        string = argument.toString([b"xyz", b"xyz"])
+        first, second = argument.fromString(string)
+        self.assertIdentical(first, second)
+
+
+
+class EncodedAmpListTests(SynchronousTestCase):
+    """Tests for AMP lists with rows serialized ahead of time.
+
+    """
+    def setUp(self):
+        self.argument = arguments.EncodedAmpList([
+            (b"identifier", arguments.Identifier()),
+            (b"title", amp.Unicode())
+        ])
+        self.plain = amp.AmpList(self.argument.subargs)
+        self.rows = [
+            {b"identifier": b"a", b"title": u"\N{SNOWMAN}"},
+            {b"identifier": b"b", b"title": u"B"}
+        ]
+
+
+    def _serialize(self, argument, rows):
+        return argument.toStringProto(rows, None)
+
+
+    def test_encodeRow(self):
+        """Encoded rows have the same items as the rows they were made
+        from, and remember how they're serialized.
+
+        """
+        row = self.argument.encodeRow(self.rows[0])
+        self.assertEqual(row, self.rows[0])
+        self.assertEqual(row.encoded, self._serialize(self.plain, [row]))
+
+
+    def test_wireCompatible(self):
+        """Lists of encoded rows, plain rows, or both, are serialized like
+        an ``AmpList`` would serialize them, and parsed the same way.
+
+        """
+        encoded = [self.argument.encodeRow(row) for row in self.rows]
+        mixed = [encoded[0], self.rows[1]]
+        expected = self._serialize(self.plain, self.rows)
+        for rows in [encoded, self.rows, mixed]:
+            self.assertEqual(self._serialize(self.argument, rows), expected)
+
+        parsed = self.argument.fromStringProto(expected, None)
+        self.assertEqual(parsed, self.rows)
+
+
+    def test_encodedRowsUsed(self):
+        """Encoded rows aren't serialized again.
+
+        """
+        row = self.argument.encodeRow(self.rows[0])
+        row.encoded = b"sentinel"
+        self.assertEqual(self._serialize(self.argument, [row]), b"sentinel")
+
+
+
+class ChunkedEcho(amp.Command):
+    arguments = [(b"value", Chunked(amp.String()))]
+    response = [(b"value", Chunked(amp.String()))]
+
+
+
+class EchoServer(amp.AMP):
+    @ChunkedEcho.responder
+    def echo(self, value):
+        return {"value": value}
+
+
+
+class ChunkedTests(SynchronousTestCase):
+    """Tests for the chunked argument.
+
+    """
+    def setUp(self):
+        self.argument = arguments.Chunked(amp.String(), chunkSize=3)
+
+
+    def toBox(self, value):
+        strings = {}
+        self.argument.toBox(b"value", strings, {"value": value}, None)
+        return strings
+
+
+    def fromBox(self, strings):
+        objects = {}
+        self.argument.fromBox(b"value", dict(strings), objects, None)
+        return objects["value"]
+
+
+    def test_split(self):
+        """Values are split into chunks of at most the chunk size.
+
+        """
+        self.assertEqual(self.toBox(b"abcdefg"), {
+            b"value": b"3",
+            b"value.0": b"abc",
+            b"value.1": b"def",
+            b"value.2": b"g"
+        })
+
+
+    def test_empty(self):
+        """Empty values are stored in a single empty chunk.
+
+        """
+        self.assertEqual(self.toBox(b""), {b"value": b"1", b"value.0": b""})
+
+
+    def test_roundtrip(self):
+        """Values can be put back together again.
+
+        """
+        for value in [b"", b"a", b"abc", b"abcdefg"]:
+            self.assertEqual(self.fromBox(self.toBox(value)), value)
+
+
+    def test_missingChunk(self):
+        """A box that's missing a chunk is rejected.
+
+        """
+        strings = self.toBox(b"abcdefg")
+        del strings[b"value.1"]
+        self.assertRaises(KeyError, self.fromBox, strings)
+
+
+    def test_optional(self):
+        """Optional values that are missing aren't in the box, and are
+        parsed as ``None``.
+
+        """
+        self.argument = arguments.Chunked(amp.String(), optional=True)
+        self.assertEqual(self.toBox(None), {})
+        self.assertIdentical(self.fromBox({}), None)
+
+
+    def test_overLimit(self):
+        """Values longer than AMP's limit on a single value can be sent
+        over an AMP connection.
+
+        """
+        server, client = EchoServer(), amp.AMP()
+        pump = connect(server, FakeTransport(server, True),
+                       client, FakeTransport(client, False))
+
+        value = urandom(arguments.MAX_VALUE_LENGTH * 2 + 1)
+        d = client.callRemote(ChunkedEcho, value=value)
+        pump.flush()
+        self.assertEqual(self.successResultOf(d), {"value": value})
@@ -0,0 +1,316 @@
+from clarent import cache, exercise
+from os import utime
+from twisted.internet.defer import succeed
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+
+class ExerciseDetailsCacheTests(SynchronousTestCase):
+    """Tests for the on-disk cache of exercise details.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.cache = cache.ExerciseDetailsCache(self.path)
+
+
+    def test_defaultPath(self):
+        """By default, the cache is stored under the data path.
+
+        """
+        dataPath = FilePath(self.mktemp())
+        dataPath.makedirs()
+        c = cache.ExerciseDetailsCache(_getDataPath=lambda: dataPath)
+        self.assertEqual(c.path, dataPath.child("exercises"))
+        self.assertTrue(c.path.isdir())
+
+
+    def test_missing(self):
+        """Exercises that aren't cached have no revision or details.
+
+        """
+        self.assertIdentical(self.cache.revision("a"), None)
+        self.assertIdentical(self.cache.get("a"), None)
+
+
+    def test_putAndGet(self):
+        """Stored details can be retrieved again.
+
+        """
+        self.cache.put("a", "r1", u"\N{SNOWMAN}", u"description")
+        self.assertEqual(self.cache.revision("a"), "r1")
+        self.assertEqual(self.cache.get("a"), {
+            b"revision": "r1",
+            b"title": u"\N{SNOWMAN}",
+            b"description": u"description"
+        })
+
+
+    def test_replace(self):
+        """Storing a new revision replaces the old one.
+
+        """
+        self.cache.put("a", "r1", u"old", u"old")
+        self.cache.put("a", "r2", u"new", u"new")
+
+        self.assertEqual(self.cache.get("a")[b"title"], u"new")
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(len(self.path.children()), 1)
+
+
+    def test_persistent(self):
+        """The cache survives restarts.
+
+        """
+        self.cache.put("a", "r1", u"title", u"description")
+        reopened = cache.ExerciseDetailsCache(self.path)
+        self.assertEqual(reopened.get("a")[b"title"], u"title")
+        self.assertEqual(reopened.size, self.cache.size)
+
+
+    def test_anyBytes(self):
+        """Identifiers and revisions that have dots, slashes or other bytes
+        in them can be stored, and survive restarts.
+
+        """
+        values = ["v1.2", "a/b", "../..", "\x00\xff", ""]
+        for identifier, revision in zip(values, reversed(values)):
+            self.cache.put(identifier, revision, u"title", u"description")
+
+        reopened = cache.ExerciseDetailsCache(self.path)
+        self.assertEqual(reopened.size, self.cache.size)
+        for identifier, revision in zip(values, reversed(values)):
+            self.assertEqual(reopened.revision(identifier), revision)
+            self.assertEqual(reopened.get(identifier)[b"revision"], revision)
+        self.assertEqual(len(self.path.children()), len(values))
+
+
+    def test_longIdentifiers(self):
+        """Identifiers and revisions too long for a file name can be stored,
+        and survive restarts.
+
+        """
+        identifier, revision = "i" * 1000, "f" * 64
+        self.cache.put(identifier, revision, u"title", u"description")
+
+        reopened = cache.ExerciseDetailsCache(self.path)
+        self.assertEqual(reopened.revision(identifier), revision)
+        self.assertEqual(reopened.get(identifier)[b"title"], u"title")
+
+
+    def test_evictAfterRestart(self):
+        """Exercises loaded after a restart are evicted when the cache is too
+        big, whatever their revisions.
+
+        """
+        self.cache.put("a", "v1.2", u"title", u"x" * 100)
+        self.cache.put("b", "v1.3", u"title", u"x" * 100)
+
+        reopened = cache.ExerciseDetailsCache(self.path)
+        reopened.maxSize = reopened.size - 1
+        reopened._evict()
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(len(self.path.children()), 1)
+
+
+    def test_mismatch(self):
+        """Cached details that are for another exercise or revision than
+        their entry are removed.
+
+        """
+        self.cache.put("a", "r1", u"title", u"x")
+        self.cache.put("b", "r2", u"title", u"x")
+        self.path.child(cache._fileName("a")).setContent(
+            self.path.child(cache._fileName("b")).getContent())
+        self.assertIdentical(self.cache.get("a"), None)
+        self.assertIdentical(self.cache.revision("a"), None)
+
+
+    def test_ignoresOtherFiles(self):
+        """Files that aren't cached exercises are ignored.
+
+        """
+        self.cache.put("a", "r1", u"title", u"x")
+        content = self.path.child(cache._fileName("a")).getContent()
+        self.path.child(cache._fileName("a")).remove()
+
+        self.path.child("README").setContent("hi")
+        self.path.child("zz.json").setContent(content)
+        self.path.child(cache._fileName("a") + ".new").setContent(content)
+        self.path.child(cache._fileName("b")).setContent(content)
+        self.path.child(cache._fileName("c")).setContent("{")
+        self.assertEqual(len(cache.ExerciseDetailsCache(self.path)), 0)
+
+
+    def test_evictLeastRecentlyUsed(self):
+        """When the cache is too big, the least recently used exercises are
+        removed.
+
+        """
+        self.cache.put("a", "r1", u"title", u"x" * 100)
+        size = self.cache.size
+        self.cache.maxSize = 2 * size
+
+        self.cache.put("b", "r1", u"title", u"x" * 100)
+        self.cache.get("a")
+        self.cache.put("c", "r1", u"title", u"x" * 100)
+
+        self.assertIdentical(self.cache.revision("b"), None)
+        self.assertEqual(self.cache.revision("a"), "r1")
+        self.assertEqual(self.cache.revision("c"), "r1")
+        self.assertEqual(self.cache.size, 2 * size)
+        self.assertEqual(len(self.path.children()), 2)
+
+
+    def test_useOrderSurvivesRestarts(self):
+        """The order of use is kept across restarts.
+
+        """
+        self.cache.put("a", "r1", u"title", u"x")
+        self.cache.put("b", "r1", u"title", u"x")
+        utime(self.path.child(cache._fileName("a")).path, (1, 1))
+
+        reopened = cache.ExerciseDetailsCache(self.path)
+        reopened.maxSize = reopened.size - 1
+        reopened._evict()
+        self.assertIdentical(reopened.revision("a"), None)
+        self.assertEqual(reopened.revision("b"), "r1")
+
+
+    def test_corrupt(self):
+        """Corrupt cached details are removed.
+
+        """
+        self.cache.put("a", "r1", u"title", u"x")
+        self.path.child(cache._fileName("a")).setContent("{")
+        self.assertIdentical(self.cache.get("a"), None)
+        self.assertIdentical(self.cache.revision("a"), None)
+        self.assertEqual(self.cache.size, 0)
+
+
+
+class FakeProtocol(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+
+    def callRemote(self, command, **kwargs):
+        self.calls.append((command, kwargs))
+        return succeed(self.responses.pop(0))
+
+
+
+class GetExerciseDetailsTests(SynchronousTestCase):
+    """Tests for getting exercise details through the cache.
+
+    """
+    def setUp(self):
+        self.cache = cache.ExerciseDetailsCache(FilePath(self.mktemp()))
+
+
+    def _get(self, *responses):
+        protocol = FakeProtocol(list(responses))
+        d = cache.getExerciseDetails(protocol, "a", self.cache)
+        return self.successResultOf(d), protocol.calls
+
+
+    def test_notCached(self):
+        """When the details aren't cached, they're fetched and cached.
+
+        """
+        details, calls = self._get({
+            b"modified": True,
+            b"revision": "r1",
+            b"title": u"title",
+            b"description": u"description",
+            b"solved": False
+        })
+
+        self.assertEqual(calls, [
+            (exercise.GetExerciseDetailsIfChanged,
+             {"identifier": "a", "revision": None})
+        ])
+        self.assertEqual(details, {
+            b"title": u"title",
+            b"description": u"description",
+            b"solved": False
+        })
+        self.assertEqual(self.cache.revision("a"), "r1")
+
+
+    def test_cached(self):
+        """When the cached details are current, they're used.
+
+        """
+        self.cache.put("a", "r1", u"title", u"description")
+        details, calls = self._get({
+            b"modified": False,
+            b"revision": "r1",
+            b"title": None,
+            b"description": None,
+            b"solved": True
+        })
+
+        self.assertEqual(calls, [
+            (exercise.GetExerciseDetailsIfChanged,
+             {"identifier": "a", "revision": "r1"})
+        ])
+        self.assertEqual(details, {
+            b"title": u"title",
+            b"description": u"description",
+            b"solved": True
+        })
+
+
+    def test_evictedWhileAsking(self):
+        """When the cached details disappear while asking whether they're
+        current, they're fetched again.
+
+        """
+        self.cache.put("a", "r1", u"title", u"description")
+        notModified = {
+            b"modified": False,
+            b"revision": "r1",
+            b"title": None,
+            b"description": None,
+            b"solved": True
+        }
+        protocol = FakeProtocol([notModified, {
+            b"modified": True,
+            b"revision": "r1",
+            b"title": u"title",
+            b"description": u"description",
+            b"solved": True
+        }])
+        original = protocol.callRemote
+        def callRemote(command, **kwargs):
+            self.cache.remove("a")
+            return original(command, **kwargs)
+        protocol.callRemote = callRemote
+
+        d = cache.getExerciseDetails(protocol, "a", self.cache)
+        self.assertEqual(self.successResultOf(d)[b"title"], u"title")
+        self.assertEqual([kwargs[b"revision"] for _, kwargs in protocol.calls],
+                         ["r1", None])
+
+
+    def test_storingFails(self):
+        """When the fetched details can't be stored, the failure is logged,
+        and the details are still returned.
+
+        """
+        def put(identifier, revision, title, description):
+            raise IOError(36, "File name too long")
+        self.cache.put = put
+
+        details, _ = self._get({
+            b"modified": True,
+            b"revision": "r1",
+            b"title": u"title",
+            b"description": u"description",
+            b"solved": False
+        })
+        self.assertEqual(details[b"title"], u"title")
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertIdentical(self.cache.revision("a"), None)
@@ -1,9 +1,14 @@
 from clarent import certificate
 from datetime import datetime
-from inspect import getargspec
 from OpenSSL import crypto, SSL
+from OpenSSL._util import lib as _lib
+from twisted.internet.defer import Deferred, DeferredSemaphore
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
+import os
+import subprocess
+import sys
 
 
 class FakePKey(object):
@@ -23,9 +28,9 @@ class KeyGenerationTests(SynchronousTestCase):
         """The key generation routine uses PKey by default.
 
         """
-        argspec = getargspec(certificate._generateKey)
-        default = argspec.defaults[argspec.args.index("_PKey")]
-        self.assertIdentical(default, crypto.PKey)
+        self.patch(crypto, "PKey", FakePKey)
+        key = certificate._generateKey()
+        self.assertIsInstance(key, FakePKey)
 
 
     def test_generateKey(self):
@@ -37,6 +42,32 @@ class KeyGenerationTests(SynchronousTestCase):
         self.assertEqual(key.keyLength, 4096)
 
 
+    def test_generateRSAKey(self):
+        """Asking for an RSA key explicitly generates a 4096-bit RSA key.
+
+        """
+        key = certificate._generateKey(certificate.RSA, _PKey=FakePKey)
+        self.assertIdentical(key.keyType, crypto.TYPE_RSA)
+        self.assertEqual(key.keyLength, 4096)
+
+
+    def test_generateECDSAKey(self):
+        """The key generation routine can generate ECDSA keys on the P-256
+        curve.
+
+        """
+        key = certificate._generateKey(certificate.ECDSA)
+        self.assertEqual(key.bits(), 256)
+        self.assertNotEqual(key.type(), crypto.TYPE_RSA)
+
+
+    def test_unknownKeyType(self):
+        """Asking for an unknown key type raises ValueError.
+
+        """
+        self.assertRaises(ValueError, certificate._generateKey, "rot13")
+
+
 
 # This ugly private key is in here so that we can avoid generating one
 # every test run.
@@ -92,6 +123,16 @@ class CertificateTests(SynchronousTestCase):
                          "sha512WithRSAEncryption")
 
 
+    def test_makeECDSACertificate(self):
+        """Certificates for ECDSA keys are self-signed with ECDSA and
+        SHA-512.
+
+        """
+        key = certificate._generateKey(certificate.ECDSA)
+        cert = certificate._makeCertificate(key, u"test@example.com")
+        self.assertEqual(cert.get_signature_algorithm(), "ecdsa-with-SHA512")
+
+
     def test_certificateRoundtrip(self):
         """A certificate can be dumped to a string and read again.
 
@@ -106,7 +147,8 @@ class MakeCredentialsTests(SynchronousTestCase):
     def setUp(self):
         self.path = FilePath(self.mktemp())
         self.path.makedirs()
-        self.patch(certificate, "_generateKey", lambda: testKey)
+        self.patch(certificate, "_generateKey", lambda keyType: testKey)
+        self.addCleanup(certificate.clearContextFactoryCache)
 
 
     def _makeCredentials(self):
@@ -123,6 +165,29 @@ class MakeCredentialsTests(SynchronousTestCase):
         certificate.getContextFactory(self.path)
 
 
+    def test_makeCredentialsWithKey(self):
+        """When given a key, making credentials uses it instead of
+        generating one.
+
+        """
+        self.patch(certificate, "_generateKey", lambda keyType: 1 // 0)
+        certificate.makeCredentials(self.path, u"test@example.test", testKey)
+        certificate.getContextFactory(self.path)
+
+
+    def test_makeECDSACredentials(self):
+        """Credentials can be made with ECDSA keys, and used to build a TLS
+        context.
+
+        """
+        self.patch(certificate, "_generateKey", certificate._generateKey)
+        certificate.makeCredentials(self.path, u"test@example.test",
+                                    keyType=certificate.ECDSA)
+
+        ctxFactory = certificate.getContextFactory(self.path)
+        ctxFactory.getContext()
+
+
     def test_makeCredentialsMultipleTimes(self):
         """Attempting to generate credentials when the credentials file
         exists already raises OSError.
@@ -138,6 +203,373 @@ class MakeCredentialsTests(SynchronousTestCase):
 
 
 
+class FakeThreads(object):
+    """Fake replacement for ``deferToThread``, that doesn't run anything
+    until asked to.
+
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def deferToThread(self, f, *args, **kwargs):
+        d = Deferred()
+        self.calls.append((d, f, args, kwargs))
+        return d
+
+
+    def runOne(self):
+        """Runs the oldest pending call, and fires its deferred with the
+        result.
+
+        """
+        d, f, args, kwargs = self.calls.pop(0)
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            d.errback()
+        else:
+            d.callback(result)
+
+
+
+class KeyPoolTests(SynchronousTestCase):
+    """Tests for the pool of pre-generated keys.
+
+    """
+    def setUp(self):
+        self.threads = FakeThreads()
+        self.generated = []
+        self.keyTypes = []
+        self.pool = certificate.KeyPool(
+            size=3, lowWater=1,
+            _generateKey=self._generateKey,
+            _deferToThread=self.threads.deferToThread)
+
+
+    def _generateKey(self, keyType):
+        self.keyTypes.append(keyType)
+        key = object()
+        self.generated.append(key)
+        return key
+
+
+    def _fill(self):
+        while self.threads.calls:
+            self.threads.runOne()
+
+
+    def test_keyType(self):
+        """The pool generates keys of its key type; RSA by default.
+
+        """
+        self.assertEqual(self.pool.keyType, certificate.RSA)
+        self.pool.keyType = certificate.ECDSA
+        self.pool.start()
+        self.threads.runOne()
+        self.assertEqual(self.keyTypes, [certificate.ECDSA])
+
+
+    def test_badWaterMarks(self):
+        """The low-water mark must be non-negative and less than the size of
+        the pool.
+
+        """
+        self.assertRaises(ValueError, certificate.KeyPool, 3, 3)
+        self.assertRaises(ValueError, certificate.KeyPool, 3, -1)
+
+
+    def test_lazy(self):
+        """The pool doesn't generate any keys until it's started.
+
+        """
+        self.assertEqual(self.threads.calls, [])
+        self.assertEqual(len(self.pool), 0)
+
+
+    def test_start(self):
+        """Starting the pool fills it up to its size, generating one key at a
+        time in a thread.
+
+        """
+        self.pool.start()
+        for expected in range(3):
+            self.assertEqual(len(self.threads.calls), 1)
+            self.assertEqual(len(self.pool), expected)
+            self.threads.runOne()
+
+        self.assertEqual(self.threads.calls, [])
+        self.assertEqual(len(self.pool), 3)
+
+
+    def test_getKeyFromFullPool(self):
+        """Getting a key from a pool with keys available returns one
+        immediately, without generating any new keys until the pool
+        hits the low-water mark.
+
+        """
+        self.pool.start()
+        self._fill()
+
+        key = self.successResultOf(self.pool.getKey())
+        self.assertIdentical(key, self.generated[0])
+        self.assertEqual(self.threads.calls, [])
+
+        self.successResultOf(self.pool.getKey())
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(len(self.threads.calls), 1)
+
+        self._fill()
+        self.assertEqual(len(self.pool), 3)
+
+
+    def test_keysHandedOutOnce(self):
+        """Every key is handed out only once.
+
+        """
+        keys = [self.pool.getKey() for _ in range(5)]
+        self._fill()
+
+        keys = [self.successResultOf(d) for d in keys]
+        self.assertEqual(len(set(map(id, keys))), 5)
+
+
+    def test_getKeyFromEmptyPool(self):
+        """Getting a key from an empty pool returns a deferred that fires when
+        a key has been generated.
+
+        """
+        d = self.pool.getKey()
+        self.assertNoResult(d)
+
+        self.threads.runOne()
+        self.assertIdentical(self.successResultOf(d), self.generated[0])
+
+
+    def test_generationFails(self):
+        """If generating a key fails, everyone waiting for a key gets the
+        failure. Asking for a key again tries again.
+
+        """
+        self.pool._generateKey = lambda keyType: 1 // 0
+        first, second = self.pool.getKey(), self.pool.getKey()
+        self.threads.runOne()
+        self.failureResultOf(first, ZeroDivisionError)
+        self.failureResultOf(second, ZeroDivisionError)
+        self.assertEqual(self.threads.calls, [])
+
+        self.pool._generateKey = self._generateKey
+        d = self.pool.getKey()
+        self.threads.runOne()
+        self.assertIdentical(self.successResultOf(d), self.generated[0])
+
+
+    def test_generationFailsInBackground(self):
+        """If generating a key fails while nobody is waiting for one, the
+        failure is logged.
+
+        """
+        self.pool._generateKey = lambda keyType: 1 // 0
+        self.pool.start()
+        self.threads.runOne()
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+
+
+class MakeCredentialsAsyncTests(SynchronousTestCase):
+    """Tests for making credentials in a thread.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        self.patch(certificate, "_generateKey", lambda keyType: testKey)
+        self.addCleanup(certificate.clearContextFactoryCache)
+        self.threads = FakeThreads()
+
+
+    def _makeCredentials(self, path=None, **kwargs):
+        return certificate.makeCredentialsAsync(
+            path or self.path, u"test@example.test",
+            _deferToThread=self.threads.deferToThread, **kwargs)
+
+
+    def test_makeCredentialsInThread(self):
+        """Credentials are made in a thread. The returned deferred fires once
+        they're on disk.
+
+        """
+        d = self._makeCredentials()
+        self.assertNoResult(d)
+        self.assertRaises(IOError, certificate.getContextFactory, self.path)
+
+        self.threads.runOne()
+        self.successResultOf(d)
+        certificate.getContextFactory(self.path)
+
+
+    def test_keyType(self):
+        """The key type is passed along to ``makeCredentials``.
+
+        """
+        self._makeCredentials(keyType=certificate.ECDSA)
+        (_, _, _, kwargs), = self.threads.calls
+        self.assertEqual(kwargs, {"keyType": certificate.ECDSA})
+
+
+    def test_failure(self):
+        """If making the credentials fails, the returned deferred fails.
+
+        """
+        self._makeCredentials()
+        self.threads.runOne()
+
+        d = self._makeCredentials()
+        self.threads.runOne()
+        self.failureResultOf(d, OSError)
+
+
+    def test_keyPool(self):
+        """When given a key pool, the key is taken from the pool.
+
+        """
+        self.patch(certificate, "_generateKey", lambda keyType: 1 // 0)
+        pool = certificate.KeyPool(
+            _generateKey=lambda keyType: testKey,
+            _deferToThread=self.threads.deferToThread)
+
+        d = self._makeCredentials(keyPool=pool)
+        self.threads.runOne() # generate the key
+        self.threads.runOne() # make the credentials
+        self.successResultOf(d)
+        certificate.getContextFactory(self.path)
+
+
+    def test_semaphore(self):
+        """When given a semaphore, no more calls than it has tokens run at
+        the same time.
+
+        """
+        semaphore = DeferredSemaphore(1)
+        otherPath = FilePath(self.mktemp())
+        otherPath.makedirs()
+
+        first = self._makeCredentials(semaphore=semaphore)
+        second = self._makeCredentials(otherPath, semaphore=semaphore)
+        self.assertEqual(len(self.threads.calls), 1)
+
+        self.threads.runOne()
+        self.successResultOf(first)
+        self.assertEqual(len(self.threads.calls), 1)
+
+        self.threads.runOne()
+        self.successResultOf(second)
+
+
+
+class GetContextFactoryCacheTests(SynchronousTestCase):
+    """Tests for caching context factories for credentials on disk.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        certificate.makeCredentials(self.path, u"test@example.test", testKey)
+        self.addCleanup(certificate.clearContextFactoryCache)
+
+        self.loads = []
+        load = certificate._loadContextFactory
+        def _loadContextFactory(*args):
+            self.loads.append(args)
+            return load(*args)
+        self.patch(certificate, "_loadContextFactory", _loadContextFactory)
+
+
+    def _rewriteCredentials(self):
+        self.path.child("client.pem").remove()
+        key = certificate._generateKey(certificate.ECDSA)
+        certificate.makeCredentials(self.path, u"test@example.test", key)
+
+
+    def test_cached(self):
+        """As long as the credentials don't change, the same context factory
+        is returned, and the credentials are only loaded once.
+
+        """
+        ctxFactory = certificate.getContextFactory(self.path)
+        self.assertIdentical(certificate.getContextFactory(self.path),
+                             ctxFactory)
+        self.assertEqual(len(self.loads), 1)
+
+
+    def test_credentialsChanged(self):
+        """When the credentials change, they're loaded again.
+
+        """
+        ctxFactory = certificate.getContextFactory(self.path)
+        self._rewriteCredentials()
+
+        newCtxFactory = certificate.getContextFactory(self.path)
+        self.assertNotIdentical(newCtxFactory, ctxFactory)
+        self.assertIdentical(certificate.getContextFactory(self.path),
+                             newCtxFactory)
+        self.assertEqual(len(self.loads), 2)
+
+
+    def test_credentialsRemoved(self):
+        """When the credentials are removed, IOError is raised, even if they
+        were cached.
+
+        """
+        certificate.getContextFactory(self.path)
+        self.path.child("client.pem").remove()
+        self.assertRaises(IOError, certificate.getContextFactory, self.path)
+
+
+    def test_sessionResumption(self):
+        """Context factories with different session resumption settings are
+        cached separately.
+
+        """
+        settings = certificate.SessionResumption()
+        plain = certificate.getContextFactory(self.path)
+        resuming = certificate.getContextFactory(self.path, settings)
+
+        self.assertNotIdentical(plain, resuming)
+        self.assertIdentical(resuming.sessionResumption, settings)
+        self.assertIdentical(certificate.getContextFactory(self.path, settings),
+                             resuming)
+
+
+    def test_bounded(self):
+        """Only the most recently used context factories are kept, so new
+        settings for every call don't fill the cache.
+
+        """
+        self.patch(certificate, "_maxCachedContextFactories", 2)
+        first = certificate.getContextFactory(self.path)
+        for _ in xrange(5):
+            settings = certificate.SessionResumption()
+            certificate.getContextFactory(self.path, settings)
+            self.assertIdentical(certificate.getContextFactory(self.path),
+                                 first)
+
+        self.assertEqual(len(certificate._contextFactories), 2)
+        self.assertEqual(len(self.loads), 6)
+
+
+    def test_clear(self):
+        """After clearing the cache, credentials are loaded again.
+
+        """
+        ctxFactory = certificate.getContextFactory(self.path)
+        certificate.clearContextFactoryCache()
+        self.assertNotIdentical(certificate.getContextFactory(self.path),
+                                ctxFactory)
+        self.assertEqual(len(self.loads), 2)
+
+
+
 class SecureCiphersContextFactoryTests(SynchronousTestCase):
     def setUp(self):
         ctxFactory = FakeContextFactory()
@@ -168,8 +600,430 @@ class SecureCiphersContextFactoryTests(SynchronousTestCase):
 
 
 
+class CachingSecureCiphersContextFactoryTests(SynchronousTestCase):
+    """Tests for caching the context in the secure ciphers context factory.
+
+    """
+    def setUp(self):
+        self.wrapped = FakeContextFactory()
+
+
+    def test_noCachingByDefault(self):
+        """By default, a new context is built every time.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(self.wrapped)
+        self.assertNotIdentical(factory.getContext(), factory.getContext())
+        self.assertEqual(self.wrapped.contextsMade, 2)
+
+
+    def test_caching(self):
+        """When caching, the context is only built once, and is hardened.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            self.wrapped, cacheContext=True)
+        ctx = factory.getContext()
+
+        self.assertIdentical(factory.getContext(), ctx)
+        self.assertEqual(self.wrapped.contextsMade, 1)
+        self.assertEqual(ctx.ciphers, certificate.ciphersuites)
+        self.assertTrue(ctx.options & SSL.OP_NO_COMPRESSION)
+
+
+    def test_invalidate(self):
+        """After invalidating the cache, a new context is built.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            self.wrapped, cacheContext=True)
+        ctx = factory.getContext()
+
+        factory.invalidate()
+        newCtx = factory.getContext()
+        self.assertNotIdentical(newCtx, ctx)
+        self.assertIdentical(factory.getContext(), newCtx)
+        self.assertEqual(self.wrapped.contextsMade, 2)
+
+
+    def test_invalidateReloads(self):
+        """When invalidated, a factory that knows how to reload the wrapped
+        context factory does so, and gets its contexts from the new
+        one.
+
+        """
+        reloaded = FakeContextFactory()
+        factory = certificate.SecureCiphersContextFactory(
+            self.wrapped, cacheContext=True,
+            reloadContextFactory=lambda: reloaded)
+        factory.getContext()
+
+        factory.invalidate()
+        self.assertIdentical(factory.ctxFactory, reloaded)
+        factory.getContext()
+        self.assertEqual(reloaded.contextsMade, 1)
+
+
+    def test_invalidateReloadFails(self):
+        """If reloading the wrapped context factory fails, the factory keeps
+        its old one.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            self.wrapped, reloadContextFactory=lambda: 1 // 0)
+        self.assertRaises(ZeroDivisionError, factory.invalidate)
+        self.assertIdentical(factory.ctxFactory, self.wrapped)
+
+
+
+class InvalidateCertificateOptionsTests(SynchronousTestCase):
+    """Tests for invalidating context factories from ``getContextFactory``,
+    which wrap real ``CertificateOptions``.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        certificate.makeCredentials(self.path, u"test@example.test", testKey)
+        self.addCleanup(certificate.clearContextFactoryCache)
+
+
+    def _certificate(self, ctx):
+        """Get the certificate a context uses.
+
+        """
+        return SSL.Connection(ctx, None).get_certificate()
+
+
+    def test_invalidate(self):
+        """``CertificateOptions`` caches its context, but after invalidating,
+        a new one is built.
+
+        """
+        factory = certificate.getContextFactory(self.path)
+        ctx = factory.getContext()
+        self.assertIdentical(factory.getContext(), ctx)
+
+        factory.invalidate()
+        self.assertNotIdentical(factory.getContext(), ctx)
+
+
+    def test_rotate(self):
+        """After the credentials are replaced, invalidating makes the
+        factory use the new ones.
+
+        """
+        factory = certificate.getContextFactory(self.path)
+        old = self._certificate(factory.getContext())
+
+        self.path.child("client.pem").remove()
+        key = certificate._generateKey(certificate.ECDSA)
+        certificate.makeCredentials(self.path, u"test@example.test", key)
+        unchanged = self._certificate(factory.getContext())
+        self.assertEqual(unchanged.digest("sha256"), old.digest("sha256"))
+
+        factory.invalidate()
+        new = self._certificate(factory.getContext())
+        self.assertNotEqual(new.digest("sha256"), old.digest("sha256"))
+        self.assertEqual(new.get_pubkey().bits(), 256)
+
+
+    def test_credentialsRemoved(self):
+        """Invalidating raises IOError if the credentials were removed.
+
+        """
+        factory = certificate.getContextFactory(self.path)
+        self.path.child("client.pem").remove()
+        self.assertRaises(IOError, factory.invalidate)
+
+
+
+class SessionResumptionTests(SynchronousTestCase):
+    """Tests for TLS session resumption settings.
+
+    """
+    def test_configure(self):
+        """Configuring a context sets the session ID context, enables the
+        session cache with the given timeout and disables tickets.
+
+        """
+        ctx = FakeContext()
+        certificate.SessionResumption(b"abc", timeout=10).configure(ctx)
+
+        self.assertEqual(ctx.sessionID, b"abc")
+        self.assertEqual(ctx.sessionCacheMode, SSL.SESS_CACHE_BOTH)
+        self.assertEqual(ctx.timeout, 10)
+        self.assertTrue(ctx.options & SSL.OP_NO_TICKET)
+
+
+    def test_tickets(self):
+        """When tickets are enabled, they aren't disabled.
+
+        """
+        ctx = FakeContext()
+        certificate.SessionResumption(tickets=True).configure(ctx)
+        self.assertFalse(ctx.options & SSL.OP_NO_TICKET)
+
+
+    def test_contextFactory(self):
+        """A context factory with session resumption configures its contexts,
+        and caches them, since that's where the session cache lives.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            FakeContextFactory(),
+            sessionResumption=certificate.SessionResumption(b"abc"))
+        self.assertTrue(factory.cacheContext)
+
+        ctx = factory.getContext()
+        self.assertEqual(ctx.sessionID, b"abc")
+        self.assertEqual(ctx.ciphers, certificate.ciphersuites)
+
+
+    def test_noSessionResumptionByDefault(self):
+        """By default, session resumption isn't configured, and the factory
+        doesn't create client connections itself.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(FakeContextFactory())
+        ctx = factory.getContext()
+
+        self.assertIdentical(ctx.sessionID, None)
+        self.assertIdentical(ctx.infoCallback, None)
+        self.assertFalse(IOpenSSLClientConnectionCreator.providedBy(factory))
+
+
+    def test_clientConnectionCreator(self):
+        """When reusing client sessions, the factory creates client
+        connections itself.
+
+        """
+        settings = certificate.SessionResumption()
+        factory = certificate.SecureCiphersContextFactory(
+            FakeContextFactory(), sessionResumption=settings)
+        self.assertTrue(IOpenSSLClientConnectionCreator.providedBy(factory))
+
+        settings = certificate.SessionResumption(reuseClientSessions=False)
+        factory = certificate.SecureCiphersContextFactory(
+            FakeContextFactory(), sessionResumption=settings)
+        self.assertFalse(IOpenSSLClientConnectionCreator.providedBy(factory))
+
+
+
+class LoopbackSessionResumptionTests(SynchronousTestCase):
+    """Tests for session resumption with real TLS handshakes in memory.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        certificate.makeCredentials(self.path, u"test@example.test",
+                                    keyType=certificate.ECDSA)
+        self.addCleanup(certificate.clearContextFactoryCache)
+
+
+    def _factories(self, **kwargs):
+        settings = certificate.SessionResumption(**kwargs)
+        client = certificate.getContextFactory(self.path, settings)
+        server = certificate.getContextFactory(self.path, settings)
+        return client, server
+
+
+    def _assertResumes(self, client, server):
+        first = handshake(client, server)
+        self.assertFalse(_lib.SSL_session_reused(first._ssl))
+
+        second = handshake(client, server)
+        self.assertTrue(_lib.SSL_session_reused(second._ssl))
+
+
+    def test_resumeWithSessionCache(self):
+        """A reconnecting client resumes its session from the server's session
+        cache.
+
+        """
+        self._assertResumes(*self._factories())
+
+
+    def test_resumeWithTickets(self):
+        """A reconnecting client resumes its session with a ticket.
+
+        """
+        self._assertResumes(*self._factories(tickets=True))
+
+
+    def test_invalidate(self):
+        """After invalidating the client factory, the client does a full
+        handshake.
+
+        """
+        client, server = self._factories()
+        handshake(client, server)
+        client.invalidate()
+        connection = handshake(client, server)
+        self.assertFalse(_lib.SSL_session_reused(connection._ssl))
+
+
+
+class ContextMetricsTests(SynchronousTestCase):
+    """Tests for context factory metrics.
+
+    """
+    def setUp(self):
+        self.now = 0.0
+        self.metrics = certificate.ContextMetrics(_clock=lambda: self.now)
+        self.patch(certificate, "_sessionReused", lambda conn: conn.reused)
+
+
+    def test_empty(self):
+        """Without any handshakes, rates and means are zero.
+
+        """
+        self.assertEqual(self.metrics.handshakes, 0)
+        self.assertEqual(self.metrics.resumptionRate, 0.0)
+        self.assertEqual(self.metrics.meanHandshakeTime, 0.0)
+
+
+    def test_contextBuilt(self):
+        """Every context built by the context factory is counted.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            FakeContextFactory(), metrics=self.metrics)
+        factory.getContext()
+        factory.getContext()
+        self.assertEqual(self.metrics.contextsBuilt, 2)
+
+
+    def test_infoCallback(self):
+        """With metrics, the context factory installs an info callback.
+
+        """
+        factory = certificate.SecureCiphersContextFactory(
+            FakeContextFactory(), metrics=self.metrics)
+        ctx = factory.getContext()
+        self.assertNotIdentical(ctx.infoCallback, None)
+
+
+    def _handshake(self, duration, cipher="C", protocol="P", reused=False):
+        connection = FakeConnection(cipher, protocol, reused)
+        self.metrics.handshakeStarted(connection)
+        self.now += duration
+        self.metrics.handshakeDone(connection)
+
+
+    def test_handshakes(self):
+        """Completed handshakes are counted, along with their duration,
+        cipher, protocol version and whether they resumed a session.
+
+        """
+        self._handshake(1.0, "A", "TLSv1.2")
+        self._handshake(2.0, "A", "TLSv1.2", reused=True)
+        self._handshake(3.0, "B", "TLSv1.3")
+        self._handshake(2.0, "B", "TLSv1.3", reused=True)
+
+        self.assertEqual(self.metrics.handshakes, 4)
+        self.assertEqual(self.metrics.resumedHandshakes, 2)
+        self.assertEqual(self.metrics.resumptionRate, 0.5)
+        self.assertEqual(self.metrics.handshakeTime, 8.0)
+        self.assertEqual(self.metrics.meanHandshakeTime, 2.0)
+        self.assertEqual(self.metrics.ciphers, {"A": 2, "B": 2})
+        self.assertEqual(self.metrics.protocols, {"TLSv1.2": 2, "TLSv1.3": 2})
+
+
+    def test_unstartedHandshake(self):
+        """Handshakes that weren't seen starting aren't counted.
+
+        """
+        self.metrics.handshakeDone(FakeConnection("C", "P", False))
+        self.assertEqual(self.metrics.handshakes, 0)
+
+
+
+class FakeConnection(object):
+    def __init__(self, cipher, protocol, reused):
+        self.cipher, self.protocol, self.reused = cipher, protocol, reused
+
+
+    def get_cipher_name(self):
+        return self.cipher
+
+
+    def get_protocol_version_name(self):
+        return self.protocol
+
+
+
+class LoopbackContextMetricsTests(SynchronousTestCase):
+    def test_loopback(self):
+        """Real handshakes are counted, on both ends, including resumed
+        ones.
+
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        certificate.makeCredentials(path, u"test@example.test",
+                                    keyType=certificate.ECDSA)
+        self.addCleanup(certificate.clearContextFactoryCache)
+
+        metrics = certificate.ContextMetrics()
+        settings = certificate.SessionResumption()
+        factory = certificate.getContextFactory(path, settings, metrics)
+
+        handshake(factory, factory)
+        handshake(factory, factory)
+
+        self.assertEqual(metrics.contextsBuilt, 1)
+        self.assertEqual(metrics.handshakes, 4)
+        self.assertEqual(metrics.resumedHandshakes, 2)
+        self.assertEqual(sum(metrics.ciphers.values()), 4)
+        self.assertEqual(sum(metrics.protocols.values()), 4)
+
+
+
+def handshake(clientFactory, serverFactory):
+    """Do a TLS handshake in memory between a client connection created by
+    the client factory and a server connection using the server
+    factory's context, send a byte from the server to the client, and
+    shut both connections down cleanly.
+
+    Returns the client connection.
+
+    """
+    server = SSL.Connection(serverFactory.getContext(), None)
+    server.set_accept_state()
+    client = clientFactory.clientConnectionForTLS(None)
+    client.set_connect_state()
+
+    def pump():
+        for _ in range(10):
+            for source, destination in [(client, server), (server, client)]:
+                try:
+                    destination.bio_write(source.bio_read(2 ** 16))
+                except SSL.WantReadError:
+                    pass
+
+            for connection in [client, server]:
+                try:
+                    connection.do_handshake()
+                except SSL.WantReadError:
+                    pass
+
+    pump()
+    server.send(b"x")
+    pump()
+    client.recv(1)
+    client.shutdown()
+    server.shutdown()
+    return client
+
+
+
 class FakeContextFactory(object):
+    contextsMade = 0
+
     def getContext(self):
+        self.contextsMade += 1
         return FakeContext()
 
 
@@ -178,6 +1032,8 @@ class FakeContext(object):
     def __init__(self):
         self.options = 0
         self.ciphers = None
+        self.sessionID = self.sessionCacheMode = self.timeout = None
+        self.infoCallback = None
 
 
     def set_options(self, opts):
@@ -188,6 +1044,22 @@ class FakeContext(object):
         self.ciphers = ciphers
 
 
+    def set_session_id(self, sessionID):
+        self.sessionID = sessionID
+
+
+    def set_session_cache_mode(self, mode):
+        self.sessionCacheMode = mode
+
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+
+    def set_info_callback(self, callback):
+        self.infoCallback = callback
+
+
 
 class CiphersuiteTests(SynchronousTestCase):
     """Tests for the secure ciphersuites.
@@ -270,6 +1142,56 @@ class CiphersuiteTests(SynchronousTestCase):
 
 
 
+class LazyImportTests(SynchronousTestCase):
+    """Tests that importing the certificate module doesn't import slow
+    dependencies.
+
+    """
+    SLOW = ["OpenSSL", "cryptography", "twisted.internet.ssl"]
+
+    # Trial changes the working directory after importing this, so
+    # this has to be made absolute now.
+    root = FilePath(certificate.__file__).parent().parent().path
+
+    def _importedAfter(self, statement):
+        """Run the statement in a new interpreter, and get which of the
+        slow dependencies it imported.
+
+        """
+        code = "\n".join([
+            statement,
+            "import sys",
+            "slow = {0!r}".format(self.SLOW),
+            "print(' '.join(m for m in slow if m in sys.modules))"
+        ])
+        env = dict(os.environ, PYTHONPATH=self.root)
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         env=env)
+        return output.split()
+
+
+    def test_import(self):
+        """Importing the module doesn't import PyOpenSSL, cryptography or
+        Twisted's SSL support.
+
+        """
+        imported = self._importedAfter("import clarent.certificate")
+        self.assertEqual(imported, [])
+
+
+    def test_use(self):
+        """The slow dependencies are imported when they're first needed.
+
+        """
+        imported = self._importedAfter("\n".join([
+            "from clarent import certificate",
+            "certificate._generateKey(certificate.ECDSA)"
+        ]))
+        self.assertIn("OpenSSL", imported)
+        self.assertIn("cryptography", imported)
+
+
+
 # Ciphers supported by OpenSSL 0.9.8y, as shipped with OS X Mavericks
 MAVERICKS_CIPHERS = [
     'DHE-RSA-AES256-SHA', 'DHE-DSS-AES256-SHA',
@@ -0,0 +1,286 @@
+from clarent import client, exercise
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone, ConnectionRefusedError
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+
+
+class FakeEndpoint(object):
+    """A client endpoint whose connection attempts only succeed or fail
+    when the test says so.
+
+    """
+    def __init__(self):
+        self.attempts = []
+
+
+    def connect(self, factory):
+        d = Deferred()
+        self.attempts.append((factory, d))
+        return d
+
+
+    def succeed(self):
+        """Make the oldest pending connection attempt succeed.
+
+        """
+        factory, d = self.attempts.pop(0)
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        d.callback(protocol)
+        return protocol
+
+
+    def fail(self):
+        """Make the oldest pending connection attempt fail.
+
+        """
+        _, d = self.attempts.pop(0)
+        d.errback(ConnectionRefusedError())
+
+
+
+class FakeAMP(Protocol):
+    """A protocol that records the remote calls made on it.
+
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def callRemote(self, command, **kwargs):
+        d = Deferred()
+        self.calls.append((command, kwargs, d))
+        return d
+
+
+
+class ConnectionPoolTests(SynchronousTestCase):
+    """Tests for the reconnecting connection pool.
+
+    """
+    def setUp(self):
+        self.endpoint = FakeEndpoint()
+        self.clock = Clock()
+        self.pool = client.ConnectionPool(
+            self.endpoint, size=2, protocolFactory=FakeAMP,
+            initialDelay=1.0, maxDelay=10.0, factor=2.0,
+            _clock=self.clock, _random=lambda: 1.0)
+
+
+    def test_start(self):
+        """Starting the pool makes as many connections as its size.
+
+        """
+        self.pool.start()
+        self.assertEqual(len(self.endpoint.attempts), 2)
+
+        self.endpoint.succeed()
+        self.endpoint.succeed()
+        self.assertEqual(len(self.pool), 2)
+
+
+    def test_queued(self):
+        """Calls made while there are no connections are sent when a
+        connection is made.
+
+        """
+        self.pool.start()
+        d = self.pool.callRemote(exercise.GetExercises, solved=False)
+        self.assertNoResult(d)
+
+        protocol = self.endpoint.succeed().wrappedProtocol
+        [(command, kwargs, remote)] = protocol.calls
+        self.assertIdentical(command, exercise.GetExercises)
+        self.assertEqual(kwargs, {"solved": False})
+
+        remote.callback({"exercises": []})
+        self.assertEqual(self.successResultOf(d), {"exercises": []})
+
+
+    def test_leastBusy(self):
+        """Calls go to the connection with the fewest calls in flight.
+
+        """
+        self.pool.start()
+        first = self.endpoint.succeed().wrappedProtocol
+        second = self.endpoint.succeed().wrappedProtocol
+
+        for _ in range(3):
+            self.pool.callRemote(exercise.GetExerciseDetails, identifier="a")
+        self.assertEqual(sorted([len(first.calls), len(second.calls)]),
+                         [1, 2])
+
+        busy = max([first, second], key=lambda p: len(p.calls))
+        for _, _, remote in busy.calls:
+            remote.callback({})
+        self.pool.callRemote(exercise.GetExerciseDetails, identifier="a")
+        self.assertEqual(len(busy.calls), 3)
+
+
+    def test_reconnectAfterLoss(self):
+        """Lost connections are made again after a delay.
+
+        """
+        self.pool.start()
+        wrapper = self.endpoint.succeed()
+        self.endpoint.succeed()
+
+        wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.endpoint.attempts, [])
+
+        self.clock.advance(1.0)
+        self.assertEqual(len(self.endpoint.attempts), 1)
+        self.endpoint.succeed()
+        self.assertEqual(len(self.pool), 2)
+
+
+    def _delay(self):
+        """Get the delay until the only pending reconnection.
+
+        """
+        [call] = self.clock.getDelayedCalls()
+        return call.getTime() - self.clock.seconds()
+
+
+    def test_backoff(self):
+        """The delay grows after every failed attempt, up to the maximum,
+        and is reset once a connection has stayed up for a while.
+
+        """
+        self.pool = client.ConnectionPool(
+            self.endpoint, size=1, initialDelay=1.0, maxDelay=5.0,
+            factor=2.0, stableTime=10.0, _clock=self.clock,
+            _random=lambda: 1.0)
+        self.pool.start()
+
+        delays = []
+        for _ in range(5):
+            self.endpoint.fail()
+            delays.append(self._delay())
+            self.clock.advance(delays[-1])
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 5.0, 5.0])
+
+        wrapper = self.endpoint.succeed()
+        self.clock.advance(10.0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(self._delay(), 1.0)
+
+
+    def test_connectThenDrop(self):
+        """Connections that are lost before they've stayed up for a while
+        count as failures, so the delay keeps growing.
+
+        """
+        self.pool = client.ConnectionPool(
+            self.endpoint, size=1, initialDelay=1.0, maxDelay=5.0,
+            factor=2.0, stableTime=10.0, _clock=self.clock,
+            _random=lambda: 1.0)
+        self.pool.start()
+
+        delays = []
+        for _ in range(5):
+            wrapper = self.endpoint.succeed()
+            self.clock.advance(0.5)
+            wrapper.connectionLost(Failure(ConnectionDone()))
+            delays.append(self._delay())
+            self.clock.advance(delays[-1])
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 5.0, 5.0])
+
+
+    def test_jitter(self):
+        """Delays are randomized between half and all of the backoff.
+
+        """
+        for r, expected in [(0.0, 0.5), (0.5, 0.75), (1.0, 1.0)]:
+            endpoint, clock = FakeEndpoint(), Clock()
+            pool = client.ConnectionPool(endpoint, size=1, initialDelay=1.0,
+                                         _clock=clock,
+                                         _random=lambda: r)
+            pool.start()
+            endpoint.fail()
+            [call] = clock.getDelayedCalls()
+            self.assertEqual(call.getTime(), expected)
+
+
+    def test_stopConnected(self):
+        """Stopping the pool disconnects live connections, and doesn't
+        reconnect them.
+
+        """
+        self.pool.start()
+        wrapper = self.endpoint.succeed()
+        self.pool.stop()
+
+        self.assertTrue(wrapper.transport.disconnecting)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.pool), 0)
+
+
+    def test_stopThenStart(self):
+        """Connections closed by stopping the pool aren't used for calls,
+        and don't reconnect when they're lost after the pool is started
+        again.
+
+        """
+        self.pool.start()
+        old = [self.endpoint.succeed(), self.endpoint.succeed()]
+        self.pool.stop()
+        self.assertEqual(len(self.pool), 0)
+
+        self.pool.start()
+        new = [self.endpoint.succeed(), self.endpoint.succeed()]
+        oldProtocols = [wrapper.wrappedProtocol for wrapper in old]
+        for wrapper in old:
+            wrapper.connectionLost(Failure(ConnectionDone()))
+
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.endpoint.attempts, [])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 2)
+
+        self.pool.callRemote(exercise.GetExercises, solved=True)
+        self.pool.callRemote(exercise.GetExercises, solved=True)
+        self.assertEqual([len(w.wrappedProtocol.calls) for w in new], [1, 1])
+        self.assertEqual([len(p.calls) for p in oldProtocols], [0, 0])
+
+
+    def test_stopConnecting(self):
+        """Stopping the pool cancels connection attempts and pending
+        reconnections, and fails queued calls.
+
+        """
+        self.pool.start()
+        self.endpoint.fail()
+        [(_, attempt)] = self.endpoint.attempts
+        d = self.pool.callRemote(exercise.GetExercises, solved=True)
+
+        self.pool.stop()
+        self.assertTrue(attempt.called)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.failureResultOf(d, ConnectionDone)
+
+        self.clock.advance(100)
+        self.assertEqual(len(self.endpoint.attempts), 1)
+
+
+    def test_failedCall(self):
+        """Failed calls don't count as in flight any more.
+
+        """
+        self.pool = client.ConnectionPool(
+            self.endpoint, size=1, protocolFactory=FakeAMP,
+            _clock=self.clock)
+        self.pool.start()
+        protocol = self.endpoint.succeed().wrappedProtocol
+
+        d = self.pool.callRemote(exercise.GetExercises, solved=True)
+        protocol.calls[0][2].errback(ConnectionDone())
+        self.failureResultOf(d, ConnectionDone)
+        self.assertEqual(self.pool._connections.values(), [0])
@@ -1,4 +1,5 @@
-from clarent import exercise
+from clarent import arguments, exercise
+from os import urandom
 from twisted.trial.unittest import SynchronousTestCase
 from txampext.commandtests import CommandTestMixin
 
@@ -41,6 +42,374 @@ class GetExercisesTests(SynchronousTestCase, CommandTestMixin):
 
 
 
+class GetFirstExercisesPageTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.GetExercisesPage
+    argumentObjects = {
+        b"solved": True,
+        b"cursor": None,
+        b"limit": 2
+    }
+    argumentStrings = {
+        b"solved": b"True",
+        b"limit": b"2"
+    }
+    responseObjects = {
+        b"exercises": [
+            {b"identifier": "a", b"title": u"\N{SNOWMAN}"},
+        ],
+        b"next": b"cursor"
+    }
+    responseStrings = {
+        b"exercises": b"".join([
+            NUL, GetExercisesTests.P_IDENTIFIER, NUL, "\x01", "a",
+            NUL, GetExercisesTests.P_TITLE, NUL, GetExercisesTests.P_SNOWMAN,
+            NUL, NUL
+        ]),
+        b"next": b"cursor"
+    }
+    errors = {
+        exercise.InvalidCursor: "INVALID_CURSOR"
+    }
+    fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class GetLastExercisesPageTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.GetExercisesPage
+    argumentObjects = {
+        b"solved": False,
+        b"cursor": b"cursor",
+        b"limit": 2
+    }
+    argumentStrings = {
+        b"solved": b"False",
+        b"cursor": b"cursor",
+        b"limit": b"2"
+    }
+    responseObjects = {
+        b"exercises": [],
+        b"next": None
+    }
+    responseStrings = {
+        b"exercises": b""
+    }
+    errors = {
+        exercise.InvalidCursor: "INVALID_CURSOR"
+    }
+    fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class QueryExercisesTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.QueryExercises
+    argumentObjects = {
+        b"solved": False,
+        b"tag": u"\N{SNOWMAN}",
+        b"difficulty": 2,
+        b"prefix": b"a",
+        b"changedSince": b"1",
+        b"fields": [b"difficulty", b"tags"],
+        b"cursor": b"c",
+        b"limit": 10
+    }
+    argumentStrings = {
+        b"solved": b"False",
+        b"tag": u"\N{SNOWMAN}".encode("utf-8"),
+        b"difficulty": b"2",
+        b"prefix": b"a",
+        b"changedSince": b"1",
+        b"fields": NUL + "\x0a" + "difficulty" + NUL + "\x04" + "tags",
+        b"cursor": b"c",
+        b"limit": b"10"
+    }
+    responseObjects = {
+        b"exercises": [
+            {
+                b"identifier": "a",
+                b"title": None,
+                b"solved": None,
+                b"tags": [u"\N{SNOWMAN}"],
+                b"difficulty": 2
+            }
+        ],
+        b"next": None
+    }
+
+    P_DIFFICULTY = "\x0a" + "difficulty"
+    P_TAGS = "\x04" + "tags"
+
+    responseStrings = {
+        b"exercises": b"".join([
+            NUL, P_DIFFICULTY, NUL, "\x01", "2",
+            NUL, GetExercisesTests.P_IDENTIFIER, NUL, "\x01", "a",
+            NUL, P_TAGS, NUL, "\x05", NUL, GetExercisesTests.P_SNOWMAN,
+            NUL, NUL
+        ])
+    }
+    errors = {
+        exercise.InvalidCursor: "INVALID_CURSOR",
+        exercise.UnknownField: "UNKNOWN_FIELD"
+    }
+    fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class QueryAllExercisesTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.QueryExercises
+    argumentObjects = {
+        b"solved": None,
+        b"tag": None,
+        b"difficulty": None,
+        b"prefix": None,
+        b"changedSince": None,
+        b"fields": None,
+        b"cursor": None,
+        b"limit": 10
+    }
+    argumentStrings = {
+        b"limit": b"10"
+    }
+    responseObjects = {
+        b"exercises": [],
+        b"next": b"c"
+    }
+    responseStrings = {
+        b"exercises": b"",
+        b"next": b"c"
+    }
+    errors = QueryExercisesTests.errors
+    fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class QueryExercisesHelperTests(SynchronousTestCase):
+    """Tests for filtering and projecting exercises for a query.
+
+    """
+    exercises = [
+        {
+            b"identifier": b"aa",
+            b"title": u"AA",
+            b"solved": True,
+            b"tags": [u"block"],
+            b"difficulty": 1
+        },
+        {
+            b"identifier": b"ab",
+            b"title": u"AB",
+            b"solved": False,
+            b"tags": [u"block", u"stream"],
+            b"difficulty": 2
+        },
+        {
+            b"identifier": b"b",
+            b"title": u"B",
+            b"solved": False,
+            b"tags": [],
+            b"difficulty": 2
+        }
+    ]
+
+
+    def _identifiers(self, **kwargs):
+        exercises = exercise.queryExercises(self.exercises, **kwargs)
+        return [e[b"identifier"] for e in exercises]
+
+
+    def test_noFilters(self):
+        """Without filters, every exercise matches, with its identifier and
+        title.
+
+        """
+        self.assertEqual(exercise.queryExercises(self.exercises), [
+            {b"identifier": b"aa", b"title": u"AA"},
+            {b"identifier": b"ab", b"title": u"AB"},
+            {b"identifier": b"b", b"title": u"B"}
+        ])
+
+
+    def test_filters(self):
+        """Only exercises that match every filter are returned.
+
+        """
+        self.assertEqual(self._identifiers(solved=False), [b"ab", b"b"])
+        self.assertEqual(self._identifiers(tag=u"block"), [b"aa", b"ab"])
+        self.assertEqual(self._identifiers(difficulty=2), [b"ab", b"b"])
+        self.assertEqual(self._identifiers(prefix=b"a"), [b"aa", b"ab"])
+        self.assertEqual(self._identifiers(tag=u"block", difficulty=2),
+                         [b"ab"])
+
+
+    def test_fields(self):
+        """Only the requested fields are returned, along with the
+        identifier.
+
+        """
+        exercises = exercise.queryExercises(self.exercises, prefix=b"b",
+                                            fields=[b"difficulty"])
+        self.assertEqual(exercises, [{b"identifier": b"b", b"difficulty": 2}])
+
+
+    def test_unknownField(self):
+        """Asking for a field that doesn't exist raises ``UnknownField``.
+
+        """
+        self.assertRaises(exercise.UnknownField, exercise.queryExercises,
+                          self.exercises, fields=[b"description"])
+
+
+
+class GetExerciseChangesTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.GetExerciseChanges
+    argumentObjects = {
+        b"version": b"1"
+    }
+    argumentStrings = {
+        b"version": b"1"
+    }
+    responseObjects = {
+        b"version": b"2",
+        b"modified": True,
+        b"reset": False,
+        b"changed": [
+            {b"identifier": "a", b"title": u"\N{SNOWMAN}", b"solved": True}
+        ],
+        b"removed": ["b"]
+    }
+
+    P_SOLVED = "\x06" + "solved"
+
+    responseStrings = {
+        b"version": b"2",
+        b"modified": b"True",
+        b"reset": b"False",
+        b"changed": b"1",
+        b"changed.0": b"".join([
+            NUL, GetExercisesTests.P_IDENTIFIER, NUL, "\x01", "a",
+            NUL, P_SOLVED, NUL, "\x04", "True",
+            NUL, GetExercisesTests.P_TITLE, NUL, GetExercisesTests.P_SNOWMAN,
+            NUL, NUL
+        ]),
+        b"removed": b"1",
+        b"removed.0": NUL + "\x01" + "b"
+    }
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class GetExerciseChangesNotModifiedTests(SynchronousTestCase,
+                                         CommandTestMixin):
+    command = exercise.GetExerciseChanges
+    argumentObjects = {
+        b"version": None
+    }
+    argumentStrings = {}
+    responseObjects = {
+        b"version": b"2",
+        b"modified": False,
+        b"reset": False,
+        b"changed": [],
+        b"removed": []
+    }
+    responseStrings = {
+        b"version": b"2",
+        b"modified": b"False",
+        b"reset": b"False",
+        b"changed": b"1",
+        b"changed.0": b"",
+        b"removed": b"1",
+        b"removed.0": b""
+    }
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class GetExerciseChangesResetTests(SynchronousTestCase):
+    """Tests for sending the entire catalog in a ``GetExerciseChanges``
+    response.
+
+    """
+    def test_largeCatalog(self):
+        """Catalogs too large for a single AMP value are split across
+        several, and can be parsed again.
+
+        """
+        response = {
+            b"version": b"2",
+            b"modified": True,
+            b"reset": True,
+            b"changed": [
+                {b"identifier": b"exercise-%d" % (i,),
+                 b"title": u"Exercise %d" % (i,),
+                 b"solved": i % 2 == 0}
+                for i in xrange(2000)
+            ],
+            b"removed": [b"removed-%d" % (i,) for i in xrange(5000)]
+        }
+        command = exercise.GetExerciseChanges
+        strings = command.makeResponse(response, None)
+        self.assertTrue(int(strings[b"changed"]) > 1)
+        self.assertTrue(int(strings[b"removed"]) > 1)
+        for value in strings.itervalues():
+            self.assertTrue(len(value) <= exercise.MAX_VALUE_LENGTH)
+
+        self.assertEqual(command.parseResponse(strings, None), response)
+
+
+
+class SubscribeToExerciseChangesTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.SubscribeToExerciseChanges
+    argumentObjects = GetExerciseChangesTests.argumentObjects
+    argumentStrings = GetExerciseChangesTests.argumentStrings
+    responseObjects = GetExerciseChangesTests.responseObjects
+    responseStrings = GetExerciseChangesTests.responseStrings
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class UnsubscribeFromExerciseChangesTests(SynchronousTestCase,
+                                          CommandTestMixin):
+    command = exercise.UnsubscribeFromExerciseChanges
+    argumentObjects = argumentStrings = {}
+    responseObjects = responseStrings = {}
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class NotifyExerciseChangesTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.NotifyExerciseChanges
+    argumentObjects = {
+        b"previous": b"1",
+        b"version": b"2",
+        b"changed": [{b"identifier": "a", b"title": u"\N{SNOWMAN}"}],
+        b"removed": ["b"]
+    }
+    argumentStrings = {
+        b"previous": b"1",
+        b"version": b"2",
+        b"changed": b"1",
+        b"changed.0": b"".join([
+            NUL, GetExercisesTests.P_IDENTIFIER, NUL, "\x01", "a",
+            NUL, GetExercisesTests.P_TITLE, NUL, GetExercisesTests.P_SNOWMAN,
+            NUL, NUL
+        ]),
+        b"removed": b"1",
+        b"removed.0": NUL + "\x01" + "b"
+    }
+    responseObjects = responseStrings = {}
+    errors = fatalErrors = {}
+    requiresAnswer = False
+
+
+
 class GetExerciseDetailsTests(SynchronousTestCase, CommandTestMixin):
     command = exercise.GetExerciseDetails
     argumentObjects = {
@@ -64,6 +433,205 @@ class GetExerciseDetailsTests(SynchronousTestCase, CommandTestMixin):
 
 
 
+class GetExerciseDetailsIfChangedTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.GetExerciseDetailsIfChanged
+    argumentObjects = {
+        b"identifier": b"a",
+        b"revision": b"r1"
+    }
+    argumentStrings = {
+        b"identifier": b"a",
+        b"revision": b"r1"
+    }
+    responseObjects = {
+        b"modified": True,
+        b"revision": b"r2",
+        b"title": u"\N{SNOWMAN}",
+        b"description": u"",
+        b"solved": False
+    }
+    responseStrings = {
+        b"modified": b"True",
+        b"revision": b"r2",
+        b"title": u"\N{SNOWMAN}".encode("utf-8"),
+        b"description": b"1",
+        b"description.0": b"\x00",
+        b"solved": b"False"
+    }
+    errors = {
+        exercise.UnknownExercise: "UNKNOWN_EXERCISE"
+    }
+    fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class GetExerciseDetailsNotChangedTests(SynchronousTestCase,
+                                        CommandTestMixin):
+    command = exercise.GetExerciseDetailsIfChanged
+    argumentObjects = {
+        b"identifier": b"a",
+        b"revision": None
+    }
+    argumentStrings = {
+        b"identifier": b"a"
+    }
+    responseObjects = {
+        b"modified": False,
+        b"revision": b"r1",
+        b"title": None,
+        b"description": None,
+        b"solved": True
+    }
+    responseStrings = {
+        b"modified": b"False",
+        b"revision": b"r1",
+        b"solved": b"True"
+    }
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class DetailsRevisionTests(SynchronousTestCase):
+    def test_revision(self):
+        """The revision is a hex SHA-256 hash, that changes when the title or
+        description does, including moving text between the two.
+
+        """
+        revision = exercise.detailsRevision(u"ab", u"c")
+        self.assertEqual(len(revision), 64)
+        self.assertEqual(exercise.detailsRevision(u"ab", u"c"), revision)
+        self.assertNotEqual(exercise.detailsRevision(u"a", u"bc"), revision)
+        self.assertNotEqual(exercise.detailsRevision(u"ab", u"d"), revision)
+
+
+    def test_unicode(self):
+        """Titles and descriptions can have non-ASCII text.
+
+        """
+        exercise.detailsRevision(u"\N{SNOWMAN}", u"\N{CLOUD}")
+
+
+
+class GetExerciseDetailsBatchTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.GetExerciseDetailsBatch
+    argumentObjects = {
+        b"identifiers": ["a", "b"]
+    }
+    argumentStrings = {
+        b"identifiers": NUL + "\x01" + "a" + NUL + "\x01" + "b"
+    }
+    responseObjects = {
+        b"exercises": [
+            {
+                b"identifier": "a",
+                b"title": u"",
+                b"description": u"",
+                b"solved": True
+            }
+        ],
+        b"unknown": ["b"],
+        b"remaining": []
+    }
+
+    P_DESCRIPTION = "\x0b" + "description"
+
+    responseStrings = {
+        b"exercises": b"".join([
+            NUL, P_DESCRIPTION, NUL, "\x01", NUL,
+            NUL, GetExercisesTests.P_IDENTIFIER, NUL, "\x01", "a",
+            NUL, GetExerciseChangesTests.P_SOLVED, NUL, "\x04", "True",
+            NUL, GetExercisesTests.P_TITLE, NUL, NUL,
+            NUL, NUL
+        ]),
+        b"unknown": NUL + "\x01" + "b",
+        b"remaining": b""
+    }
+    errors = fatalErrors = {}
+    requiresAnswer = True
+
+
+
+class MakeDetailsBatchResponseTests(SynchronousTestCase):
+    """Tests for making batched exercise details responses.
+
+    """
+    def _exercise(self, identifier, description=u""):
+        return {
+            b"identifier": identifier,
+            b"title": u"title",
+            b"description": description,
+            b"solved": False
+        }
+
+
+    def test_everythingFits(self):
+        """When all of the exercises fit, they're all in the response.
+
+        """
+        exercises = [self._exercise("a"), self._exercise("b")]
+        response = exercise.makeDetailsBatchResponse(exercises, ["c"])
+        self.assertEqual(response, {
+            b"exercises": exercises,
+            b"unknown": ["c"],
+            b"remaining": []
+        })
+
+
+    def test_split(self):
+        """When the exercises don't fit in a single value, the ones that
+        didn't fit are remaining. The response can be serialized.
+
+        """
+        description = urandom(25000).encode("hex").decode("ascii")
+        exercises = [self._exercise(i, description) for i in "abc"]
+        response = exercise.makeDetailsBatchResponse(exercises)
+
+        self.assertEqual(response[b"exercises"], exercises[:2])
+        self.assertEqual(response[b"remaining"], ["c"])
+        command = exercise.GetExerciseDetailsBatch
+        strings = command.makeResponse(response, None)
+        self.assertTrue(len(strings[b"exercises"]) <= exercise.MAX_VALUE_LENGTH)
+
+
+    def test_maxLength(self):
+        """The maximum length can be chosen.
+
+        """
+        exercises = [self._exercise("a"), self._exercise("b")]
+        response = exercise.makeDetailsBatchResponse(exercises, maxLength=1)
+        self.assertEqual(response[b"exercises"], exercises[:1])
+        self.assertEqual(response[b"remaining"], ["b"])
+
+
+    def test_serializedOnce(self):
+        """The exercises are serialized once, when they're measured: the
+        response is sent as measured, without compressing their
+        descriptions again.
+
+        """
+        compressed = []
+        def compress(data, level):
+            compressed.append(data)
+            return original(data, level)
+        original = arguments.zlib.compress
+        self.patch(arguments.zlib, "compress", compress)
+
+        description = u"x" * 1000
+        exercises = [self._exercise(i, description) for i in "ab"]
+        response = exercise.makeDetailsBatchResponse(exercises)
+        self.assertEqual(len(compressed), 2)
+
+        command = exercise.GetExerciseDetailsBatch
+        strings = command.makeResponse(response, None)
+        self.assertEqual(len(compressed), 2)
+        self.assertEqual(
+            strings[b"exercises"],
+            b"".join(row.encoded for row in response[b"exercises"]))
+
+
+
 class NotifySolvedTests(SynchronousTestCase, CommandTestMixin):
     command = exercise.NotifySolved
     argumentObjects = {
@@ -77,3 +645,13 @@ class NotifySolvedTests(SynchronousTestCase, CommandTestMixin):
     responseObjects = responseStrings = {}
     errors = fatalErrors = {}
     requiresAnswer = False
+
+
+
+class NotifySolvedBatchTests(SynchronousTestCase, CommandTestMixin):
+    command = exercise.NotifySolvedBatch
+    argumentObjects = GetExercisesTests.responseObjects
+    argumentStrings = GetExercisesTests.responseStrings
+    responseObjects = responseStrings = {}
+    errors = fatalErrors = {}
+    requiresAnswer = False
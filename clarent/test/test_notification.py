@@ -0,0 +1,457 @@
+from clarent import exercise, notification
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.task import Clock
+from twisted.protocols import amp
+from twisted.test.iosim import FakeTransport, connect
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+from zope.interface.verify import verifyObject
+import gc
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.calls = []
+
+
+    def callRemote(self, command, **kwargs):
+        self.calls.append((command, kwargs))
+
+
+
+class SolvedNotifierTests(SynchronousTestCase):
+    """Tests for coalescing solved notifications.
+
+    """
+    def setUp(self):
+        self.protocol = FakeProtocol()
+        self.clock = Clock()
+        self.notifier = notification.SolvedNotifier(
+            self.protocol, delay=1.0, maxBatchSize=3, _clock=self.clock)
+
+
+    def _sent(self):
+        return [[(e[b"identifier"], e[b"title"]) for e in kwargs["exercises"]]
+                for command, kwargs in self.protocol.calls
+                if command is exercise.NotifySolvedBatch]
+
+
+    def test_delay(self):
+        """Notifications are sent as a single batch after the delay.
+
+        """
+        self.notifier.notify("a", u"A")
+        self.clock.advance(0.5)
+        self.notifier.notify("b", u"B")
+        self.assertEqual(self._sent(), [])
+
+        self.clock.advance(0.5)
+        self.assertEqual(self._sent(), [[("a", u"A"), ("b", u"B")]])
+
+        self.clock.advance(10)
+        self.assertEqual(len(self._sent()), 1)
+
+
+    def test_maxBatchSize(self):
+        """When the batch is full, it's sent immediately.
+
+        """
+        for identifier in "abcd":
+            self.notifier.notify(identifier, u"")
+
+        self.assertEqual(self._sent(), [[("a", u""), ("b", u""), ("c", u"")]])
+        self.clock.advance(1.0)
+        self.assertEqual(self._sent()[1:], [[("d", u"")]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_duplicates(self):
+        """Pending notifications for the same exercise are collapsed.
+
+        """
+        self.notifier.notify("a", u"A")
+        self.notifier.notify("a", u"A")
+        self.clock.advance(1.0)
+        self.assertEqual(self._sent(), [[("a", u"A")]])
+
+
+    def test_flush(self):
+        """Flushing sends pending notifications immediately. Flushing with
+        nothing pending sends nothing.
+
+        """
+        self.notifier.flush()
+        self.notifier.notify("a", u"A")
+        self.notifier.flush()
+
+        self.assertEqual(self._sent(), [[("a", u"A")]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class Subscriber(amp.AMP):
+    """A client that keeps track of the changes pushed to it.
+
+    """
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self.changes = []
+
+
+    @exercise.NotifyExerciseChanges.responder
+    def exerciseChanges(self, previous, version, changed, removed):
+        self.changes.append((previous, version, changed, removed))
+        return {}
+
+
+
+class ExerciseChangesPublisherTests(SynchronousTestCase):
+    """Tests for pushing catalog changes to subscribed connections.
+
+    """
+    def setUp(self):
+        self.publisher = notification.ExerciseChangesPublisher()
+
+
+    def _connect(self):
+        server, client = amp.AMP(), Subscriber()
+        pump = connect(server, FakeTransport(server, True),
+                       client, FakeTransport(client, False))
+        return server, client, pump
+
+
+    def test_publish(self):
+        """Changes are pushed to every subscribed connection.
+
+        """
+        connections = [self._connect() for _ in range(2)]
+        for server, _, _ in connections:
+            self.publisher.subscribe(server)
+
+        changed = [{b"identifier": "a", b"title": u"\N{SNOWMAN}"}]
+        self.publisher.publish(b"1", b"2", changed, ["b"])
+
+        for _, client, pump in connections:
+            pump.flush()
+            self.assertEqual(client.changes, [(b"1", b"2", changed, ["b"])])
+
+
+    def test_unsubscribe(self):
+        """Changes aren't pushed to connections that have unsubscribed.
+
+        """
+        server, client, pump = self._connect()
+        self.publisher.subscribe(server)
+        self.publisher.unsubscribe(server)
+        self.publisher.unsubscribe(server)
+        self.assertNotIn(server, self.publisher)
+
+        self.publisher.publish(b"1", b"2")
+        pump.flush()
+        self.assertEqual(client.changes, [])
+
+
+    def test_connectionLost(self):
+        """Connections that have been lost are unsubscribed.
+
+        """
+        lost, _, lostPump = self._connect()
+        server, client, pump = self._connect()
+        self.publisher.subscribe(lost)
+        self.publisher.subscribe(server)
+
+        lost.transport.loseConnection()
+        lostPump.flush()
+        self.publisher.publish(b"1", b"2")
+        pump.flush()
+
+        self.assertNotIn(lost, self.publisher)
+        self.assertIn(server, self.publisher)
+        self.assertEqual(client.changes, [(b"1", b"2", [], [])])
+
+
+    def test_protocolSwitched(self):
+        """Connections that have switched to another protocol are
+        unsubscribed.
+
+        """
+        server, _, _ = self._connect()
+        self.publisher.subscribe(server)
+
+        server._lockForSwitch()
+        self.publisher.publish(b"1", b"2")
+        self.assertNotIn(server, self.publisher)
+
+
+    def test_forgotten(self):
+        """Connections that have gone away are forgotten.
+
+        """
+        server = amp.AMP()
+        self.publisher.subscribe(server)
+        del server
+        gc.collect()
+        self.assertEqual(len(self.publisher), 0)
+
+
+
+class QueueProtocol(FakeProtocol):
+    """A protocol with a transport, that records the remote calls made
+    on it.
+
+    """
+    def __init__(self):
+        FakeProtocol.__init__(self)
+        self.transport = StringTransport()
+
+
+    def sent(self):
+        """Get the identifiers of the exercises notified so far, per batch.
+
+        """
+        return [[e[b"identifier"] for e in kwargs["exercises"]]
+                for command, kwargs in self.calls
+                if command is exercise.NotifySolvedBatch]
+
+
+
+class NotificationQueueTests(SynchronousTestCase):
+    """Tests for bounded, flow-controlled notification queues.
+
+    """
+    def setUp(self):
+        self.protocol = QueueProtocol()
+        self.clock = Clock()
+        self.queue = notification.NotificationQueue(
+            self.protocol, maxSize=3, maxBatchSize=2, delay=1.0,
+            _clock=self.clock)
+
+
+    def test_registered(self):
+        """The queue is registered as a streaming producer.
+
+        """
+        self.assertIdentical(self.protocol.transport.producer, self.queue)
+        self.assertTrue(self.protocol.transport.streaming)
+        self.assertTrue(verifyObject(IPushProducer, self.queue))
+
+
+    def test_otherProducer(self):
+        """Making a queue for a transport that already has a producer
+        raises ``RuntimeError``.
+
+        """
+        self.assertRaises(RuntimeError, notification.NotificationQueue,
+                          self.protocol, _clock=self.clock)
+
+
+    def test_notSlow(self):
+        """While the transport isn't paused, notifications are coalesced
+        into batches, like a ``SolvedNotifier`` does.
+
+        """
+        self.queue.notify("a", u"A")
+        self.queue.notify("a", u"A")
+        self.assertEqual(self.protocol.sent(), [])
+
+        self.clock.advance(1.0)
+        self.assertEqual(self.protocol.sent(), [["a"]])
+
+        for identifier in "bcd":
+            self.queue.notify(identifier, u"")
+        self.assertEqual(self.protocol.sent(), [["a"], ["b", "c"]])
+        self.clock.advance(1.0)
+        self.assertEqual(self.protocol.sent(), [["a"], ["b", "c"], ["d"]])
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.sent, 4)
+        self.assertEqual(self.queue.collapsed, 1)
+
+
+    def test_paused(self):
+        """Notifications are queued while the transport is paused, and
+        sent in batches when it's resumed.
+
+        """
+        self.queue.pauseProducing()
+        for identifier in "abc":
+            self.queue.notify(identifier, u"")
+        self.clock.advance(1.0)
+        self.assertEqual(self.protocol.sent(), [])
+        self.assertEqual(len(self.queue), 3)
+
+        self.queue.resumeProducing()
+        self.assertEqual(self.protocol.sent(), [["a", "b"], ["c"]])
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.sent, 3)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_pausedWhileFlushing(self):
+        """If the transport is paused while queued notifications are being
+        sent, the rest stay queued.
+
+        """
+        self.queue.pauseProducing()
+        for identifier in "abc":
+            self.queue.notify(identifier, u"")
+
+        callRemote = self.protocol.callRemote
+        def callRemoteAndPause(command, **kwargs):
+            callRemote(command, **kwargs)
+            self.queue.pauseProducing()
+        self.protocol.callRemote = callRemoteAndPause
+
+        self.queue.resumeProducing()
+        self.assertEqual(self.protocol.sent(), [["a", "b"]])
+        self.assertEqual(len(self.queue), 1)
+
+
+    def test_collapsed(self):
+        """Queued notifications for the same exercise are collapsed.
+
+        """
+        self.queue.pauseProducing()
+        self.queue.notify("a", u"A")
+        self.queue.notify("a", u"A")
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.collapsed, 1)
+
+
+    def test_bounded(self):
+        """When the queue is full, the oldest notification is dropped.
+
+        """
+        self.queue.pauseProducing()
+        for identifier in "abcde":
+            self.queue.notify(identifier, u"")
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.queue.dropped, 2)
+
+        self.queue.resumeProducing()
+        self.assertEqual(self.protocol.sent(), [["c", "d"], ["e"]])
+
+
+    def test_stopped(self):
+        """When the transport stops the queue, queued notifications are
+        dropped, and no more are sent.
+
+        """
+        self.queue.notify("a", u"")
+        self.queue.stopProducing()
+        self.queue.notify("b", u"")
+        self.queue.resumeProducing()
+        self.clock.advance(1.0)
+
+        self.assertEqual(self.protocol.sent(), [])
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class NotificationDispatcherTests(SynchronousTestCase):
+    """Tests for dispatching notifications to many connections.
+
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.dispatcher = notification.NotificationDispatcher(
+            maxQueueSize=2, maxBatchSize=10, delay=1.0, _clock=self.clock)
+        self.fast, self.slow = QueueProtocol(), QueueProtocol()
+        self.dispatcher.register(self.fast)
+        self.dispatcher.register(self.slow).pauseProducing()
+
+
+    def test_notify(self):
+        """Notifications go to the queue of their connection, and are sent
+        in batches, right away when the queue is full. Slow connections
+        don't hold up other ones.
+
+        """
+        for identifier in "abc":
+            self.dispatcher.notify(self.fast, identifier, u"")
+            self.dispatcher.notify(self.slow, identifier, u"")
+        self.clock.advance(1.0)
+
+        self.assertEqual(self.fast.sent(), [["a", "b"], ["c"]])
+        self.assertEqual(self.slow.sent(), [])
+        self.assertEqual(self.dispatcher.queueDepths(),
+                         {self.fast: 0, self.slow: 2})
+
+
+    def test_registerTwice(self):
+        """Registering a connection again gets its existing queue.
+
+        """
+        self.assertIdentical(self.dispatcher.register(self.slow),
+                             self.dispatcher.register(self.slow))
+
+
+    def test_registerOtherProducer(self):
+        """Registering a connection whose transport already has a producer
+        raises ``RuntimeError``, and the connection isn't registered.
+
+        """
+        protocol = QueueProtocol()
+        protocol.transport.registerProducer(object(), True)
+        self.assertRaises(RuntimeError, self.dispatcher.register, protocol)
+        self.assertNotIn(protocol, self.dispatcher.queueDepths())
+
+
+    def test_unregister(self):
+        """Unregistered connections don't get notifications, and their
+        queues are unregistered from their transports.
+
+        """
+        self.dispatcher.unregister(self.slow)
+        self.assertIdentical(self.slow.transport.producer, None)
+        self.dispatcher.notify(self.slow, "a", u"")
+        self.assertEqual(self.dispatcher.queueDepths(), {self.fast: 0})
+
+
+    def test_connectionLost(self):
+        """Connections are forgotten when their transports stop their
+        queues.
+
+        """
+        self.slow.transport.producer.stopProducing()
+        self.assertEqual(self.dispatcher.queueDepths(), {self.fast: 0})
+
+
+    def test_metrics(self):
+        """The metrics summarize all queues.
+
+        """
+        for identifier in "abcb":
+            self.dispatcher.notify(self.fast, identifier, u"")
+            self.dispatcher.notify(self.slow, identifier, u"")
+        self.clock.advance(1.0)
+
+        self.assertEqual(self.dispatcher.metrics(), {
+            "connections": 2,
+            "paused": 1,
+            "queued": 2,
+            "maxQueued": 2,
+            "sent": 4,
+            "collapsed": 1,
+            "dropped": 1
+        })
+
+
+    def test_metricsAfterLoss(self):
+        """The numbers of notifications sent, collapsed and dropped include
+        those of connections that are gone.
+
+        """
+        for identifier in "abcb":
+            self.dispatcher.notify(self.fast, identifier, u"")
+            self.dispatcher.notify(self.slow, identifier, u"")
+        self.clock.advance(1.0)
+
+        self.slow.transport.producer.stopProducing()
+        self.dispatcher.unregister(self.fast)
+        self.dispatcher.unregister(self.fast)
+
+        metrics = self.dispatcher.metrics()
+        self.assertEqual(metrics["connections"], 0)
+        self.assertEqual((metrics["sent"], metrics["collapsed"],
+                          metrics["dropped"]), (4, 1, 1))
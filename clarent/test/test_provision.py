@@ -0,0 +1,299 @@
+from clarent import certificate, provision
+from clarent.test.test_certificate import testKey
+from itertools import imap
+from StringIO import StringIO
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+
+class FakePool(object):
+    """A fake process pool, that does all the work in this process.
+
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self.closed = self.terminated = self.joined = False
+
+
+    def imap_unordered(self, f, iterable):
+        return imap(f, iterable)
+
+
+    def close(self):
+        self.closed = True
+
+
+    def terminate(self):
+        self.terminated = True
+
+
+    def join(self):
+        self.joined = True
+
+
+
+class ProvisionTests(SynchronousTestCase):
+    """Tests for making credentials for many clients at once.
+
+    """
+    def setUp(self):
+        self.patch(certificate, "_generateKey", lambda keyType: testKey)
+        self.addCleanup(certificate.clearContextFactoryCache)
+        self.pools = []
+        self.now = 0.0
+
+        self.root = FilePath(self.mktemp())
+        self.paths = [self.root.child(name) for name in "abc"]
+        for path in self.paths:
+            path.makedirs()
+
+        self.items = [(u"{0}@example.test".format(path.basename()), path)
+                      for path in self.paths]
+
+
+    def _Pool(self, processes):
+        pool = FakePool(processes)
+        self.pools.append(pool)
+        return pool
+
+
+    def _time(self):
+        self.now += 1.0
+        return self.now
+
+
+    def _provision(self, items, **kwargs):
+        return provision.provision(items, _Pool=self._Pool, _time=self._time,
+                                   **kwargs)
+
+
+    def test_provision(self):
+        """Credentials are made for every item, and the pool is cleaned up.
+
+        """
+        results = self._provision(self.items, processes=3)
+
+        self.assertEqual(results, [
+            provision.Result(email, path.path, None)
+            for email, path in self.items
+        ])
+        for path in self.paths:
+            certificate.getContextFactory(path)
+
+        pool, = self.pools
+        self.assertEqual(pool.processes, 3)
+        self.assertTrue(pool.closed)
+        self.assertFalse(pool.terminated)
+        self.assertTrue(pool.joined)
+
+
+    def test_failuresDontAbort(self):
+        """A failure for one item is reported, and doesn't stop the others.
+
+        """
+        certificate.makeCredentials(self.paths[1], u"b@example.test")
+        results = self._provision(self.items)
+
+        self.assertEqual(results[0].error, None)
+        self.assertIn("OSError", results[1].error)
+        self.assertEqual(results[2].error, None)
+        certificate.getContextFactory(self.paths[2])
+
+
+    def test_noPartialFiles(self):
+        """When making credentials fails, no partial credentials file or
+        temporary file is left behind.
+
+        """
+        self.patch(certificate, "_makeCertificate", lambda key, email: 1 // 0)
+        result, = self._provision(self.items[:1])
+
+        self.assertIn("ZeroDivisionError", result.error)
+        self.assertEqual(self.paths[0].listdir(), [])
+
+
+    def test_keyType(self):
+        """Keys of the given type are generated.
+
+        """
+        keyTypes = []
+        def generateKey(keyType):
+            keyTypes.append(keyType)
+            return testKey
+        self.patch(certificate, "_generateKey", generateKey)
+
+        self._provision(self.items, keyType=certificate.ECDSA)
+        self.assertEqual(keyTypes, [certificate.ECDSA] * 3)
+
+
+    def test_progress(self):
+        """The progress callback is called for every item, with the result,
+        the number of items done, the total and the elapsed time.
+
+        """
+        calls = []
+        results = self._provision(
+            self.items, progress=lambda *args: calls.append(args))
+
+        self.assertEqual(calls, [
+            (result, i + 1, 3, float(i + 1))
+            for i, result in enumerate(results)
+        ])
+
+
+    def test_progressFails(self):
+        """When the progress callback raises, the exception propagates, and
+        the pool is terminated instead of waiting for the remaining
+        items.
+
+        """
+        def progress(*args):
+            raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, self._provision, self.items,
+                          progress=progress)
+        pool, = self.pools
+        self.assertTrue(pool.terminated)
+        self.assertFalse(pool.closed)
+        self.assertTrue(pool.joined)
+
+
+
+class ParseItemsTests(SynchronousTestCase):
+    def test_parseItems(self):
+        """Items are e-mail addresses followed by whitespace and a path.
+        Blank lines and comments are ignored.
+
+        """
+        lines = [
+            "# comment\n",
+            "a@example.test /tmp/a\n",
+            "\n",
+            "b@example.test\t/tmp/with space\n",
+        ]
+        self.assertEqual(list(provision._parseItems(lines)), [
+            (u"a@example.test", "/tmp/a"),
+            (u"b@example.test", "/tmp/with space"),
+        ])
+
+
+    def test_badLine(self):
+        """Lines without a path, or with an e-mail address that isn't UTF-8,
+        raise ValueError mentioning their line number.
+
+        """
+        for bad in ["a@example.test\n", "\xff@example.test /tmp/a\n"]:
+            lines = ["# comment\n", "b@example.test /tmp/b\n", bad]
+            e = self.assertRaises(ValueError, list,
+                                  provision._parseItems(lines))
+            self.assertIn("line 3", str(e))
+
+
+
+class MainTests(SynchronousTestCase):
+    """Tests for the command line entry point.
+
+    """
+    def setUp(self):
+        self.stderr = StringIO()
+        self.calls = []
+        self.results = []
+
+
+    def _provision(self, items, processes, progress, keyType):
+        self.calls.append((items, processes, keyType))
+        for i, result in enumerate(self.results):
+            progress(result, i + 1, len(self.results), 1.0)
+        return self.results
+
+
+    def _main(self, argv, stdin=""):
+        return provision.main(argv, _stdin=StringIO(stdin),
+                              _stderr=self.stderr, _provision=self._provision)
+
+
+    def test_stdin(self):
+        """Items can be read from stdin. When everything succeeds, the exit
+        status is 0.
+
+        """
+        self.results = [provision.Result(u"a@example.test", "/a", None)]
+        status = self._main(["-p", "2", "-"], "a@example.test /a\n")
+
+        self.assertEqual(status, 0)
+        self.assertEqual(self.calls, [
+            ([(u"a@example.test", "/a")], 2, certificate.RSA)
+        ])
+
+        output = self.stderr.getvalue()
+        self.assertIn("[1/1] a@example.test: ok (1.00/s)", output)
+        self.assertIn("1 made, 0 failed", output)
+
+
+    def test_file(self):
+        """Items can be read from a file.
+
+        """
+        itemsPath = FilePath(self.mktemp())
+        itemsPath.setContent("a@example.test /a\n")
+        self._main([itemsPath.path])
+        self.assertEqual(self.calls, [
+            ([(u"a@example.test", "/a")], None, certificate.RSA)
+        ])
+
+
+    def test_badItems(self):
+        """When an item is bad, it's reported with its line number, the
+        exit status is 2, and nothing is made.
+
+        """
+        status = self._main(["-"], "a@example.test /a\nb@example.test\n")
+        self.assertEqual(status, 2)
+        self.assertEqual(self.calls, [])
+        self.assertIn("line 2", self.stderr.getvalue())
+
+
+    def test_missingFile(self):
+        """When the items file doesn't exist, that's reported, the exit
+        status is 2, and nothing is made.
+
+        """
+        path = self.mktemp()
+        self.assertEqual(self._main([path]), 2)
+        self.assertEqual(self.calls, [])
+        self.assertIn(path, self.stderr.getvalue())
+
+
+    def test_keyType(self):
+        """The key type can be chosen.
+
+        """
+        self._main(["--key-type", certificate.ECDSA, "-"])
+        (_, _, keyType), = self.calls
+        self.assertEqual(keyType, certificate.ECDSA)
+
+
+    def test_badKeyType(self):
+        """Unknown key types are rejected.
+
+        """
+        self.assertEqual(self._main(["--key-type", "rot13", "-"]), 2)
+        self.assertEqual(self.calls, [])
+
+
+    def test_failures(self):
+        """When some credentials couldn't be made, the exit status is 1.
+
+        """
+        self.results = [provision.Result(u"a@example.test", "/a", "Oops")]
+        self.assertEqual(self._main(["-"]), 1)
+        self.assertIn("[1/1] a@example.test: Oops", self.stderr.getvalue())
+
+
+    def test_badUsage(self):
+        """Bad usage prints the usage and returns exit status 2.
+
+        """
+        self.assertEqual(self._main([]), 2)
+        self.assertEqual(self.calls, [])
+        self.assertIn("Usage:", self.stderr.getvalue())
@@ -0,0 +1,200 @@
+from clarent import exercise, solved
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+
+class BitmapHelperTests(SynchronousTestCase):
+    """Tests for converting bitmaps to and from bytes and ordinals.
+
+    """
+    def test_bytes(self):
+        """Bitmaps are serialized as little-endian bytes of a fixed length,
+        and can be parsed again.
+
+        """
+        self.assertEqual(solved._toBytes(0x0102, 3), b"\x02\x01\x00")
+        self.assertEqual(solved._fromBytes(b"\x02\x01\x00"), 0x0102)
+        self.assertEqual(solved._fromBytes(b""), 0)
+
+
+    def test_ordinals(self):
+        """Bitmaps can be made from ordinals, and turned back into them.
+
+        """
+        ordinals = [0, 3, 8, 9, 63, 64, 1000]
+        bits = solved._fromOrdinals(ordinals)
+        self.assertEqual(bits, sum(1 << o for o in ordinals))
+        self.assertEqual(solved._toOrdinals(bits), ordinals)
+        self.assertEqual(solved._fromOrdinals([]), 0)
+        self.assertEqual(solved._toOrdinals(0), [])
+
+
+
+class SolvedBitmapsTests(SynchronousTestCase):
+    """Tests for per-user solved exercise bitmaps.
+
+    """
+    def setUp(self):
+        self.identifiers = [b"e{0}".format(i) for i in range(20)]
+        self.bitmaps = solved.SolvedBitmaps(self.identifiers)
+
+
+    def test_ordinals(self):
+        """Exercises get ordinals in the order they were added in. Adding
+        one again keeps its ordinal.
+
+        """
+        self.assertEqual(self.bitmaps.ordinal(b"e3"), 3)
+        self.assertEqual(self.bitmaps.addExercise(b"e3"), 3)
+        self.assertEqual(self.bitmaps.addExercise(b"new"), 20)
+
+
+    def test_unknown(self):
+        """Using an exercise that hasn't been added raises
+        ``UnknownExercise``.
+
+        """
+        self.assertRaises(exercise.UnknownExercise,
+                          self.bitmaps.markSolved, b"alice", b"x")
+        self.assertRaises(exercise.UnknownExercise,
+                          self.bitmaps.isSolved, b"alice", b"x")
+
+
+    def test_solved(self):
+        """Solved exercises are listed as solved, in the order they were
+        added in, and the others as unsolved.
+
+        """
+        self.bitmaps.markSolved(b"alice", b"e10")
+        self.bitmaps.markSolved(b"alice", b"e2")
+
+        self.assertTrue(self.bitmaps.isSolved(b"alice", b"e2"))
+        self.assertFalse(self.bitmaps.isSolved(b"alice", b"e3"))
+        self.assertEqual(self.bitmaps.solved(b"alice"), [b"e2", b"e10"])
+        self.assertEqual(self.bitmaps.unsolved(b"alice"),
+                         [i for i in self.identifiers
+                          if i not in (b"e2", b"e10")])
+
+
+    def test_unknownUser(self):
+        """Users without a bitmap haven't solved anything.
+
+        """
+        self.assertEqual(self.bitmaps.solved(b"bob"), [])
+        self.assertEqual(self.bitmaps.unsolved(b"bob"), self.identifiers)
+        self.assertEqual(len(self.bitmaps), 0)
+
+
+    def test_setSolved(self):
+        """A user's solved exercises can be replaced all at once.
+
+        """
+        self.bitmaps.markSolved(b"alice", b"e0")
+        self.bitmaps.setSolved(b"alice", [b"e5", b"e1"])
+        self.assertEqual(self.bitmaps.solved(b"alice"), [b"e1", b"e5"])
+
+
+    def test_dumpLoad(self):
+        """Bitmaps can be dumped and loaded, one bit per exercise.
+
+        """
+        self.bitmaps.setSolved(b"alice", [b"e0", b"e9", b"e19"])
+        data = self.bitmaps.dump(b"alice")
+        self.assertEqual(data, b"\x01\x02\x08")
+
+        self.bitmaps.load(b"bob", data)
+        self.assertEqual(self.bitmaps.solved(b"bob"), [b"e0", b"e9", b"e19"])
+
+
+    def test_loadUnknownExercises(self):
+        """Loading a bitmap with bits for exercises that haven't been
+        added raises ``ValueError``.
+
+        """
+        self.assertRaises(ValueError, self.bitmaps.load, b"alice",
+                          b"\x00\x00\x10")
+
+
+
+class SolvedBitmapsFileTests(SynchronousTestCase):
+    """Tests for saving bitmaps, and opening them memory-mapped.
+
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+
+        self.bitmaps = solved.SolvedBitmaps([b"a", b"b", b"c"])
+        self.bitmaps.setSolved(b"alice", [b"a", b"c"])
+        self.bitmaps.setSolved(b"bob", [b"b"])
+        self.bitmaps.save(self.path)
+
+
+    def _open(self):
+        opened = solved.SolvedBitmaps.open(self.path)
+        self.addCleanup(opened.close)
+        return opened
+
+
+    def test_roundtrip(self):
+        """Saved bitmaps can be opened again.
+
+        """
+        opened = self._open()
+        self.assertEqual(sorted(opened.users()), [b"alice", b"bob"])
+        self.assertEqual(opened.ordinal(b"c"), 2)
+        self.assertEqual(opened.solved(b"alice"), [b"a", b"c"])
+        self.assertEqual(opened.unsolved(b"bob"), [b"a", b"c"])
+
+
+    def test_lazy(self):
+        """Users' bitmaps are only read from the file when they're used.
+
+        """
+        opened = self._open()
+        self.assertEqual(opened._bitmaps, {})
+        opened.isSolved(b"alice", b"a")
+        self.assertEqual(opened._bitmaps.keys(), [b"alice"])
+
+
+    def test_changeAndSave(self):
+        """Opened bitmaps can be changed and saved over the file they were
+        opened from.
+
+        """
+        opened = self._open()
+        opened.addExercise(b"d")
+        opened.markSolved(b"bob", b"d")
+        opened.markSolved(b"carol", b"a")
+        opened.save(self.path)
+
+        reopened = self._open()
+        self.assertEqual(reopened.solved(b"alice"), [b"a", b"c"])
+        self.assertEqual(reopened.solved(b"bob"), [b"b", b"d"])
+        self.assertEqual(reopened.solved(b"carol"), [b"a"])
+
+
+    def test_close(self):
+        """Closing unmaps the file. Bitmaps that weren't read from it yet
+        are read first, so they can still be used. Closing again does
+        nothing.
+
+        """
+        opened = self._open()
+        opened.isSolved(b"alice", b"a")
+        opened.close()
+        opened.close()
+
+        self.assertIdentical(opened._map, None)
+        self.assertEqual(opened.solved(b"alice"), [b"a", b"c"])
+        self.assertEqual(opened.solved(b"bob"), [b"b"])
+
+
+    def test_notBitmaps(self):
+        """Opening a file that isn't saved bitmaps raises ``ValueError``.
+
+        """
+        content = self.path.getContent()
+        for bad in [b"", b"XXXX" + content[4:], content[:10], content + b"x"]:
+            self.path.setContent(bad)
+            self.assertRaises(ValueError, solved.SolvedBitmaps.open,
+                              self.path)
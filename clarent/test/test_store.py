@@ -0,0 +1,208 @@
+from clarent import arguments, exercise, solved, store
+from twisted.protocols import amp
+from twisted.test.iosim import FakeTransport, connect
+from twisted.trial.unittest import SynchronousTestCase
+
+
+class ExerciseStoreTests(SynchronousTestCase):
+    """Tests for the in-memory exercise store.
+
+    """
+    def setUp(self):
+        self.store = store.ExerciseStore()
+        self.store.add(b"a", u"A", u"Do a.")
+        self.store.add(b"b", u"B", u"Do b.")
+        self.store.add(b"c", u"C", u"Do c.")
+
+
+    def _identifiers(self, user, solved):
+        return [row[b"identifier"] for row in self.store.rows(user, solved)]
+
+
+    def test_get(self):
+        """Exercises can be looked up by identifier.
+
+        """
+        self.assertEqual(self.store.get(b"b"),
+                         store.Exercise(b"b", u"B", u"Do b."))
+        self.assertIn(b"b", self.store)
+        self.assertEqual(len(self.store), 3)
+
+
+    def test_unknown(self):
+        """Looking up, removing or solving an exercise that isn't in the
+        store raises ``UnknownExercise``.
+
+        """
+        self.assertRaises(exercise.UnknownExercise, self.store.get, b"x")
+        self.assertRaises(exercise.UnknownExercise, self.store.remove, b"x")
+        self.assertRaises(exercise.UnknownExercise,
+                          self.store.markSolved, "alice", b"x")
+
+
+    def test_replace(self):
+        """Adding an exercise with an identifier that's already in the
+        store replaces it, in the same place.
+
+        """
+        self.store.add(b"a", u"A2", u"Do a again.")
+        self.assertEqual(self.store.get(b"a").title, u"A2")
+        self.assertEqual(self.store.rows("alice", False)[0],
+                         {b"identifier": b"a", b"title": u"A2"})
+
+
+    def test_remove(self):
+        """Removed exercises are gone, even if they were solved.
+
+        """
+        self.store.markSolved("alice", b"a")
+        self.store.remove(b"a")
+        self.assertNotIn(b"a", self.store)
+        self.assertEqual(self._identifiers("alice", True), [])
+        self.assertEqual(self._identifiers("alice", False), [b"b", b"c"])
+
+
+    def test_rows(self):
+        """Solved and unsolved rows are in the order they were added in.
+        Users don't see each other's solved exercises.
+
+        """
+        self.store.markSolved("alice", b"c")
+        self.store.markSolved("alice", b"a")
+        self.store.markSolved("alice", b"c")
+
+        self.assertEqual(self._identifiers("alice", True), [b"a", b"c"])
+        self.assertEqual(self._identifiers("alice", False), [b"b"])
+        self.assertEqual(self._identifiers("bob", True), [])
+        self.assertEqual(self._identifiers("bob", False), [b"a", b"b", b"c"])
+
+
+    def test_addAgain(self):
+        """Exercises that are removed and added again are back in their
+        old place, and still solved.
+
+        """
+        self.store.markSolved("alice", b"a")
+        self.store.remove(b"a")
+        self.store.add(b"a", u"A", u"Do a.")
+        self.assertEqual(self._identifiers("alice", True), [b"a"])
+        self.assertEqual(self._identifiers("bob", False), [b"a", b"b", b"c"])
+
+
+    def test_isSolved(self):
+        """Exercises are only solved once a user has solved them.
+
+        """
+        self.store.markSolved("alice", b"a")
+        self.assertTrue(self.store.isSolved("alice", b"a"))
+        self.assertFalse(self.store.isSolved("alice", b"b"))
+        self.assertFalse(self.store.isSolved("bob", b"a"))
+        self.assertFalse(self.store.isSolved("alice", b"x"))
+
+
+    def test_bitmaps(self):
+        """Solved exercises are kept in the given bitmaps, and exercises
+        added to the store are added to them.
+
+        """
+        bitmaps = solved.SolvedBitmaps([b"b"])
+        bitmaps.markSolved(b"alice", b"b")
+
+        self.store = store.ExerciseStore(bitmaps)
+        self.store.add(b"a", u"A", u"Do a.")
+        self.store.add(b"b", u"B", u"Do b.")
+        self.store.markSolved(b"alice", b"a")
+
+        self.assertEqual(bitmaps.solved(b"alice"), [b"b", b"a"])
+        self.assertEqual(self._identifiers(b"alice", True), [b"b", b"a"])
+
+
+    def test_rowsShared(self):
+        """Rows are made once, not for every query.
+
+        """
+        first = self.store.rows("alice", False)
+        second = self.store.rows("bob", False)
+        for a, b in zip(first, second):
+            self.assertIdentical(a, b)
+
+
+    def test_rowsEncoded(self):
+        """Rows are serialized ahead of time, the same way ``GetExercises``
+        would serialize them.
+
+        """
+        rows = self.store.rows("alice", False)
+        plain = [dict(row) for row in rows]
+        makeResponse = exercise.GetExercises.makeResponse
+        self.assertEqual(makeResponse({b"exercises": rows}, None),
+                         makeResponse({b"exercises": plain}, None))
+        for row in rows:
+            self.assertIsInstance(row, arguments.EncodedRow)
+
+
+
+class ExerciseLocatorTests(SynchronousTestCase):
+    """Tests for the AMP responders of the exercise store.
+
+    """
+    def setUp(self):
+        self.store = store.ExerciseStore()
+        self.store.add(b"a", u"A", u"Do a.")
+        self.store.add(b"b", u"B", u"Do b.")
+        self.store.markSolved("alice", b"b")
+
+        locator = store.ExerciseLocator(self.store, "alice")
+        server, self.client = amp.AMP(locator=locator), amp.AMP()
+        self.pump = connect(server, FakeTransport(server, True),
+                            self.client, FakeTransport(self.client, False))
+
+
+    def _call(self, command, **kwargs):
+        """Call a command, and get its result.
+
+        AMP drops the connection if an error arrives before there's an
+        errback for it, so the result is captured before flushing.
+
+        """
+        results = []
+        self.client.callRemote(command, **kwargs).addBoth(results.append)
+        self.pump.flush()
+        return results[0]
+
+
+    def test_getExercises(self):
+        """The user's solved or unsolved exercises can be listed.
+
+        """
+        result = self._call(exercise.GetExercises, solved=True)
+        self.assertEqual(result, {
+            b"exercises": [{b"identifier": b"b", b"title": u"B"}]
+        })
+
+        result = self._call(exercise.GetExercises, solved=False)
+        self.assertEqual(result, {
+            b"exercises": [{b"identifier": b"a", b"title": u"A"}]
+        })
+
+
+    def test_getExerciseDetails(self):
+        """The details of an exercise can be fetched, including whether
+        the user has solved it.
+
+        """
+        result = self._call(exercise.GetExerciseDetails, identifier=b"b")
+        self.assertEqual(result, {
+            b"title": u"B",
+            b"description": u"Do b.",
+            b"solved": True
+        })
+
+
+    def test_unknownExercise(self):
+        """Fetching the details of an unknown exercise fails with
+        ``UnknownExercise``.
+
+        """
+        failure = self._call(exercise.GetExerciseDetails, identifier=b"x")
+        self.assertTrue(failure.check(exercise.UnknownExercise))
@@ -7,7 +7,8 @@ packageName = "clarent"
 dependencies = [
     "twisted>=13.2.0",
     "txampext>=0.0.10",
-    "PyOpenSSL>=0.14"
+    "PyOpenSSL>=0.14",
+    "cryptography"
 ]
 
 import re
@@ -34,10 +35,15 @@ setup(name=packageName,
       author='Laurens Van Houtven',
       author_email='_@lvh.io',
 
-      packages=find_packages(),
+      packages=find_packages(exclude=["benchmarks"]),
       test_suite=packageName + ".test",
 
       install_requires=dependencies,
+      entry_points={
+          "console_scripts": [
+              "clarent-provision = clarent.provision:main"
+          ]
+      },
 
       cmdclass={'test': Tox},
       zip_safe=True,